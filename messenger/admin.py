@@ -1,7 +1,17 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+import hmac
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app, Response
 from flask_login import login_required, current_user
 from models import db, User
 from forms import AdminUserForm
+from cache import lookup_cache, fragment_cache
+from metrics import metrics
+from persistence import message_writer
+from fanout import fanout
+from codes import user_codes
+from receipts import receipts
+from flood import flood
+from attachments import attachments
+from storage import lock_stats
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -20,8 +30,21 @@ def admin_required(func):
 @login_required
 @admin_required
 def users_list():
-    users = User.query.order_by(User.joined_at.desc()).all()
-    return render_template('admin/users.html', users=users)
+    q = request.args.get('q', '').strip()
+    page = max(1, request.args.get('page', 1, type=int))
+    size = current_app.config['ADMIN_PAGE_SIZE']
+    # فقط ستون‌های جدول؛ بدون ساختن شیء ORM برای هر کاربر
+    query = db.session.query(User.id, User.username, User.email, User.code,
+                             User.is_admin, User.is_active, User.joined_at)
+    if q:
+        # جست‌وجوی پیشوندی به صورت بازه روی ایندکس یکتای code یا username
+        column = User.code if q.isdigit() else User.username
+        query = query.filter(column >= q, column < q + '\U0010ffff').order_by(column)
+    else:
+        query = query.order_by(User.joined_at.desc(), User.id.desc())
+    rows = query.offset((page - 1) * size).limit(size + 1).all()
+    return render_template('admin/users.html', users=rows[:size], has_more=len(rows) > size,
+                           page=page, q=q)
 
 @admin_bp.route('/users/<int:user_id>', methods=['GET', 'POST'])
 @login_required
@@ -35,6 +58,9 @@ def users_edit(user_id):
         user.is_admin = form.is_admin.data
         user.is_active = form.is_active.data
         db.session.commit()
+        lookup_cache.invalidate_user(user)
+        # نام کاربر در فهرست مخاطبان کش‌شده دیگران هم هست
+        fragment_cache.invalidate('friends')
         flash('User updated', 'info')
         return redirect(url_for('admin.users_list'))
     return render_template('admin/user_edit.html', form=form, user=user)
@@ -46,5 +72,50 @@ def users_deactivate(user_id):
     user = User.query.get_or_404(user_id)
     user.is_active = False
     db.session.commit()
+    # بدون حذف از کش همه پردازه‌ها، کاربر تا پایان TTL همچنان وارد شده باقی می‌ماند
+    lookup_cache.invalidate_user(user)
     flash('User deactivated', 'info')
     return redirect(url_for('admin.users_list'))
+
+@admin_bp.route('/cache')
+@login_required
+@admin_required
+def cache_stats():
+    return jsonify(dict(lookup_cache.stats(), fragments=fragment_cache.cache.stats()))
+
+@admin_bp.route('/metrics')
+def metrics_export():
+    # Prometheus با توکن Bearer می‌خواند؛ در غیر این صورت فقط ادمین واردشده
+    token = current_app.config['METRICS_TOKEN']
+    header = request.headers.get('Authorization', '')
+    if not (token and hmac.compare_digest(header, f'Bearer {token}')):
+        if not current_user.is_authenticated or not current_user.is_admin:
+            return Response('forbidden\n', status=403, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@metrics.collector
+def runtime_metrics():
+    """آمار صف write-behind، صف‌های پخش، قفل‌های SQLite و کش‌های جست‌وجو"""
+    yield ('messenger_writer_events_total', 'counter', 'Write-behind queue events.',
+           [({'event': name}, value) for name, value in sorted(message_writer.stats.items())])
+    yield ('messenger_writer_backlog', 'gauge', 'Rows waiting in the write-behind queue.',
+           [({}, message_writer.backlog)])
+    yield ('messenger_fanout_events_total', 'counter', 'Room broadcasts, deliveries and slow-consumer actions.',
+           [({'event': name}, value) for name, value in sorted(fanout.stats.items())])
+    yield ('messenger_fanout_backlog', 'gauge', 'Broadcasts waiting in per-room send queues.',
+           [({}, fanout.backlog)])
+    yield ('messenger_user_code_events_total', 'counter', 'User code allocations, reserved blocks and skips.',
+           [({'event': name}, value) for name, value in sorted(user_codes.stats.items())])
+    yield ('messenger_read_receipt_events_total', 'counter', 'Read reports, coalesced reports and batched writes.',
+           [({'event': name}, value) for name, value in sorted(receipts.stats.items())])
+    yield ('messenger_flood_events_total', 'counter', 'Socket messages allowed, rate limited or oversized, and flooding sockets disconnected.',
+           [({'event': name}, value) for name, value in sorted(flood.stats.items())])
+    yield ('messenger_attachment_events_total', 'counter', 'Attachment uploads, deduplicated blobs, bytes stored and thumbnails.',
+           [({'event': name}, value) for name, value in sorted(attachments.stats.items())])
+    yield ('messenger_db_lock_events_total', 'counter', 'SQLite lock retries and final failures.',
+           [({'event': name}, value) for name, value in sorted(lock_stats.items())])
+    caches = dict(lookup_cache.stats(), fragments=fragment_cache.cache.stats())
+    for field, kind in (('hits', 'counter'), ('misses', 'counter'), ('size', 'gauge')):
+        suffix = '_total' if kind == 'counter' else ''
+        yield (f'messenger_cache_{field}{suffix}', kind, f'Lookup cache {field}.',
+               [({'cache': name}, stats[field]) for name, stats in sorted(caches.items())])
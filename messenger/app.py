@@ -1,11 +1,34 @@
 import os
-from flask import Flask, render_template, redirect, url_for, flash, request, jsonify
+import threading
+from functools import wraps
+from flask import Flask, render_template, redirect, url_for, flash, request, jsonify, abort
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from flask_socketio import SocketIO, join_room, leave_room, emit
-from models import db, User, Room, Message, DirectMessage
+from flask_socketio import SocketIO, join_room, leave_room, emit, disconnect
+from models import db, User, Room, Message, DirectMessage, Conversation, canonical_dm_key, allocate_sequences
 from forms import RegisterForm, LoginForm, AddFriendForm
-from utils import bcrypt, hash_password, check_password
+from werkzeug.middleware.proxy_fix import ProxyFix
+from utils import passwords, hash_password, check_password, PasswordPoolBusy
+from ratelimit import RateLimiter
+from persistence import message_writer, WriteBackpressure
+from migrations import upgrade, seed_defaults, migrate_command, seed_command
+from storage import storage
+from search import search_index
+from presence import presence
+from fanout import fanout
+from assets import assets
+from receipts import receipts
+from attachments import attachments, AttachmentRejected
+from flood import flood
+from archive import archiver
+from metrics import metrics
+from cluster import socketio_queue_options, tag_session_ids, cluster_events
+from concurrency import configure_pool, async_mode
+from cache import lookup_cache, fragment_cache
+from codes import user_codes
+from admin import admin_bp
 from sqlalchemy import or_, and_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 from datetime import datetime
 import json
 
@@ -18,14 +41,75 @@ def create_app():
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'super-secret-key-2024')
     app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(app.instance_path, 'messenger.db')}"
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['HISTORY_PAGE_SIZE'] = 50
+    app.config['HISTORY_PAGE_MAX'] = 200
+    app.config['INBOX_PAGE_SIZE'] = 20
+    app.config['ADMIN_PAGE_SIZE'] = 50
+    # همگام‌سازی تفاضلی پس از اتصال دوباره: اندازه هر صفحه و بیشترین فاصله
+    # قابل جبران؛ فاصله بیشتر یعنی بارگذاری دوباره صفحه ارزان‌تر است
+    app.config['SYNC_PAGE_SIZE'] = 100
+    app.config['SYNC_MAX_GAP'] = 1000
+    # صف پیام مشترک بین پردازه‌ها (redis://... یا sqlite:///...) و شماره پردازه
+    app.config['SOCKETIO_MESSAGE_QUEUE'] = None
+    app.config['WORKER_ID'] = None
+    # gevent / eventlet / threading؛ None یعنی همان مدلی که monkey patch شده (بدون patch، threading)
+    app.config['SOCKETIO_ASYNC_MODE'] = None
+    # اندازه استخر نخ برای کارهای مسدودکننده در حالت ناهمگام
+    app.config['BLOCKING_POOL_SIZE'] = 16
+    # تعداد پراکسی‌های مورد اعتماد جلوی برنامه (X-Forwarded-For)؛ cluster.py آن را ۱ می‌کند
+    app.config['TRUSTED_PROXIES'] = 0
+    # محدودیت تلاش ورود: ظرفیت و نرخ پر شدن (در ثانیه) برای هر IP و هر شناسه
+    app.config['LOGIN_IP_BURST'] = 20
+    app.config['LOGIN_IP_RATE'] = 20 / 60
+    app.config['LOGIN_IDENT_BURST'] = 5
+    app.config['LOGIN_IDENT_RATE'] = 5 / 60
+
+    # بازنویسی تنظیمات از متغیرهای محیطی MESSENGER_*
+    app.config.from_prefixed_env('MESSENGER')
 
     # ایجاد پوشه instance
     os.makedirs(app.instance_path, exist_ok=True)
 
-    # مقداردهی اولیه افزونه‌ها
+    # مقداردهی اولیه افزونه‌ها؛ پروفایل ذخیره‌سازی باید پیش از ساخت engine تنظیم شود
+    storage.init_app(app)
     db.init_app(app)
-    bcrypt.init_app(app)
-    socketio.init_app(app, cors_allowed_origins="*")
+    storage.attach(app)
+    metrics.init_app(app)
+    passwords.init_app(app)
+    message_writer.init_app(app)
+    message_writer.before_flush(allocate_sequences)
+    # پس از allocate_sequences که conversation_key پیام‌های DM را پر می‌کند
+    message_writer.before_flush(attachments.claim_messages)
+    message_writer.on_flush(Conversation.apply_messages)
+    search_index.init_app(app)
+    message_writer.on_flush(search_index.index_messages)
+    lookup_cache.init_app(app)
+    user_codes.init_app(app)
+    fragment_cache.init_app(app)
+    assets.init_app(app)
+    flood.init_app(app)
+    configure_pool(app.config['BLOCKING_POOL_SIZE'])
+    # بسته‌های بزرگ‌تر را Engine.IO پیش از رسیدن به رویدادها رد می‌کند
+    socketio_options = {'cors_allowed_origins': "*", 'max_http_buffer_size': app.config['SOCKET_MAX_PAYLOAD']}
+    # انتخاب خودکار Flask-SocketIO بدون monkey patch هم gevent است و آنگاه نخ نویسنده پیام‌ها
+    # (که پخش پس از commit را انجام می‌دهد) بیرون از حلقه رویداد می‌ماند
+    socketio_options['async_mode'] = app.config['SOCKETIO_ASYNC_MODE'] or async_mode()
+    if app.config['SOCKETIO_MESSAGE_QUEUE']:
+        socketio_options.update(socketio_queue_options(app.config['SOCKETIO_MESSAGE_QUEUE']))
+    socketio.init_app(app, **socketio_options)
+    cluster_events.init_app(app, socketio)
+    presence.init_app(app, socketio)
+    fanout.init_app(app, socketio)
+    receipts.init_app(app, socketio)
+    attachments.init_app(app, socketio)
+    archiver.init_app(app, socketio)
+    if app.config['WORKER_ID'] is not None:
+        tag_session_ids(socketio.server, app.config['WORKER_ID'])
+    app.register_blueprint(admin_bp)
+    if app.config['TRUSTED_PROXIES']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
+    login_ip_limiter = RateLimiter(app.config['LOGIN_IP_RATE'], app.config['LOGIN_IP_BURST'])
+    login_ident_limiter = RateLimiter(app.config['LOGIN_IDENT_RATE'], app.config['LOGIN_IDENT_BURST'])
 
     # Flask-Login
     login_manager = LoginManager(app)
@@ -34,31 +118,16 @@ def create_app():
 
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        # هر رویداد سوکت کاربر را دوباره بارگذاری می‌کند؛ از کش خوانده می‌شود
+        user = lookup_cache.user(int(user_id))
+        if user is None or not user.is_active:
+            return None
+        return user
 
-    # ایجاد دیتابیس و داده‌های اولیه
-    with app.app_context():
-        db.create_all()
-        if Room.query.count() == 0:
-            rooms = [
-                Room(slug='general', title='💬 اتاق عمومی'),
-                Room(slug='random', title='🎮 اتاق متفرقه'),
-                Room(slug='help', title='❓ اتاق کمک')
-            ]
-            for room in rooms:
-                db.session.add(room)
-            db.session.commit()
-        
-        if not User.query.filter_by(username='admin').first():
-            admin_user = User(
-                username='admin',
-                email='admin@example.com',
-                password_hash=hash_password('admin123'),
-                code=User.generate_code(),
-                is_admin=True
-            )
-            db.session.add(admin_user)
-            db.session.commit()
+    # ساخت و به‌روزرسانی دیتابیس و داده‌های اولیه فرمان جدا دارند (flask migrate / flask seed)
+    # تا ساختن برنامه در هر پردازه، آزمون و فرمان CLI به دیتابیس و bcrypt دست نزند
+    app.cli.add_command(migrate_command)
+    app.cli.add_command(seed_command)
 
     # Routes
     @app.route('/')
@@ -89,14 +158,22 @@ def create_app():
                     flash('این ایمیل قبلاً ثبت شده است', 'error')
             else:
                 # ایجاد کاربر جدید
+                try:
+                    password_hash = hash_password(form.password.data)
+                except PasswordPoolBusy:
+                    flash('⏳ سرور مشغول است؛ لطفاً چند لحظه بعد دوباره تلاش کنید', 'error')
+                    return render_template('auth/register.html', form=form), 503
                 user = User(
                     username=form.username.data.strip(),
                     email=form.email.data.strip(),
-                    password_hash=hash_password(form.password.data),
-                    code=User.generate_code()
+                    password_hash=password_hash
                 )
-                db.session.add(user)
-                db.session.commit()
+                try:
+                    user_codes.add_user(user)
+                except IntegrityError:
+                    # ثبت‌نام هم‌زمان با همین نام کاربری یا ایمیل
+                    flash('این نام کاربری یا ایمیل قبلاً ثبت شده است', 'error')
+                    return render_template('auth/register.html', form=form)
                 
                 flash(f'🎉 حساب شما با موفقیت ایجاد شد! کد ۷ رقمی شما: <strong>{user.code}</strong>', 'success')
                 login_user(user)
@@ -113,11 +190,29 @@ def create_app():
         form = LoginForm()
         if form.validate_on_submit():
             ident = form.code_or_username.data.strip()
+            # رد ارزان تلاش‌های پشت‌سرهم پیش از هر کار bcrypt
+            if not (login_ip_limiter.allow(request.remote_addr) and login_ident_limiter.allow(ident.lower())):
+                flash('⏳ تلاش‌های ورود بیش از حد است؛ لطفاً کمی بعد دوباره تلاش کنید', 'error')
+                return render_template('auth/login.html', form=form), 429
+            
             user = User.query.filter(
                 (User.code == ident) | (User.username == ident)
             ).first()
             
-            if user and user.is_active and check_password(user.password_hash, form.password.data):
+            try:
+                valid = user is not None and user.is_active and check_password(user.password_hash, form.password.data)
+            except PasswordPoolBusy:
+                flash('⏳ سرور مشغول است؛ لطفاً چند لحظه بعد دوباره تلاش کنید', 'error')
+                return render_template('auth/login.html', form=form), 503
+            
+            if valid:
+                if passwords.needs_rehash(user.password_hash):
+                    # هزینه bcrypt تغییر کرده؛ هش با هزینه جدید جایگزین می‌شود (در شلوغی، ورود بعدی)
+                    try:
+                        user.password_hash = hash_password(form.password.data)
+                        db.session.commit()
+                    except PasswordPoolBusy:
+                        pass
                 login_user(user)
                 flash(f'👋 خوش آمدید {user.username}!', 'success')
                 return redirect(url_for('chat_dashboard'))
@@ -138,20 +233,23 @@ def create_app():
     @login_required
     def chat_dashboard():
         """داشبورد اصلی کاربر"""
-        # پیدا کردن تمام کاربرانی که با آنها چت داشته‌ایم
-        sent_conversations = db.session.query(DirectMessage.receiver_id).filter_by(sender_id=current_user.id).distinct().all()
-        received_conversations = db.session.query(DirectMessage.sender_id).filter_by(receiver_id=current_user.id).distinct().all()
+        # کاربرانی که با آنها چت داشته‌ایم با خوانده‌نشده از شمارنده مکالمه، بدون شمارش پیام‌ها
+        rows = Conversation.friend_rows(current_user.id)
+        online_ids = presence.online_user_ids(uid for uid, _ in rows)
         
-        all_conversation_ids = set()
-        for conv in sent_conversations:
-            all_conversation_ids.add(conv[0])
-        for conv in received_conversations:
-            all_conversation_ids.add(conv[0])
+        # فهرست مخاطبان و اتاق‌ها فقط وقتی داده‌شان عوض شود دوباره رندر می‌شوند
+        def render_friends():
+            users = {u.id: u for u in User.query.filter(User.id.in_([uid for uid, _ in rows]))}
+            return render_template('chat/_friend_list.html', friends=[users[uid] for uid, _ in rows],
+                                   unread=dict(rows), online_ids=online_ids)
+        friend_list = fragment_cache.render(
+            'friends', (current_user.id, tuple((uid, unread, uid in online_ids) for uid, unread in rows)),
+            render_friends)
+        room_list = fragment_cache.render(
+            'rooms', tuple(db.session.query(db.func.count(Room.id), db.func.max(Room.id)).one()),
+            lambda: render_template('chat/_room_list.html', rooms=Room.query.all()))
         
-        friends = User.query.filter(User.id.in_(all_conversation_ids)).all() if all_conversation_ids else []
-        rooms = Room.query.all()
-        
-        return render_template('chat/dashboard.html', friends=friends, rooms=rooms)
+        return render_template('chat/dashboard.html', friend_list=friend_list, room_list=room_list)
 
     @app.route('/add_friend', methods=['GET', 'POST'])
     @login_required
@@ -190,15 +288,36 @@ def create_app():
             flash('❌ نمی‌توانید با خودتان چت کنید', 'error')
             return redirect(url_for('add_friend'))
         
-        # گرفتن تاریخچه پیام‌ها
-        history = DirectMessage.query.filter(
-            ((DirectMessage.sender_id == current_user.id) & (DirectMessage.receiver_id == friend.id)) |
-            ((DirectMessage.sender_id == friend.id) & (DirectMessage.receiver_id == current_user.id))
-        ).order_by(DirectMessage.created_at.asc()).limit(300).all()
+        key = canonical_dm_key(current_user.id, friend.id)
+        
+        # پیام‌ها با گزارش high-water mark کلاینت (رویداد read) خوانده می‌شوند، نه با باز کردن صفحه.
+        # last_seq پیش از تاریخچه خوانده می‌شود؛ تکرار احتمالی را کلاینت با data-seq حذف می‌کند
+        conversation = Conversation.query.filter_by(key=key).first()
+        last_seq = conversation.last_seq if conversation else 0
+        friend_read_seq = conversation.read_seq_for(friend.id) if conversation else 0
+        
+        # گرفتن آخرین صفحه تاریخچه؛ صفحات قدیمی‌تر از chat_dm_history خوانده می‌شوند
+        query = DirectMessage.query.filter_by(conversation_key=key)
+        history, has_more = history_page(query, DirectMessage, None, app.config['HISTORY_PAGE_SIZE'], key)
         
-        room_id = f"dm_{min(current_user.id, friend.id)}_{max(current_user.id, friend.id)}"
+        room_id = canonical_dm_room(current_user.id, friend.id)
         
-        return render_template('chat/dm.html', friend=friend, history=history, dm_room=room_id)
+        return render_template('chat/dm.html', friend=friend, history=history, dm_room=room_id,
+                               has_more=has_more, last_seq=last_seq, friend_read_seq=friend_read_seq)
+
+    @app.route('/dm/<code>/history')
+    @login_required
+    def chat_dm_history(code):
+        """صفحه‌بندی تاریخچه چت خصوصی به عقب با before_id"""
+        friend = User.query.filter_by(code=code).first_or_404()
+        query = DirectMessage.query.filter_by(conversation_key=canonical_dm_key(current_user.id, friend.id))
+        history, has_more = history_page(query, DirectMessage, *history_args(),
+                                         canonical_dm_key(current_user.id, friend.id))
+        
+        return jsonify({
+            'messages': [dm_message_json(m, friend) for m in history],
+            'next_before_id': history[0].id if history and has_more else None
+        })
 
     @app.route('/profile')
     @login_required
@@ -210,48 +329,37 @@ def create_app():
     @login_required
     def my_messages():
         """صفحه پیام‌های من"""
-        # پیام‌های دریافتی
-        received_messages = DirectMessage.query.filter_by(receiver_id=current_user.id).order_by(DirectMessage.created_at.desc()).all()
-        
-        # پیام‌های ارسالی
-        sent_messages = DirectMessage.query.filter_by(sender_id=current_user.id).order_by(DirectMessage.created_at.desc()).all()
-        
-        # گروه‌بندی بر اساس کاربر
-        conversations = {}
-        
-        for msg in received_messages:
-            other_user = msg.sender
-            if other_user.id not in conversations:
-                conversations[other_user.id] = {
-                    'user': other_user,
-                    'last_message': msg,
-                    'unread_count': 0,
-                    'messages': []
-                }
-            conversations[other_user.id]['messages'].append(msg)
-        
-        for msg in sent_messages:
-            other_user = msg.receiver
-            if other_user.id not in conversations:
-                conversations[other_user.id] = {
-                    'user': other_user,
-                    'last_message': msg,
-                    'unread_count': 0,
-                    'messages': []
-                }
-            conversations[other_user.id]['messages'].append(msg)
-        
-        # مرتب‌سازی بر اساس آخرین پیام
-        sorted_conversations = sorted(
-            conversations.values(), 
-            key=lambda x: x['last_message'].created_at, 
-            reverse=True
-        )
+        # یک ردیف ستونی برای هر مکالمه در این صفحه، مرتب بر اساس آخرین فعالیت
+        page = max(1, request.args.get('page', 1, type=int))
+        conversations, has_more = Conversation.inbox_page(current_user.id, page, app.config['INBOX_PAGE_SIZE'])
+        sent_count, received_count = Conversation.totals_for(current_user.id)
         
         return render_template('chat/my_messages.html', 
-                             conversations=sorted_conversations,
-                             received_count=len(received_messages),
-                             sent_count=len(sent_messages))
+                             conversations=conversations,
+                             received_count=received_count,
+                             sent_count=sent_count,
+                             page=page, has_more=has_more)
+
+    @app.route('/search')
+    @login_required
+    def search_messages():
+        """جست‌وجو در پیام‌های اتاق‌ها و پیام‌های خصوصی خود کاربر"""
+        q = request.args.get('q', '').strip()
+        page = max(1, request.args.get('page', 1, type=int))
+        room = None
+        friend = None
+        room_id = None
+        conversation_key = None
+        if request.args.get('room'):
+            room = Room.query.filter_by(slug=request.args['room']).first_or_404()
+            room_id = room.id
+        elif request.args.get('with'):
+            friend = User.query.filter_by(code=request.args['with']).first_or_404()
+            conversation_key = canonical_dm_key(current_user.id, friend.id)
+        
+        hits, has_more = search_index.search(current_user.id, q, page, room_id, conversation_key) if q else ([], False)
+        return render_template('chat/search.html', q=q, hits=hits, page=page, has_more=has_more,
+                               room=room, friend=friend)
 
     @app.route('/rooms')
     @login_required
@@ -265,58 +373,257 @@ def create_app():
     def chat_room(slug):
         """صفحه اتاق چت عمومی"""
         room = Room.query.filter_by(slug=slug).first_or_404()
-        history = Message.query.filter_by(room_id=room.id).order_by(Message.created_at.asc()).limit(200).all()
-        return render_template('chat/room.html', room=room, history=history)
+        query = Message.query.filter_by(room_id=room.id).options(joinedload(Message.user))
+        history, has_more = history_page(query, Message, None, app.config['HISTORY_PAGE_SIZE'], room.id)
+        return render_template('chat/room.html', room=room, history=history, has_more=has_more,
+                               last_seq=room.last_seq)
+
+    @app.route('/r/<slug>/history')
+    @login_required
+    def chat_room_history(slug):
+        """صفحه‌بندی تاریخچه اتاق به عقب با before_id"""
+        room = Room.query.filter_by(slug=slug).first_or_404()
+        query = Message.query.filter_by(room_id=room.id).options(joinedload(Message.user))
+        history, has_more = history_page(query, Message, *history_args(), room.id)
+        
+        return jsonify({
+            'messages': [room_message_json(m) for m in history],
+            'next_before_id': history[0].id if history and has_more else None
+        })
 
     # Helper functions
     def canonical_dm_room(a_id, b_id):
-        return f"dm_{min(a_id, b_id)}_{max(a_id, b_id)}"
+        return f"dm_{canonical_dm_key(a_id, b_id)}"
+
+    def room_message_json(m):
+        return {
+            'id': m.id,
+            # پیام‌های بایگانی‌شده پیش از مهاجرت ۵ شماره ترتیبی ندارند
+            'seq': getattr(m, 'seq', None),
+            'user': m.user.username,
+            'msg': m.content,
+            'attachment': attachments.describe(getattr(m, 'attachment', None)),
+            'ts': m.created_at.strftime('%H:%M'),
+            'user_id': m.user_id
+        }
+
+    def dm_message_json(m, friend):
+        mine = m.sender_id == current_user.id
+        return {
+            'id': m.id,
+            'seq': getattr(m, 'seq', None),
+            'from_code': current_user.code if mine else friend.code,
+            'from_name': current_user.username if mine else friend.username,
+            'msg': m.content,
+            'attachment': attachments.describe(getattr(m, 'attachment', None)),
+            'ts': m.created_at.strftime('%H:%M'),
+            'date': m.created_at.strftime('%Y/%m/%d')
+        }
+
+    def history_args():
+        """خواندن before_id و limit از query string"""
+        before_id = request.args.get('before_id', type=int)
+        limit = request.args.get('limit', app.config['HISTORY_PAGE_SIZE'], type=int)
+        return before_id, max(1, min(limit, app.config['HISTORY_PAGE_MAX']))
+
+    def history_page(query, model, before_id, limit, scope):
+        """صفحه‌بندی keyset روی (created_at, id)؛ خروجی از قدیمی به جدید است
+
+        وقتی جدول داغ صفحه را پر نمی‌کند، ادامه آن از بایگانی (scope همان
+        room_id یا conversation_key است) خوانده و با ردیف‌های داغ ادغام می‌شود.
+        """
+        kind = 'd' if model is DirectMessage else 'm'
+        cursor = None
+        if before_id is not None:
+            cursor = query.filter(model.id == before_id).first() or archiver.get(kind, scope, before_id)
+            if cursor is None:
+                abort(404)
+            # شرط بازه روی created_at از ایندکس ترکیبی استفاده می‌کند
+            query = query.filter(
+                model.created_at <= cursor.created_at,
+                or_(model.created_at < cursor.created_at, model.id < cursor.id)
+            )
+        
+        rows = query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1).all()
+        # فقط پیام‌های بایگانی‌شده جدیدتر از آخرین ردیف داغ لازم‌اند
+        floor = (rows[limit].created_at, rows[limit].id) if len(rows) > limit else None
+        before = (cursor.created_at, cursor.id) if cursor is not None else None
+        archived = archiver.history(kind, scope, before, floor, limit + 1)
+        if archived:
+            rows = sorted(rows + archived, key=lambda m: (m.created_at, m.id), reverse=True)[:limit + 1]
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+        return rows, has_more
+
+    def write_ack(pending, broadcast=True):
+        """پاسخ ack؛ در حالت ack پایدار تا commit شدن ردیف صبر می‌کند
+
+        broadcast=False یعنی صف پخش اتاق پر بود و اعضا پیام را فقط با sync می‌گیرند.
+        """
+        if not app.config['MESSAGE_ACK_DURABLE']:
+            ack = {'ok': True}
+        elif not pending.wait(app.config['MESSAGE_ACK_TIMEOUT']):
+            return {'ok': False, 'error': 'not_durable'}
+        else:
+            ack = {'ok': True, 'id': pending.id, 'seq': pending.seq}
+        if not broadcast:
+            ack['broadcast'] = False
+        return ack
+
+    def live_broadcast(event, payload, room):
+        """(on_commit، send) برای پخش پیام زنده؛ send پس از پذیرفته شدن در صف صدا زده می‌شود
+
+        به‌طور پیش‌فرض پیام بی‌درنگ و بدون seq با یک key پخش می‌شود و پس از commit
+        رویداد {event}_saved با همان key و id و seq می‌آید. با MESSAGE_BROADCAST_AFTER_COMMIT
+        یا در حالت نوشتن همگام فقط یک پخش پس از commit با id و seq انجام می‌شود.
+        send خروجی fanout.emit را برمی‌گرداند؛ اگر پخش پس از commit دور ریخته شود
+        فرستنده رویداد broadcast_dropped می‌گیرد تا sync کند.
+        """
+        sid = request.sid
+        
+        def deliver(name, data):
+            if not fanout.emit(name, data, room):
+                socketio.emit('broadcast_dropped', {'room': room}, to=sid)
+        
+        if app.config['MESSAGE_BROADCAST_AFTER_COMMIT'] or not app.config['MESSAGE_WRITE_BEHIND']:
+            def on_commit(pending):
+                payload.update(id=pending.id, seq=pending.seq)
+                deliver(event, payload)
+            return on_commit, lambda: True
+        
+        payload['key'] = os.urandom(8).hex()
+        
+        def on_commit(pending):
+            deliver(f'{event}_saved', {'key': payload['key'], 'id': pending.id, 'seq': pending.seq})
+        return on_commit, lambda: fanout.emit(event, payload, room)
+
+    def authenticated_only(handler):
+        """قطع اتصال سوکت کاربرانی که خارج شده یا غیرفعال شده‌اند"""
+        @wraps(handler)
+        def wrapper(*args, **kwargs):
+            if not current_user.is_authenticated:
+                disconnect()
+                return
+            presence.touch(request.sid)
+            return handler(*args, **kwargs)
+        return wrapper
 
     # Socket.IO events
+    def dm_room_for(data):
+        """نام اتاق DM از friend_id رویداد یا None"""
+        try:
+            return canonical_dm_room(current_user.id, int(data.get('friend_id')))
+        except (TypeError, ValueError):
+            return None
+
     @socketio.on('connect')
+    @metrics.socket_event
     def on_connect():
         if current_user.is_authenticated:
+            presence.connect(request.sid, current_user.id, current_user.username)
             emit('status', {'msg': f'{current_user.username} connected'})
 
+    @socketio.on('disconnect')
+    @metrics.socket_event
+    def on_disconnect(*args):
+        presence.disconnect(request.sid)
+        flood.forget(request.sid)
+        fanout.forget(request.sid)
+
+    @socketio.on('fanout_ack')
+    @metrics.socket_event
+    def handle_fanout_ack(n=0):
+        """تأیید probeهای پخش اتاق؛ پنجره ارسال این اتصال را جلو می‌برد"""
+        try:
+            fanout.ack(request.sid, int(n))
+        except (TypeError, ValueError):
+            pass
+
+    @socketio.on('heartbeat')
+    @metrics.socket_event
+    @authenticated_only
+    def handle_heartbeat(data=None):
+        pass
+
+    @socketio.on('typing')
+    @metrics.socket_event
+    @authenticated_only
+    def handle_typing(data):
+        room = data.get('room') or dm_room_for(data)
+        if room:
+            presence.typing(request.sid, room, bool(data.get('typing', True)))
+
     @socketio.on('join')
+    @metrics.socket_event
+    @authenticated_only
     def handle_join(data):
         slug = data.get('room')
         if not slug:
             return
         join_room(slug)
-        emit('status', {'msg': f'{current_user.username} joined'}, room=slug)
+        # حضور اعضا به صورت تفاضل دوره‌ای پخش می‌شود؛ تازه‌وارد وضعیت کامل را می‌گیرد
+        presence.join(request.sid, slug)
+        emit('presence', presence.snapshot(slug))
 
     @socketio.on('leave')
+    @metrics.socket_event
+    @authenticated_only
     def handle_leave(data):
         slug = data.get('room')
         if not slug:
             return
         leave_room(slug)
-        emit('status', {'msg': f'{current_user.username} left'}, room=slug)
+        presence.leave(request.sid, slug)
 
     @socketio.on('message')
+    @metrics.socket_event
+    @authenticated_only
     def handle_message(data):
         slug = data.get('room')
         content = (data.get('msg') or '').strip()
-        if not slug or not content:
+        if not slug or not (content or data.get('attachment_id')):
             return
+        rejected = flood.check(request.sid, current_user.id, content)
+        if rejected is not None:
+            return rejected
         
-        room = Room.query.filter_by(slug=slug).first()
-        if not room:
+        room_id = lookup_cache.room_id(slug)
+        if room_id is None:
             return
+        rejected = flood.check_room(request.sid, slug)
+        if rejected is not None:
+            return rejected
+        if fanout.saturated(slug):
+            return {'ok': False, 'error': 'busy'}
+        try:
+            attachment = attachments.resolve(data.get('attachment_id'), current_user.id, 'm', str(room_id))
+        except AttachmentRejected:
+            return {'ok': False, 'error': 'bad_attachment'}
         
-        msg = Message(room_id=room.id, user_id=current_user.id, content=content)
-        db.session.add(msg)
-        db.session.commit()
-        
-        emit('message', {
+        now = datetime.utcnow()
+        msg = Message(room_id=room_id, user_id=current_user.id, content=content, created_at=now,
+                      attachment_id=attachment.id if attachment else None)
+        payload = {
             'user': current_user.username,
             'msg': content,
-            'ts': msg.created_at.strftime('%H:%M'),
+            'attachment': attachments.describe(attachment),
+            'ts': now.strftime('%H:%M'),
             'user_id': current_user.id
-        }, room=slug)
+        }
+        
+        # ذخیره و ارسال به اعضا هر دو در پس‌زمینه انجام می‌شوند؛ اگر صف اتاق پر شود
+        # fanout آن را ثبت می‌کند و اعضا پیام را با sync می‌گیرند
+        on_commit, send = live_broadcast('message', payload, slug)
+        try:
+            pending = message_writer.submit(msg, on_commit=on_commit)
+        except WriteBackpressure:
+            return {'ok': False, 'error': 'busy'}
+        return write_ack(pending, send())
 
     @socketio.on('dm_join')
+    @metrics.socket_event
+    @authenticated_only
     def handle_dm_join(data):
         friend_id = data.get('friend_id')
         if friend_id is None:
@@ -329,8 +636,12 @@ def create_app():
         
         room = canonical_dm_room(current_user.id, friend_id)
         join_room(room)
+        presence.join(request.sid, room)
+        emit('presence', presence.snapshot(room))
 
     @socketio.on('dm_leave')
+    @metrics.socket_event
+    @authenticated_only
     def handle_dm_leave(data):
         friend_id = data.get('friend_id')
         if friend_id is None:
@@ -343,41 +654,156 @@ def create_app():
         
         room = canonical_dm_room(current_user.id, friend_id)
         leave_room(room)
+        presence.leave(request.sid, room)
 
     @socketio.on('dm')
+    @metrics.socket_event
+    @authenticated_only
     def handle_dm(data):
         to_code = data.get('to')
         content = (data.get('msg') or '').strip()
-        if not to_code or not content:
+        if not to_code or not (content or data.get('attachment_id')):
             return
+        rejected = flood.check(request.sid, current_user.id, content)
+        if rejected is not None:
+            return rejected
         
-        friend = User.query.filter_by(code=to_code).first()
-        if not friend or friend.id == current_user.id:
+        friend_id = lookup_cache.user_id_by_code(to_code)
+        if friend_id is None or friend_id == current_user.id:
             return
+        room = canonical_dm_room(current_user.id, friend_id)
+        rejected = flood.check_room(request.sid, room)
+        if rejected is not None:
+            return rejected
+        if fanout.saturated(room):
+            return {'ok': False, 'error': 'busy'}
+        try:
+            attachment = attachments.resolve(data.get('attachment_id'), current_user.id, 'd',
+                                             canonical_dm_key(current_user.id, friend_id))
+        except AttachmentRejected:
+            return {'ok': False, 'error': 'bad_attachment'}
         
+        now = datetime.utcnow()
         msg = DirectMessage(
             sender_id=current_user.id, 
-            receiver_id=friend.id, 
-            content=content
+            receiver_id=friend_id, 
+            content=content,
+            created_at=now,
+            attachment_id=attachment.id if attachment else None
         )
-        db.session.add(msg)
-        db.session.commit()
-        
-        room = canonical_dm_room(current_user.id, friend.id)
-        emit('dm', {
+        payload = {
             'from_code': current_user.code,
             'from_name': current_user.username,
             'msg': content,
-            'ts': msg.created_at.strftime('%H:%M'),
-            'date': msg.created_at.strftime('%Y/%m/%d')
-        }, room=room)
+            'attachment': attachments.describe(attachment),
+            'ts': now.strftime('%H:%M'),
+            'date': now.strftime('%Y/%m/%d')
+        }
+        
+        on_commit, send = live_broadcast('dm', payload, room)
+        try:
+            pending = message_writer.submit(msg, on_commit=on_commit)
+        except WriteBackpressure:
+            return {'ok': False, 'error': 'busy'}
+        return write_ack(pending, send())
+
+    @socketio.on('read')
+    @metrics.socket_event
+    @authenticated_only
+    def handle_read(data):
+        """گزارش بزرگ‌ترین seq دیده‌شده در DM؛ نوشتن و رویداد read دسته‌ای در receipts انجام می‌شود"""
+        try:
+            friend_id = int(data.get('friend_id'))
+            seq = int(data.get('seq'))
+        except (TypeError, ValueError):
+            return {'ok': False, 'error': 'bad_request'}
+        if seq <= 0 or friend_id == current_user.id or lookup_cache.user(friend_id) is None:
+            return {'ok': False, 'error': 'not_found'}
+        receipts.report(canonical_dm_key(current_user.id, friend_id), current_user.id, seq,
+                        canonical_dm_room(current_user.id, friend_id))
+        return {'ok': True}
+
+    @socketio.on('sync')
+    @metrics.socket_event
+    @authenticated_only
+    def handle_sync(data):
+        """پیام‌های پس از آخرین seq دیده‌شده کلاینت؛ پس از هر اتصال دوباره فراخوانی می‌شود
+
+        پاسخ صفحه‌بندی‌شده است (has_more) و کلاینت با last_seq پاسخ ادامه می‌دهد.
+        اگر فاصله از SYNC_MAX_GAP بیشتر باشد یا بخشی از آن بایگانی شده باشد
+        reset برمی‌گردد تا صفحه دوباره بارگذاری شود.
+        """
+        try:
+            after = max(int(data.get('after') or 0), 0)
+        except (TypeError, ValueError):
+            return {'ok': False, 'error': 'bad_request'}
+        
+        if data.get('room'):
+            room_id = lookup_cache.room_id(data['room'])
+            if room_id is None:
+                return {'ok': False, 'error': 'not_found'}
+            last_seq = db.session.query(Room.last_seq).filter_by(id=room_id).scalar()
+            query = Message.query.filter(Message.room_id == room_id, Message.seq > after) \
+                .options(joinedload(Message.user)).order_by(Message.seq)
+            serialize = room_message_json
+        else:
+            try:
+                friend = lookup_cache.user(int(data.get('friend_id')))
+            except (TypeError, ValueError):
+                friend = None
+            if friend is None or friend.id == current_user.id:
+                return {'ok': False, 'error': 'not_found'}
+            key = canonical_dm_key(current_user.id, friend.id)
+            last_seq = db.session.query(Conversation.last_seq).filter_by(key=key).scalar() or 0
+            query = DirectMessage.query.filter(DirectMessage.conversation_key == key,
+                                               DirectMessage.seq > after).order_by(DirectMessage.seq)
+            serialize = lambda m: dm_message_json(m, friend)
+        
+        if after > last_seq or last_seq - after > app.config['SYNC_MAX_GAP']:
+            return {'ok': True, 'reset': True, 'last_seq': last_seq}
+        if after == last_seq:
+            return {'ok': True, 'messages': [], 'has_more': False, 'last_seq': last_seq}
+        
+        limit = app.config['SYNC_PAGE_SIZE']
+        rows = query.limit(limit + 1).all()
+        # پیام‌های این فاصله بایگانی شده‌اند و در جدول نیستند؛ بدون reset از دست می‌روند
+        if not rows or rows[0].seq > after + 1:
+            return {'ok': True, 'reset': True, 'last_seq': last_seq}
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return {
+            'ok': True,
+            'messages': [serialize(m) for m in rows],
+            'has_more': has_more,
+            'last_seq': rows[-1].seq
+        }
 
     return app
 
-# ایجاد برنامه
-app = create_app()
+_app = None
+_app_lock = threading.Lock()
+
+def get_app():
+    """برنامه سراسری که در اولین استفاده ساخته می‌شود"""
+    global _app
+    if _app is None:
+        with _app_lock:
+            if _app is None:
+                _app = create_app()
+    return _app
+
+def __getattr__(name):
+    # from app import app برنامه را فقط هنگام نیاز می‌سازد؛ import ماژول هزینه‌ای ندارد
+    if name == 'app':
+        return get_app()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 if __name__ == '__main__':
+    app = get_app()
+    with app.app_context():
+        upgrade()
+        seed_defaults()
+    assets.build()
     print("🚀 پیام‌رسان در حال اجرا است...")
     print("🌐 آدرس: http://localhost:5000")
     print("👤 کاربر پیش‌فرض: admin / admin123")
@@ -0,0 +1,342 @@
+import gzip
+import json
+import logging
+import os
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+from cache import LRUCache
+from models import db, User, Room, Message, DirectMessage, Conversation, ArchiveSegment, Attachment
+from storage import retry_on_lock
+
+try:
+    import fcntl
+except ImportError:  # ویندوز؛ قفل بین پردازه‌ها در دسترس نیست
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# نوع بایگانی -> (مدل، ستون محدوده)
+_SOURCES = {
+    'm': (Message, Message.room_id),
+    'd': (DirectMessage, DirectMessage.conversation_key),
+}
+
+def _key(msg):
+    return msg.created_at, msg.id
+
+class ArchivedMessage:
+    """پیام خوانده‌شده از بایگانی با همان ستون‌های Message یا DirectMessage
+
+    شیء ORM نیست تا هرگز وارد نشست نشود؛ برای پیام اتاق، user جداگانه پر می‌شود.
+    """
+    archived = True
+
+    def __init__(self, fields):
+        self.__dict__.update(fields)
+
+def _encode(obj, columns):
+    record = {}
+    for name in columns:
+        value = getattr(obj, name)
+        record[name] = value.isoformat() if isinstance(value, datetime) else value
+    return record
+
+def _decode(record):
+    record = dict(record)
+    if record.get('created_at'):
+        record['created_at'] = datetime.fromisoformat(record['created_at'])
+    return ArchivedMessage(record)
+
+class Archiver:
+    """انتقال پیام‌های قدیمی از جدول‌های داغ به فایل‌های فشرده بایگانی
+
+    هر دسته (ARCHIVE_BATCH_SIZE پیام از یک اتاق یا مکالمه) ابتدا به فایل
+    ماهانه‌اش افزوده و fsync می‌شود، سپس ثبت تکه در archive_segment و حذف
+    ردیف‌ها در یک تراکنش کوتاه commit می‌شود. اگر commit شکست بخورد فقط
+    بایت‌های بی‌مرجع در انتهای فایل می‌مانند. پیام‌های بایگانی‌شده در نمایه
+    جست‌وجو می‌مانند و نتیجه‌هایشان با get_many از بایگانی خوانده می‌شود.
+    DMهای خوانده‌نشده و آخرین پیام هر مکالمه در جدول داغ می‌مانند.
+    """
+
+    def __init__(self, app=None, socketio=None):
+        self.app = None
+        self.socketio = None
+        # تکه‌ها تغییرناپذیرند؛ رکوردهای خام برای صفحه‌های پشت سر هم کش می‌شوند
+        self._segments = LRUCache(maxsize=64, ttl=600)
+        self._task_pid = None
+        if app is not None:
+            self.init_app(app, socketio)
+
+    def init_app(self, app, socketio=None):
+        app.config.setdefault('ARCHIVE_DIR', os.path.join(app.instance_path, 'archive'))
+        app.config.setdefault('ARCHIVE_AFTER_DAYS', 180)
+        app.config.setdefault('ARCHIVE_BATCH_SIZE', 1000)
+        # صفحه‌های آزادشده در هر گام incremental_vacuum
+        app.config.setdefault('ARCHIVE_VACUUM_PAGES', 1000)
+        # فاصله اجرای خودکار بر حسب ثانیه؛ 0 یعنی فقط از طریق flask archive
+        app.config.setdefault('ARCHIVE_INTERVAL', 0)
+        self.app = app
+        self.socketio = socketio
+        app.extensions['archive'] = self
+        app.cli.add_command(archive_command)
+        # در حالت چند پردازه‌ای فقط پردازه صفر زمان‌بندی را اجرا می‌کند
+        if app.config['ARCHIVE_INTERVAL'] and socketio is not None \
+                and app.config.get('WORKER_ID') in (None, 0):
+            app.before_request(self._ensure_started)
+
+    def _path(self, kind, scope, month):
+        return os.path.join(current_app.config['ARCHIVE_DIR'], kind, scope, f'{month}.jsonl.gz')
+
+    # --- بایگانی --------------------------------------------------------
+
+    def run(self, days=None):
+        """بایگانی پیام‌های قدیمی‌تر از days روز و آزادسازی فضا؛ خروجی گزارش"""
+        config = current_app.config
+        days = config['ARCHIVE_AFTER_DAYS'] if days is None else days
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        report = {'rows': 0, 'segments': 0, 'raw_bytes': 0, 'stored_bytes': 0, 'pages_freed': 0}
+        with self._exclusive() as acquired:
+            if not acquired:
+                report['skipped'] = True
+                return report
+            for (room_id,) in db.session.query(Room.id).all():
+                self._archive_scope('m', room_id, cutoff, report)
+            for key, last_id in db.session.query(Conversation.key, Conversation.last_message_id).all():
+                self._archive_scope('d', key, cutoff, report, keep_id=last_id)
+            report['pages_freed'] = self.reclaim()
+        return report
+
+    @contextmanager
+    def _exclusive(self):
+        """جلوگیری از افزودن همزمان دو اجرا به یک فایل"""
+        root = current_app.config['ARCHIVE_DIR']
+        os.makedirs(root, exist_ok=True)
+        with open(os.path.join(root, '.lock'), 'w') as lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    yield False
+                    return
+            yield True
+
+    def _archive_scope(self, kind, scope, cutoff, report, keep_id=None):
+        model, column = _SOURCES[kind]
+        columns = [c.name for c in model.__table__.columns]
+        batch = current_app.config['ARCHIVE_BATCH_SIZE']
+        while True:
+            query = model.query.filter(column == scope, model.created_at < cutoff)
+            if kind == 'd':
+                query = query.filter(DirectMessage.is_read.is_(True))
+                if keep_id is not None:
+                    query = query.filter(DirectMessage.id != keep_id)
+            rows = query.order_by(model.created_at, model.id).limit(batch).all()
+            if not rows:
+                return
+            self._move(kind, str(scope), model, rows, columns, report)
+            if len(rows) < batch:
+                return
+
+    def _move(self, kind, scope, model, rows, columns, report):
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(row.created_at.strftime('%Y-%m'), []).append(row)
+        segments = [self._append(kind, scope, month, group, columns)
+                    for month, group in by_month.items()]
+        ids = [row.id for row in rows]
+
+        def commit():
+            db.session.add_all(segments)
+            model.query.filter(model.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+        retry_on_lock(commit)
+
+        report['rows'] += len(rows)
+        report['segments'] += len(segments)
+        report['raw_bytes'] += sum(s.raw_bytes for s in segments)
+        report['stored_bytes'] += sum(s.length for s in segments)
+        db.session.expunge_all()
+
+    def _append(self, kind, scope, month, group, columns):
+        """افزودن یک عضو gzip به انتهای فایل ماه؛ gzip چند عضوی هم معتبر است"""
+        raw = ''.join(json.dumps(_encode(row, columns), ensure_ascii=False) + '\n'
+                      for row in group).encode('utf-8')
+        data = gzip.compress(raw, mtime=0)
+        path = self._path(kind, scope, month)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'ab') as f:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        ids = [row.id for row in group]
+        return ArchiveSegment(
+            kind=kind, scope=scope, month=month, offset=offset, length=len(data),
+            count=len(group), raw_bytes=len(raw), first_id=min(ids), last_id=max(ids),
+            first_at=group[0].created_at, last_at=group[-1].created_at
+        )
+
+    def reclaim(self):
+        """آزادسازی صفحه‌های خالی با incremental_vacuum در گام‌های کوتاه
+
+        فقط وقتی auto_vacuum=INCREMENTAL است کار می‌کند؛ دیتابیس‌های قدیمی
+        یک بار با flask archive --full-vacuum تبدیل می‌شوند.
+        """
+        if db.engine.dialect.name != 'sqlite':
+            return 0
+        if db.session.execute(text('PRAGMA auto_vacuum')).scalar() != 2:
+            return 0
+        step = current_app.config['ARCHIVE_VACUUM_PAGES']
+        freed = 0
+        free = db.session.execute(text('PRAGMA freelist_count')).scalar()
+
+        def vacuum_step():
+            db.session.execute(text(f'PRAGMA incremental_vacuum({int(step)})'))
+            db.session.commit()
+        while free:
+            retry_on_lock(vacuum_step)
+            remaining = db.session.execute(text('PRAGMA freelist_count')).scalar()
+            if remaining >= free:
+                break
+            freed += free - remaining
+            free = remaining
+        return freed
+
+    def full_vacuum(self):
+        """VACUUM کامل با تبدیل به auto_vacuum=INCREMENTAL؛ در زمان کم‌باری اجرا شود"""
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.exec_driver_sql('PRAGMA auto_vacuum=INCREMENTAL')
+            conn.exec_driver_sql('VACUUM')
+
+    # --- خواندن ---------------------------------------------------------
+
+    def _read(self, segment):
+        with open(self._path(segment.kind, segment.scope, segment.month), 'rb') as f:
+            f.seek(segment.offset)
+            data = f.read(segment.length)
+        return [json.loads(line) for line in gzip.decompress(data).decode('utf-8').splitlines()]
+
+    def _records(self, segment):
+        records = self._segments.get(segment.id)
+        if records is None:
+            records = self._read(segment)
+            self._segments.set(segment.id, records)
+        return [_decode(record) for record in records]
+
+    def history(self, kind, scope, before=None, after=None, limit=50):
+        """پیام‌های بایگانی‌شده با کلید (created_at, id) بین after و before، از جدید به قدیم
+
+        فقط تکه‌هایی که بازه زمانی‌شان با درخواست همپوشانی دارد خوانده می‌شوند.
+        """
+        query = ArchiveSegment.query.filter_by(kind=kind, scope=str(scope))
+        if before is not None:
+            query = query.filter(ArchiveSegment.first_at <= before[0])
+        if after is not None:
+            query = query.filter(ArchiveSegment.last_at >= after[0])
+        found = []
+        for segment in query.order_by(ArchiveSegment.last_at.desc()).all():
+            if len(found) >= limit and segment.last_at < found[limit - 1].created_at:
+                break
+            for msg in self._records(segment):
+                key = _key(msg)
+                if (before is None or key < before) and (after is None or key > after):
+                    found.append(msg)
+            found.sort(key=_key, reverse=True)
+            del found[limit:]
+        self._attach_related(kind, found)
+        return found
+
+    def get(self, kind, scope, msg_id):
+        """یک پیام بایگانی‌شده با شناسه‌اش یا None"""
+        segments = ArchiveSegment.query.filter(
+            ArchiveSegment.kind == kind, ArchiveSegment.scope == str(scope),
+            ArchiveSegment.first_id <= msg_id, ArchiveSegment.last_id >= msg_id
+        )
+        for segment in segments:
+            for msg in self._records(segment):
+                if msg.id == msg_id:
+                    return msg
+        return None
+
+    def get_many(self, kind, scope, ids):
+        """پیام‌های بایگانی‌شده یک اتاق یا مکالمه با شناسه‌هایشان: {id: پیام}"""
+        ids = set(ids)
+        segments = ArchiveSegment.query.filter(
+            ArchiveSegment.kind == kind, ArchiveSegment.scope == str(scope),
+            ArchiveSegment.first_id <= max(ids), ArchiveSegment.last_id >= min(ids)
+        )
+        found = {}
+        for segment in segments:
+            for msg in self._records(segment):
+                if msg.id in ids:
+                    found[msg.id] = msg
+        self._attach_related(kind, list(found.values()))
+        return found
+
+    def documents(self):
+        """(نوع، شناسه، متن، محدوده) همه پیام‌های بایگانی برای بازسازی نمایه جست‌وجو، تکه به تکه
+
+        از کش تکه‌ها رد نمی‌شود تا خواندن کل بایگانی آن را خالی نکند.
+        """
+        for segment in ArchiveSegment.query.order_by(ArchiveSegment.id).all():
+            yield [(segment.kind, record['id'], record['content'], segment.scope)
+                   for record in self._read(segment)]
+
+    @staticmethod
+    def _attach_related(kind, messages):
+        """پر کردن user پیام‌های اتاق و attachment همه پیام‌ها، هر کدام با یک کوئری"""
+        if kind == 'm':
+            ids = {msg.user_id for msg in messages}
+            users = {user.id: user for user in User.query.filter(User.id.in_(ids))} if ids else {}
+            for msg in messages:
+                msg.user = users.get(msg.user_id)
+        # رکوردهای پیش از مهاجرت ۷ ستون attachment_id ندارند
+        ids = {getattr(msg, 'attachment_id', None) for msg in messages} - {None}
+        found = {a.id: a for a in Attachment.query.filter(Attachment.id.in_(ids))} if ids else {}
+        for msg in messages:
+            msg.attachment = found.get(getattr(msg, 'attachment_id', None))
+
+    # --- زمان‌بندی ------------------------------------------------------
+
+    def _ensure_started(self):
+        if self._task_pid == os.getpid():
+            return
+        self._task_pid = os.getpid()
+        self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.app.config['ARCHIVE_INTERVAL'])
+            try:
+                with self.app.app_context():
+                    report = self.run()
+                logger.info('archive run: %s', report)
+            except Exception:
+                logger.exception('archive run failed')
+
+archiver = Archiver()
+
+@click.command('archive')
+@click.option('--days', type=int, default=None, help='سن پیام‌ها برای بایگانی (پیش‌فرض ARCHIVE_AFTER_DAYS)')
+@click.option('--full-vacuum', is_flag=True, help='VACUUM کامل و فعال‌سازی auto_vacuum تدریجی')
+@with_appcontext
+def archive_command(days, full_vacuum):
+    """انتقال پیام‌های قدیمی به بایگانی فشرده و آزادسازی فضای دیتابیس"""
+    archive = current_app.extensions['archive']
+    report = archive.run(days)
+    if report.get('skipped'):
+        click.echo('another archive run is in progress')
+        return
+    ratio = report['raw_bytes'] / report['stored_bytes'] if report['stored_bytes'] else 0
+    click.echo(f"{report['rows']} messages archived in {report['segments']} segments, "
+               f"{report['raw_bytes']} -> {report['stored_bytes']} bytes ({ratio:.1f}x), "
+               f"{report['pages_freed']} pages freed")
+    if full_vacuum:
+        archive.full_vacuum()
+        click.echo('full vacuum done, auto_vacuum=INCREMENTAL')
@@ -0,0 +1,294 @@
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import urllib.request
+
+import click
+from flask import current_app, send_from_directory, url_for
+from flask.cli import with_appcontext
+from werkzeug.http import parse_accept_header
+from werkzeug.utils import send_file
+
+try:
+    import brotli
+except ImportError:  # بدون brotli فقط نسخه gzip ساخته می‌شود
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# نسخه‌های ثابت کتابخانه‌هایی که قبلاً از CDN بارگذاری می‌شدند؛ flask assets-vendor
+# آنها را در assets/vendor می‌گذارد تا استقرار بدون اینترنت هم کار کند. تا آن زمان
+# صفحه‌ها با هشدار در لاگ از CDN بارگذاری می‌شوند؛ استقرار بدون اینترنت
+# ASSETS_CDN_FALLBACK را خاموش می‌کند تا build هنگام راه‌اندازی خطا بدهد
+_JSDELIVR = 'https://cdn.jsdelivr.net/npm'
+_CDNJS = 'https://cdnjs.cloudflare.com/ajax/libs'
+VENDOR = {
+    'vendor/bootstrap/bootstrap.min.css': f'{_JSDELIVR}/bootstrap@5.3.0/dist/css/bootstrap.min.css',
+    'vendor/bootstrap/bootstrap.bundle.min.js': f'{_JSDELIVR}/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js',
+    'vendor/bootstrap-icons/bootstrap-icons.css': f'{_JSDELIVR}/bootstrap-icons@1.10.0/font/bootstrap-icons.css',
+    'vendor/bootstrap-icons/fonts/bootstrap-icons.woff2':
+        f'{_JSDELIVR}/bootstrap-icons@1.10.0/font/fonts/bootstrap-icons.woff2',
+    'vendor/bootstrap-icons/fonts/bootstrap-icons.woff':
+        f'{_JSDELIVR}/bootstrap-icons@1.10.0/font/fonts/bootstrap-icons.woff',
+    'vendor/fontawesome/css/all.min.css': f'{_CDNJS}/font-awesome/6.4.0/css/all.min.css',
+    'vendor/socket.io/socket.io.min.js': 'https://cdn.socket.io/4.7.2/socket.io.min.js',
+}
+for _font in ('fa-brands-400', 'fa-regular-400', 'fa-solid-900', 'fa-v4compatibility'):
+    for _ext in ('woff2', 'ttf'):
+        VENDOR[f'vendor/fontawesome/webfonts/{_font}.{_ext}'] = f'{_CDNJS}/font-awesome/6.4.0/webfonts/{_font}.{_ext}'
+
+# فونت‌های woff/woff2 خودشان فشرده‌اند
+_COMPRESSIBLE = {'.css', '.js', '.svg', '.ttf', '.eot', '.json', '.txt'}
+_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+_SOURCE_MAP = re.compile(r'^\s*(/\*#\s*sourceMappingURL=[^*]*\*/|//#\s*sourceMappingURL=\S*)\s*$', re.M)
+
+
+def minify_css(text):
+    """حذف توضیحات و فاصله‌های اضافه؛ توضیحات /*! (مجوزها) می‌مانند"""
+    text = re.sub(r'/\*(?!!).*?\*/', '', text, flags=re.S)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{};,])\s*', r'\1', text)
+    return text.replace(';}', '}').strip() + '\n'
+
+
+def minify_js(text):
+    """کوچک‌سازی محافظه‌کارانه: حذف تورفتگی، خطوط خالی و خطوط فقط-توضیح
+
+    شکست خطوط حفظ می‌شود تا درج خودکار نقطه‌ویرگول تغییر نکند.
+    """
+    lines = (line.strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//')) + '\n'
+
+
+class Assets:
+    """خط لوله فایل‌های استاتیک: کوچک‌سازی، نام اثرانگشت‌دار و نسخه‌های پیش‌فشرده
+
+    flask assets-build هر فایل پوشه assets را (پس از کوچک‌سازی فایل‌های
+    خود برنامه) با نامی شامل هش محتوا در ASSETS_OUTPUT می‌نویسد، کنار آن
+    نسخه gz و در صورت نصب بودن brotli نسخه br می‌سازد و نگاشت نام به نام
+    نهایی را در manifest.json نگه می‌دارد. آدرس‌های url() در CSS به نام
+    نهایی فونت‌ها بازنویسی می‌شوند. چون نام با محتوا عوض می‌شود، پاسخ‌ها
+    با Cache-Control یک‌ساله و immutable فرستاده می‌شوند و نسخه فشرده مناسب
+    Accept-Encoding بدون فشرده‌سازی در هر درخواست انتخاب می‌شود. این فایل‌ها
+    پیش از Flask در یک لایه WSGI داده می‌شوند تا نشست و Flask-Login
+    (Vary: Cookie) کش‌های مشترک را از کار نیندازند. بدون build فایل‌ها از
+    همان پوشه assets و بدون کش بلندمدت داده می‌شوند.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.manifest = {}
+        self._built = set()
+        self._missing = set()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ASSETS_SOURCE', os.path.join(app.root_path, 'assets'))
+        app.config.setdefault('ASSETS_OUTPUT', os.path.join(app.root_path, 'static', 'dist'))
+        app.config.setdefault('ASSETS_MAX_AGE', 365 * 24 * 3600)
+        # کتابخانه vendor که دانلود نشده از CDN بارگذاری شود؛ False یعنی نبودن آن خطای راه‌اندازی است
+        app.config.setdefault('ASSETS_CDN_FALLBACK', True)
+        self.app = app
+        app.extensions['assets'] = self
+        app.add_url_rule('/assets/<path:filename>', 'asset', self.serve_source)
+        app.wsgi_app = self._middleware(app.wsgi_app)
+        app.jinja_env.globals['asset_url'] = self.url
+        app.cli.add_command(build_command)
+        app.cli.add_command(vendor_command)
+        self._load_manifest()
+
+    def _load_manifest(self):
+        try:
+            with open(os.path.join(self.app.config['ASSETS_OUTPUT'], 'manifest.json')) as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {}
+        self._built = set(self.manifest.values())
+
+    # --- آدرس و ارسال ---------------------------------------------------
+
+    def url(self, name):
+        """آدرس یک فایل استاتیک برای قالب‌ها"""
+        built = self.manifest.get(name)
+        if built is not None:
+            return url_for('asset', filename=built)
+        if name in VENDOR and self.app.config['ASSETS_CDN_FALLBACK'] \
+                and not os.path.isfile(os.path.join(self.app.config['ASSETS_SOURCE'], name)):
+            if name not in self._missing:
+                self._missing.add(name)
+                logger.warning('%s is not vendored; loading it from CDN (run flask assets-vendor)', name)
+            return VENDOR[name]
+        return url_for('asset', filename=name)
+
+    def serve_source(self, filename):
+        """فایل اصلی پیش از build، بدون کش بلندمدت"""
+        return send_from_directory(current_app.config['ASSETS_SOURCE'], filename, max_age=0)
+
+    def _middleware(self, wsgi_app):
+        prefix = '/assets/'
+
+        def middleware(environ, start_response):
+            path = environ.get('PATH_INFO', '')
+            if path.startswith(prefix) and path[len(prefix):] in self._built:
+                return self._send_built(environ, path[len(prefix):])(environ, start_response)
+            return wsgi_app(environ, start_response)
+        return middleware
+
+    def _send_built(self, environ, filename):
+        config = self.app.config
+        path = os.path.join(config['ASSETS_OUTPUT'], *filename.split('/'))
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        accept = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING'))
+        encoding = None
+        for name, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if accept[name] and os.path.isfile(path + suffix):
+                encoding, path = name, path + suffix
+                break
+        response = send_file(path, environ, mimetype=mimetype, max_age=config['ASSETS_MAX_AGE'],
+                             conditional=True)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    # --- build ----------------------------------------------------------
+
+    def missing_vendor(self):
+        """نام فایل‌های VENDOR که در پوشه assets نیستند"""
+        source = self.app.config['ASSETS_SOURCE']
+        return [name for name in VENDOR if not os.path.isfile(os.path.join(source, *name.split('/')))]
+
+    def build(self):
+        """ساخت همه فایل‌ها و manifest؛ خروجی‌های موجود با همان هش دوباره نوشته نمی‌شوند
+
+        فایل‌های VENDOR ناموجود با هشدار از CDN بارگذاری می‌شوند؛ اگر
+        ASSETS_CDN_FALLBACK خاموش باشد RuntimeError تا استقرار بدون اینترنت
+        با صفحه‌های بدون اسکریپت بالا نیاید.
+        """
+        source = self.app.config['ASSETS_SOURCE']
+        output = self.app.config['ASSETS_OUTPUT']
+        missing = self.missing_vendor()
+        if missing:
+            message = (f'{len(missing)} vendor files are missing from {source}: {", ".join(missing)}; '
+                       'run flask assets-vendor')
+            if not self.app.config['ASSETS_CDN_FALLBACK']:
+                raise RuntimeError(message)
+            logger.warning('%s; serving them from CDN meanwhile', message)
+        names = []
+        for root, _, files in os.walk(source):
+            for filename in files:
+                names.append(os.path.relpath(os.path.join(root, filename), source).replace(os.sep, '/'))
+
+        manifest = {}
+        report = {'files': 0, 'written': 0, 'bytes': 0, 'gzip': 0, 'br': 0}
+        # CSS در آخر تا url() های آن به نام نهایی فونت‌ها اشاره کنند
+        for name in sorted(names, key=lambda n: (n.endswith('.css'), n)):
+            with open(os.path.join(source, name), 'rb') as f:
+                data = f.read()
+            data = self._transform(name, data, manifest)
+            base, ext = posixpath.splitext(name)
+            built = f'{base}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+            path = os.path.join(output, *built.split('/'))
+            variants = [(path, lambda: data)]
+            if ext in _COMPRESSIBLE:
+                variants.append((path + '.gz', lambda: gzip.compress(data, 9, mtime=0)))
+                if brotli is not None:
+                    variants.append((path + '.br', lambda: brotli.compress(data)))
+            for target, make in variants:
+                if not os.path.isfile(target):
+                    _write_atomic(target, make())
+                    report['written'] += 1
+            report['files'] += 1
+            report['bytes'] += len(data)
+            for key, suffix in (('gzip', '.gz'), ('br', '.br')):
+                report[key] += os.path.getsize(path + suffix) if os.path.isfile(path + suffix) else len(data)
+            manifest[name] = built
+
+        _write_atomic(os.path.join(output, 'manifest.json'),
+                      json.dumps(manifest, indent=1, sort_keys=True).encode())
+        self.manifest = manifest
+        self._built = set(manifest.values())
+        return report
+
+    def _transform(self, name, data, manifest):
+        ext = posixpath.splitext(name)[1]
+        if ext not in ('.css', '.js'):
+            return data
+        text = _SOURCE_MAP.sub('', data.decode('utf-8'))
+        minified = '.min.' in name
+        if ext == '.css':
+            text = self._rewrite_urls(name, text, manifest)
+            if not minified:
+                text = minify_css(text)
+        elif not minified:
+            text = minify_js(text)
+        return text.encode('utf-8')
+
+    @staticmethod
+    def _rewrite_urls(name, text, manifest):
+        folder = posixpath.dirname(name)
+
+        def replace(match):
+            url = match.group(2).strip()
+            if re.match(r'^([a-z]+:|/|#)', url, re.I):
+                return match.group(0)
+            path, _, fragment = url.partition('#')
+            path = path.split('?', 1)[0]
+            target = manifest.get(posixpath.normpath(posixpath.join(folder, path)))
+            if target is None:
+                return match.group(0)
+            rewritten = posixpath.relpath(target, folder or '.')
+            return f'url("{rewritten}{"#" + fragment if fragment else ""}")'
+        return _URL.sub(replace, text)
+
+    def vendor(self, force=False):
+        """دانلود کتابخانه‌های VENDOR در پوشه assets؛ خروجی نام‌های دانلودشده"""
+        fetched = []
+        for name, url in VENDOR.items():
+            path = os.path.join(self.app.config['ASSETS_SOURCE'], *name.split('/'))
+            if os.path.isfile(path) and not force:
+                continue
+            with urllib.request.urlopen(url, timeout=30) as response:
+                _write_atomic(path, response.read())
+            fetched.append(name)
+        return fetched
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+assets = Assets()
+
+
+@click.command('assets-build')
+@with_appcontext
+def build_command():
+    """کوچک‌سازی، اثرانگشت و پیش‌فشرده‌سازی فایل‌های استاتیک"""
+    try:
+        report = current_app.extensions['assets'].build()
+    except RuntimeError as exc:
+        raise click.ClickException(str(exc))
+    click.echo(f"{report['files']} assets ({report['written']} files written): {report['bytes']:,} bytes, "
+               f"gzip {report['gzip']:,}" + (f", br {report['br']:,}" if brotli is not None else ', br skipped'))
+
+
+@click.command('assets-vendor')
+@click.option('--force', is_flag=True, help='دانلود دوباره فایل‌های موجود')
+@with_appcontext
+def vendor_command(force):
+    """دانلود کتابخانه‌های CDN در assets/vendor برای استقرار بدون اینترنت"""
+    fetched = current_app.extensions['assets'].vendor(force)
+    click.echo(f'{len(fetched)} files downloaded' if fetched else 'all vendor files present')
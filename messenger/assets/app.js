@@ -0,0 +1,58 @@
+// اسکرول به پایین برای صفحات چت
+function scrollToBottom() {
+    const messagesContainer = document.getElementById('messages');
+    if (messagesContainer) {
+        messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    }
+}
+
+// بارگذاری اولیه
+document.addEventListener('DOMContentLoaded', function() {
+    scrollToBottom();
+
+    // انیمیشن برای کارت‌ها
+    const cards = document.querySelectorAll('.glass-card');
+    cards.forEach((card, index) => {
+        card.style.animationDelay = `${index * 0.1}s`;
+    });
+});
+
+// پیوست پیام: پیش‌نمایش تصویر یا پیوند دانلود؛ a خروجی attachments.describe است
+function attachmentNode(a) {
+    const link = document.createElement('a');
+    link.className = 'attachment';
+    link.href = a.url;
+    link.target = '_blank';
+    link.rel = 'noopener';
+    if (a.thumbnail) {
+        const img = document.createElement('img');
+        img.src = a.thumbnail;
+        img.alt = a.name;
+        img.loading = 'lazy';
+        link.append(img);
+    } else {
+        link.textContent = `📎 ${a.name}`;
+    }
+    return link;
+}
+
+// بارگذاری فایل به صورت بدنه خام درخواست تا سرور آن را جریانی ذخیره کند
+async function uploadAttachment(url, file) {
+    const res = await fetch(url, {
+        method: 'POST',
+        headers: {
+            'Content-Type': file.type || 'application/octet-stream',
+            'X-Filename': encodeURIComponent(file.name),
+        },
+        body: file,
+    });
+    const data = await res.json();
+    if (!res.ok) throw new Error(data.error || res.status);
+    return data;
+}
+
+// پنجره ارسال پخش اتاق در سرور: هر fanout_probe تأیید می‌شود تا اتصال کند تشخیص داده شود
+function enableFanoutAcks(socket) {
+    socket.on('connect', () => socket.emit('fanout_ack', 0));
+    socket.on('fanout_probe', (n) => socket.emit('fanout_ack', n));
+}
@@ -0,0 +1,335 @@
+import hashlib
+import io
+import logging
+import mimetypes
+import os
+import re
+import tempfile
+import threading
+import unicodedata
+from urllib.parse import quote, unquote
+
+from flask import jsonify, request, abort, url_for, send_file
+from flask_login import login_required, current_user
+
+from models import db, Attachment, Message, DirectMessage
+from concurrency import BlockingPool
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # بدون Pillow تصویر کامل به جای پیش‌نمایش فرستاده می‌شود
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# نوع‌هایی که در مرورگر نمایش داده می‌شوند و پیش‌نمایش دارند؛ بقیه (از جمله SVG
+# و HTML) فقط به صورت دانلود فرستاده می‌شوند تا در دامنه برنامه اجرا نشوند
+INLINE_TYPES = {'image/png', 'image/jpeg', 'image/gif', 'image/webp'}
+
+_UNSAFE_NAME = re.compile(r'[\x00-\x1f\x7f/\\]')
+
+
+class AttachmentRejected(Exception):
+    """شناسه پیوست پیام نامعتبر است یا فرستنده اجازه استفاده از آن را ندارد"""
+
+
+def _clean_filename(raw):
+    name = _UNSAFE_NAME.sub('_', unquote(raw or '')).strip(' .')
+    return name[-255:] or 'file'
+
+
+def _disposition(response, filename, as_attachment):
+    """Content-Disposition با نام UTF-8 طبق RFC 5987، مانند send_file"""
+    try:
+        filename.encode('ascii')
+        names = {'filename': filename}
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+        names = {'filename': simple or 'file', 'filename*': "UTF-8''" + quote(filename, safe="!#$&+-.^_`|~")}
+    response.headers.set('Content-Disposition', 'attachment' if as_attachment else 'inline', **names)
+
+
+def _make_thumbnail(source, target, size):
+    """ساخت پیش‌نمایش JPEG؛ در نخ استخر اجرا می‌شود"""
+    with Image.open(source) as image:
+        # JPEGهای بزرگ مستقیم با مقیاس کوچک‌تر decode می‌شوند
+        image.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=80, optimize=True)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target))
+    with os.fdopen(fd, 'wb') as out:
+        out.write(buffer.getvalue())
+    os.replace(tmp, target)
+
+
+class AttachmentStore:
+    """ذخیره و ارسال پیوست‌های پیام با آدرس‌دهی بر اساس محتوا
+
+    بدنه خام درخواست POST /attachments تکه‌به‌تکه خوانده و همزمان هش و در
+    فایل موقت نوشته می‌شود، پس هیچ‌وقت کامل در حافظه نیست؛ سپس با نام sha256
+    به blobs منتقل می‌شود و اگر همان محتوا قبلاً بوده فایل موقت دور ریخته می‌شود.
+    دانلود با send_file و پاسخ شرطی (Range، ETag) انجام می‌شود؛ USE_X_SENDFILE
+    یا ATTACHMENT_ACCEL_REDIRECT ارسال فایل را به وب‌سرور جلویی می‌سپارد.
+    پیش‌نمایش تصاویر پس از پاسخ در استخر جدای THUMBNAIL_POOL_SIZE نخ ساخته می‌شود.
+    """
+
+    def __init__(self, app=None, socketio=None):
+        self.app = None
+        self.socketio = None
+        self._pool = None
+        self._lock = threading.Lock()
+        self._thumbnailing = set()
+        self.stats = {'uploads': 0, 'deduplicated': 0, 'bytes': 0, 'too_large': 0,
+                      'thumbnails': 0, 'thumbnail_errors': 0}
+        if app is not None:
+            self.init_app(app, socketio)
+
+    def init_app(self, app, socketio):
+        app.config.setdefault('ATTACHMENTS_DIR', os.path.join(app.instance_path, 'attachments'))
+        app.config.setdefault('ATTACHMENT_MAX_SIZE', 25 * 1024 * 1024)
+        app.config.setdefault('ATTACHMENT_CHUNK_SIZE', 64 * 1024)
+        # محتوای هر شناسه تغییر نمی‌کند؛ فقط مرورگر خود کاربر آن را کش می‌کند
+        app.config.setdefault('ATTACHMENT_MAX_AGE', 365 * 24 * 3600)
+        # پیشوند location داخلی nginx برای X-Accel-Redirect؛ None یعنی ارسال از خود برنامه
+        app.config.setdefault('ATTACHMENT_ACCEL_REDIRECT', None)
+        app.config.setdefault('THUMBNAIL_SIZE', 320)
+        app.config.setdefault('THUMBNAIL_POOL_SIZE', 2)
+        self.app = app
+        self.socketio = socketio
+        self._pool = BlockingPool(app.config['THUMBNAIL_POOL_SIZE'])
+        app.extensions['attachments'] = self
+        app.jinja_env.globals['attachment_info'] = self.describe
+        app.add_url_rule('/attachments', 'attachment_upload', login_required(self.upload), methods=['POST'])
+        app.add_url_rule('/attachments/<int:attachment_id>', 'attachment_download',
+                         login_required(self.download))
+        app.add_url_rule('/attachments/<int:attachment_id>/thumbnail', 'attachment_thumbnail',
+                         login_required(self.thumbnail))
+
+    # --- مسیرها ---------------------------------------------------------
+
+    def _path(self, folder, sha256, suffix=''):
+        return os.path.join(self.app.config['ATTACHMENTS_DIR'], folder, sha256[:2], sha256 + suffix)
+
+    def blob_path(self, sha256):
+        return self._path('blobs', sha256)
+
+    def thumbnail_path(self, sha256):
+        return self._path('thumbs', sha256, '.jpg')
+
+    # --- بارگذاری -------------------------------------------------------
+
+    def upload(self):
+        """بدنه خام درخواست فایل است و نامش در سرآیند X-Filename (URL-encoded)
+
+        سرآیند سفارشی درخواست‌های فرم دیگر سایت‌ها را هم رد می‌کند (preflight CORS).
+        """
+        if 'X-Filename' not in request.headers:
+            return jsonify({'error': 'bad_request'}), 400
+        limit = self.app.config['ATTACHMENT_MAX_SIZE']
+        if (request.content_length or 0) > limit:
+            self.stats['too_large'] += 1
+            return jsonify({'error': 'too_large', 'max_size': limit}), 413
+
+        filename = _clean_filename(request.headers['X-Filename'])
+        content_type = request.mimetype
+        if not content_type or content_type == 'application/octet-stream':
+            content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        stored = self._store(request.stream, limit)
+        if stored is None:
+            self.stats['too_large'] += 1
+            return jsonify({'error': 'too_large', 'max_size': limit}), 413
+        sha256, size = stored
+        if not size:
+            return jsonify({'error': 'empty'}), 400
+
+        attachment = Attachment(sha256=sha256, size=size, content_type=content_type[:100],
+                                filename=filename, uploader_id=current_user.id)
+        db.session.add(attachment)
+        db.session.commit()
+        self.stats['uploads'] += 1
+        self.stats['bytes'] += size
+        self._schedule_thumbnail(attachment)
+        return jsonify(self.describe(attachment)), 201
+
+    def _store(self, stream, limit):
+        """نوشتن جریان در فایل موقت با هش همزمان و انتقال به blobs؛ None اگر از limit بیشتر باشد"""
+        chunk_size = self.app.config['ATTACHMENT_CHUNK_SIZE']
+        tmp_dir = os.path.join(self.app.config['ATTACHMENTS_DIR'], 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = stream.read(chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > limit:
+                        os.unlink(tmp)
+                        return None
+                    digest.update(chunk)
+                    out.write(chunk)
+            sha256 = digest.hexdigest()
+            path = self.blob_path(sha256)
+            if os.path.exists(path):
+                self.stats['deduplicated'] += 1
+                os.unlink(tmp)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp, path)
+            return sha256, size
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    # --- پیام‌ها --------------------------------------------------------
+
+    def resolve(self, raw_id, user_id, kind, scope):
+        """پیوست قابل فرستادن در این اتاق یا مکالمه؛ None اگر پیام پیوست ندارد
+
+        فقط بارگذاری‌های خود فرستنده که آزادند یا از قبل به همین محدوده بسته
+        شده‌اند پذیرفته می‌شوند؛ در غیر این صورت AttachmentRejected. اینجا فقط
+        خوانده می‌شود؛ بستن به محدوده در claim_messages و در تراکنش خود پیام است.
+        """
+        if raw_id is None:
+            return None
+        try:
+            attachment_id = int(raw_id)
+        except (TypeError, ValueError):
+            raise AttachmentRejected(raw_id)
+        attachment = db.session.get(Attachment, attachment_id)
+        if attachment is None or attachment.uploader_id != user_id or \
+                (attachment.scope is not None and (attachment.kind, attachment.scope) != (kind, scope)):
+            raise AttachmentRejected(raw_id)
+        return attachment
+
+    @staticmethod
+    def claim_messages(objs):
+        """هوک before_flush نویسنده پیام‌ها: بستن پیوست هر پیام به اتاق یا مکالمه‌اش
+
+        UPDATE شرطی در همان تراکنش دسته است تا دو پیام هم‌زمان نتوانند یک پیوست
+        آزاد را به دو محدوده ببرند؛ اگر ردیفی تغییر نکند پیام رد می‌شود و
+        نویسنده آن را از بقیه دسته جدا می‌کند.
+        """
+        for obj in objs:
+            if getattr(obj, 'attachment_id', None) is None:
+                continue
+            if isinstance(obj, DirectMessage):
+                kind, scope, uploader = 'd', obj.conversation_key, obj.sender_id
+            elif isinstance(obj, Message):
+                kind, scope, uploader = 'm', str(obj.room_id), obj.user_id
+            else:
+                continue
+            claimed = db.session.execute(db.update(Attachment).where(
+                Attachment.id == obj.attachment_id,
+                Attachment.uploader_id == uploader,
+                db.or_(Attachment.scope.is_(None), db.and_(Attachment.kind == kind, Attachment.scope == scope))
+            ).values(kind=kind, scope=scope).execution_options(synchronize_session=False)).rowcount
+            if not claimed:
+                raise AttachmentRejected(obj.attachment_id)
+
+    def describe(self, attachment):
+        """داده پیوست برای JSON پیام‌ها؛ None برای پیام بدون پیوست"""
+        if attachment is None:
+            return None
+        image = attachment.content_type in INLINE_TYPES
+        return {
+            'id': attachment.id,
+            'name': attachment.filename,
+            'size': attachment.size,
+            'type': attachment.content_type,
+            'url': url_for('attachment_download', attachment_id=attachment.id),
+            'thumbnail': url_for('attachment_thumbnail', attachment_id=attachment.id) if image else None,
+        }
+
+    # --- دانلود ---------------------------------------------------------
+
+    def _readable(self, attachment_id):
+        attachment = db.session.get(Attachment, attachment_id)
+        if attachment is None or not attachment.readable_by(current_user.id):
+            abort(404)
+        return attachment
+
+    def download(self, attachment_id):
+        attachment = self._readable(attachment_id)
+        inline = attachment.content_type in INLINE_TYPES
+        return self._send(self.blob_path(attachment.sha256), attachment.sha256,
+                          attachment.content_type if inline else 'application/octet-stream',
+                          attachment.filename, not inline)
+
+    def thumbnail(self, attachment_id):
+        """پیش‌نمایش آماده یا تصویر کامل تا زمانی که پیش‌نمایش ساخته نشده است"""
+        attachment = self._readable(attachment_id)
+        if attachment.content_type not in INLINE_TYPES:
+            abort(404)
+        path = self.thumbnail_path(attachment.sha256)
+        if not os.path.exists(path):
+            self._schedule_thumbnail(attachment)
+            response = self.download(attachment_id)
+            response.cache_control.max_age = 0
+            response.cache_control.immutable = False
+            return response
+        return self._send(path, attachment.sha256 + '-thumb', 'image/jpeg', attachment.filename, False)
+
+    def _send(self, path, etag, mimetype, filename, as_attachment):
+        config = self.app.config
+        if config['ATTACHMENT_ACCEL_REDIRECT']:
+            relative = os.path.relpath(path, config['ATTACHMENTS_DIR']).replace(os.sep, '/')
+            response = self.app.response_class(mimetype=mimetype)
+            response.headers['X-Accel-Redirect'] = config['ATTACHMENT_ACCEL_REDIRECT'].rstrip('/') + '/' + relative
+        elif not os.path.isfile(path):
+            # ردیف بدون فایل (مثلاً پوشه پیوست‌ها بازیابی نشده)؛ 404 به جای خطای 500
+            logger.warning('attachment blob %s is missing', path)
+            abort(404)
+        else:
+            # conditional: پاسخ 206 برای Range و 304 برای ETag؛ فایل با wsgi.file_wrapper فرستاده می‌شود
+            response = send_file(path, mimetype=mimetype, conditional=True, etag=etag,
+                                 max_age=config['ATTACHMENT_MAX_AGE'])
+        _disposition(response, filename, as_attachment)
+        response.headers['X-Content-Type-Options'] = 'nosniff'
+        response.cache_control.public = False
+        response.cache_control.private = True
+        response.cache_control.max_age = config['ATTACHMENT_MAX_AGE']
+        response.cache_control.immutable = True
+        return response
+
+    # --- پیش‌نمایش ------------------------------------------------------
+
+    def _schedule_thumbnail(self, attachment):
+        if Image is None or attachment.content_type not in INLINE_TYPES:
+            return
+        sha256 = attachment.sha256
+        with self._lock:
+            if sha256 in self._thumbnailing or os.path.exists(self.thumbnail_path(sha256)):
+                return
+            self._thumbnailing.add(sha256)
+        self.socketio.start_background_task(self._thumbnail_task, sha256)
+
+    def _thumbnail_task(self, sha256):
+        try:
+            self._pool.run(_make_thumbnail, self.blob_path(sha256), self.thumbnail_path(sha256),
+                           self.app.config['THUMBNAIL_SIZE'])
+            self.stats['thumbnails'] += 1
+        except Exception:
+            # تصویر خراب در _thumbnailing می‌ماند تا در این پردازه دوباره امتحان نشود
+            self.stats['thumbnail_errors'] += 1
+            logger.exception('thumbnail for %s failed', sha256)
+            return
+        with self._lock:
+            self._thumbnailing.discard(sha256)
+
+
+attachments = AttachmentStore()
@@ -0,0 +1,409 @@
+"""بنچمارک مسیرهای HTTP و رویدادهای Socket.IO روی دیتابیس پرشده
+
+یک دیتابیس با تعداد دلخواه کاربر، اتاق، پیام اتاق و پیام خصوصی ساخته
+می‌شود (با درج دسته‌ای، بنابراین میلیون‌ها ردیف در چند ثانیه)، سپس چند
+کلاینت همزمان با test client های Flask و Socket.IO هر مسیر را می‌زنند.
+برای هر مسیر و رویداد صدک‌های تأخیر و توان عملیاتی به صورت JSON نوشته
+می‌شود تا اجراها با --compare مقایسه شوند.
+
+اجرا از پوشه messenger:
+    python benchmarks/bench_app.py --messages 1000000 --dms 1000000 --output before.json
+    python benchmarks/bench_app.py --db /tmp/bench.db --output after.json --compare before.json
+
+با --db دیتابیس پرشده نگه داشته می‌شود و اجراهای بعدی دوباره آن را پر نمی‌کنند.
+پیام‌های پرشده در نمایه جست‌وجو نیستند.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, HERE)
+
+ROUTES = ['dashboard', 'my_messages', 'dm', 'room']
+EVENTS = ['message', 'dm', 'sync', 'read']
+# نام رویدادها در --only و نتایج؛ پیشوند socket_ آن‌ها را از مسیرهای هم‌نام جدا می‌کند
+EVENT_NAMES = [f'socket_{event}' for event in EVENTS]
+
+
+def percentile(sorted_values, p):
+    """صدک به روش nearest-rank"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    values = sorted(latencies)
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        'count': len(values),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'throughput': round(len(values) / elapsed, 1) if elapsed else None,
+        'mean_ms': ms(sum(values) / len(values)) if values else None,
+        'p50_ms': ms(percentile(values, 50)),
+        'p90_ms': ms(percentile(values, 90)),
+        'p95_ms': ms(percentile(values, 95)),
+        'p99_ms': ms(percentile(values, 99)),
+        'max_ms': ms(values[-1]) if values else None,
+    }
+
+
+def configure_env(path, args):
+    """تنظیمات برنامه پیش از import شدن app از طریق متغیرهای MESSENGER_*"""
+    os.environ['MESSENGER_SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    os.environ['MESSENGER_HISTORY_PAGE_SIZE'] = str(args.page_size)
+    os.environ['MESSENGER_MESSAGE_ACK_DURABLE'] = 'true' if args.durable_ack else 'false'
+    # کلاینت‌های شبیه‌سازی‌شده بی‌وقفه می‌فرستند؛ محدودیت flood اندازه‌گیری را خراب می‌کند
+    for scope in ('CONNECTION', 'USER', 'ROOM'):
+        os.environ[f'MESSENGER_FLOOD_{scope}_BURST'] = os.environ[f'MESSENGER_FLOOD_{scope}_RATE'] = '1e9'
+
+
+# --- پر کردن دیتابیس -------------------------------------------------------
+
+def seed(app, args):
+    """درج دسته‌ای کاربران، دوستی‌ها، پیام‌ها و خلاصه مکالمات؛ خروجی تعداد ردیف‌ها"""
+    from models import db, User, Room, Message, DirectMessage, Conversation, canonical_dm_key
+    from utils import hash_password
+
+    rng = random.Random(args.seed)
+    chunk = 50000
+    with app.app_context():
+        if db.session.query(Message.id).limit(1).first() is not None:
+            return None
+        start = time.perf_counter()
+        password_hash = hash_password('bench-pass')
+        taken = {code for (code,) in db.session.query(User.code)}
+        first_user = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+        users = []
+        for i in range(args.users):
+            code = f'{rng.randrange(10 ** 7):07d}'
+            while code in taken:
+                code = f'{rng.randrange(10 ** 7):07d}'
+            taken.add(code)
+            users.append({'id': first_user + i, 'username': f'bench{i}', 'email': f'bench{i}@example.com',
+                          'password_hash': password_hash, 'code': code, 'is_admin': False,
+                          'is_active': True, 'joined_at': datetime.utcnow()})
+        db.session.execute(User.__table__.insert(), users)
+
+        existing = db.session.query(Room.slug).count()
+        if args.rooms > existing:
+            db.session.execute(Room.__table__.insert(), [
+                {'slug': f'bench-{i}', 'title': f'Bench {i}'} for i in range(args.rooms - existing)
+            ])
+        room_ids = [room_id for (room_id,) in db.session.query(Room.id)]
+        user_ids = [u['id'] for u in users]
+        db.session.commit()
+
+        # هر کاربر با friends کاربر بعدی در یک حلقه مکالمه دارد
+        pairs = sorted({(min(a, b), max(a, b))
+                        for i, a in enumerate(user_ids)
+                        for b in user_ids[i + 1:i + 1 + args.friends]})
+        begin = datetime.utcnow() - timedelta(days=args.days)
+        step = timedelta(days=args.days) / max(1, args.messages)
+        room_seq = dict(db.session.query(Room.id, Room.last_seq))
+        for offset in range(0, args.messages, chunk):
+            rows = []
+            for n in range(offset, min(args.messages, offset + chunk)):
+                room_id = rng.choice(room_ids)
+                room_seq[room_id] += 1
+                rows.append({'room_id': room_id, 'user_id': rng.choice(user_ids), 'seq': room_seq[room_id],
+                             'content': f'bench message {n}', 'created_at': begin + step * n})
+            db.session.execute(Message.__table__.insert(), rows)
+            db.session.commit()
+        for room_id, last_seq in room_seq.items():
+            db.session.execute(db.update(Room).where(Room.id == room_id).values(last_seq=last_seq))
+        db.session.commit()
+
+        summary = {}
+        next_id = (db.session.query(db.func.max(DirectMessage.id)).scalar() or 0) + 1
+        step = timedelta(days=args.days) / max(1, args.dms)
+        for offset in range(0, args.dms, chunk):
+            rows = []
+            for n in range(offset, min(args.dms, offset + chunk)):
+                lo, hi = rng.choice(pairs)
+                sender, receiver = (lo, hi) if rng.random() < 0.5 else (hi, lo)
+                created = begin + step * n
+                is_read = n < args.dms - args.unread
+                key = canonical_dm_key(lo, hi)
+                rows.append({'id': next_id, 'sender_id': sender, 'receiver_id': receiver,
+                             'conversation_key': key, 'content': f'bench dm {n}',
+                             'created_at': created, 'is_read': is_read})
+                conv = summary.setdefault(key, {'key': key, 'user_a_id': lo, 'user_b_id': hi,
+                                                'unread_a': 0, 'unread_b': 0,
+                                                'sent_by_a': 0, 'sent_by_b': 0, 'last_seq': 0,
+                                                'read_seq_a': None, 'read_seq_b': None})
+                conv['last_seq'] += 1
+                rows[-1]['seq'] = conv['last_seq']
+                side = 'a' if sender == lo else 'b'
+                other = 'b' if side == 'a' else 'a'
+                conv[f'sent_by_{side}'] += 1
+                if not is_read:
+                    conv[f'unread_{other}'] += 1
+                    if conv[f'read_seq_{other}'] is None:
+                        conv[f'read_seq_{other}'] = conv['last_seq'] - 1
+                conv['last_message_id'] = next_id
+                conv['last_activity_at'] = created
+                next_id += 1
+            db.session.execute(DirectMessage.__table__.insert(), rows)
+            db.session.commit()
+        for conv in summary.values():
+            for side in ('a', 'b'):
+                if conv[f'read_seq_{side}'] is None:
+                    conv[f'read_seq_{side}'] = conv['last_seq']
+        if summary:
+            db.session.execute(Conversation.__table__.insert(), list(summary.values()))
+            db.session.commit()
+        return {
+            'users': args.users, 'rooms': len(room_ids), 'messages': args.messages,
+            'dms': args.dms, 'conversations': len(summary),
+            'seconds': round(time.perf_counter() - start, 2),
+        }
+
+
+# --- کلاینت‌های شبیه‌سازی‌شده ---------------------------------------------
+
+class SimClient:
+    """یک کاربر واردشده با test client خودش؛ ورود از طریق نشست تا bcrypt در اندازه‌گیری نباشد"""
+
+    def __init__(self, app, user, friend, room_slug):
+        self.user = user
+        self.friend_id = friend.id
+        self.friend_code = friend.code
+        self.room_slug = room_slug
+        self.http = app.test_client()
+        with self.http.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+        self.socket = None
+
+    def url(self, route):
+        return {
+            'dashboard': '/dashboard',
+            'my_messages': '/my_messages',
+            'dm': f'/dm/{self.friend_code}',
+            'room': f'/r/{self.room_slug}',
+        }[route]
+
+
+def make_clients(app, count, seed_value):
+    from models import db, User, Room, Conversation
+
+    rng = random.Random(seed_value)
+    with app.app_context():
+        rows = db.session.query(Conversation.user_a_id, Conversation.user_b_id).limit(count * 20).all()
+        slugs = [slug for (slug,) in db.session.query(Room.slug)]
+        if not rows:
+            raise SystemExit('database has no conversations; seed it first')
+        picked = rng.sample(rows, min(count, len(rows)))
+        users = {u.id: u for u in User.query.filter(
+            User.id.in_({uid for pair in picked for uid in pair}))}
+        clients = []
+        for a_id, b_id in picked:
+            user, friend = users[a_id], users[b_id]
+            db.session.expunge(user)
+            clients.append(SimClient(app, user, friend, rng.choice(slugs)))
+    return clients
+
+
+def run_concurrent(clients, operation, per_client):
+    """اجرای همزمان operation(client, i) توسط همه کلاینت‌ها؛ خروجی تأخیرها، خطاها و زمان کل"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    barrier = threading.Barrier(len(clients) + 1)
+
+    def worker(client):
+        local, failed = [], 0
+        barrier.wait()
+        for i in range(per_client):
+            start = time.perf_counter()
+            try:
+                ok = operation(client, i)
+            except Exception:
+                ok = False
+            local.append(time.perf_counter() - start)
+            failed += not ok
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker, args=(c,)) for c in clients]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    return latencies, errors[0], time.perf_counter() - start
+
+
+def bench_route(clients, route, per_client):
+    def get(client, i):
+        return client.http.get(client.url(route)).status_code == 200
+    return summarize(*run_concurrent(clients, get, per_client))
+
+
+def bench_event(app, socketio, clients, event, per_client, sync_gap=20):
+    from persistence import message_writer
+    from receipts import receipts
+
+    for client in clients:
+        if client.socket is None:
+            client.socket = socketio.test_client(app, flask_test_client=client.http)
+            client.socket.emit('join', {'room': client.room_slug})
+
+    if event == 'sync':
+        # کلاینتی که پس از اتصال دوباره sync_gap پیام از اتاقش عقب است
+        for client in clients:
+            probe = client.socket.emit('sync', {'room': client.room_slug, 'after': 2 ** 62}, callback=True)
+            client.sync_after = max(probe['last_seq'] - sync_gap, 0)
+
+    if event == 'read':
+        # گزارش‌های پیاپی از پایین‌ترین پیام خوانده‌نشده تا آخر مکالمه، مانند اسکرول
+        for client in clients:
+            probe = client.socket.emit('sync', {'friend_id': client.friend_id, 'after': 2 ** 62},
+                                       callback=True)
+            client.read_last = probe['last_seq']
+
+    def send(client, i):
+        if event == 'read':
+            seq = max(client.read_last - per_client + i + 1, 1)
+            ack = client.socket.emit('read', {'friend_id': client.friend_id, 'seq': seq}, callback=True)
+            return bool(ack and ack.get('ok'))
+        if event == 'sync':
+            ack = client.socket.emit('sync', {'room': client.room_slug, 'after': client.sync_after},
+                                     callback=True)
+            return bool(ack and ack.get('ok') and not ack.get('reset'))
+        if event == 'message':
+            ack = client.socket.emit('message', {'room': client.room_slug, 'msg': f'bench {i}'}, callback=True)
+        else:
+            ack = client.socket.emit('dm', {'to': client.friend_code, 'msg': f'bench {i}'}, callback=True)
+        # پیام‌های پخش‌شده در صف test client جمع می‌شوند
+        if i % 50 == 0:
+            client.socket.get_received()
+        return bool(ack and ack.get('ok'))
+
+    result = summarize(*run_concurrent(clients, send, per_client))
+    if event == 'read':
+        # نوشتن دسته‌ای گزارش‌های جمع‌شده؛ همان کاری که کار پس‌زمینه هر READ_RECEIPT_INTERVAL می‌کند
+        flush = time.perf_counter()
+        receipts.flush()
+        result['flush_seconds'] = round(time.perf_counter() - flush, 3)
+    # صف write-behind پیش از مرحله بعد خالی می‌شود تا نوشتن‌ها روی آن اثر نگذارند
+    drain = time.perf_counter()
+    message_writer.stop()
+    result['drain_seconds'] = round(time.perf_counter() - drain, 3)
+    return result
+
+
+# --- خروجی ---------------------------------------------------------------
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(results, baseline=None):
+    print(f'{"name":<18}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"errors":>8}', file=sys.stderr)
+    for name, r in results.items():
+        line = (f'{name:<18}{r["throughput"] or 0:>10,.0f}{r["p50_ms"] or 0:>10.2f}'
+                f'{r["p95_ms"] or 0:>10.2f}{r["p99_ms"] or 0:>10.2f}{r["errors"]:>8}')
+        old = (baseline or {}).get(name)
+        if old and old.get('p50_ms') and old.get('throughput') and r['p50_ms']:
+            line += (f'   p50 {r["p50_ms"] / old["p50_ms"]:.2f}x, '
+                     f'req/s {(r["throughput"] or 0) / old["throughput"]:.2f}x vs baseline')
+        print(line, file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help='مسیر دیتابیس؛ اگر از قبل پر باشد دوباره پر نمی‌شود')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--rooms', type=int, default=10)
+    parser.add_argument('--friends', type=int, default=5, help='مکالمه‌های هر کاربر با کاربران بعدی')
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--dms', type=int, default=200000)
+    parser.add_argument('--unread', type=int, default=1000, help='تعداد DMهای خوانده‌نشده آخر')
+    parser.add_argument('--days', type=int, default=365, help='بازه زمانی پیام‌های پرشده')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--clients', type=int, default=16, help='کلاینت‌های همزمان')
+    parser.add_argument('--requests', type=int, default=50, help='درخواست هر کلاینت برای هر مسیر')
+    parser.add_argument('--events', type=int, default=200, help='رویداد هر کلاینت برای هر نوع')
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--sync-gap', type=int, default=20, help='پیام‌های از دست رفته در هر sync')
+    parser.add_argument('--durable-ack', action='store_true', help='ack پس از commit پیام')
+    parser.add_argument('--only', nargs='+', choices=ROUTES + EVENT_NAMES,
+                        default=ROUTES + EVENT_NAMES)
+    parser.add_argument('--output', help='فایل JSON نتایج (پیش‌فرض stdout)')
+    parser.add_argument('--compare', help='فایل JSON اجرای قبلی برای مقایسه')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.abspath(args.db) if args.db else os.path.join(tmp, 'bench.db')
+        configure_env(path, args)
+
+        from app import app, socketio
+        from migrations import upgrade, seed_defaults
+        from persistence import message_writer
+
+        with app.app_context():
+            upgrade()
+            seed_defaults()
+        seeded = seed(app, args)
+        if seeded:
+            print(f'seeded {seeded}', file=sys.stderr)
+        clients = make_clients(app, args.clients, args.seed)
+
+        results = {}
+        for route in [r for r in ROUTES if r in args.only]:
+            clients[0].http.get(clients[0].url(route))
+            results[route] = bench_route(clients, route, args.requests)
+        for event, name in zip(EVENTS, EVENT_NAMES):
+            if name not in args.only:
+                continue
+            results[name] = bench_event(app, socketio, clients, event, args.events, args.sync_gap)
+        for client in clients:
+            if client.socket is not None:
+                client.socket.disconnect()
+        message_writer.stop()
+
+    report = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+            'seeded': seeded,
+        },
+        'results': results,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    print_table(results, baseline)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
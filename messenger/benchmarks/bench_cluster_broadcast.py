@@ -0,0 +1,120 @@
+"""آزمون بار پخش پیام بین چند پردازه از طریق cluster.py
+
+یک خوشه با صف SQLite بالا می‌آید، کلاینت‌ها از طریق پراکسی وصل می‌شوند
+(و در نتیجه روی پردازه‌های مختلف قرار می‌گیرند)، همه عضو یک اتاق می‌شوند
+و پیام‌های یک فرستنده باید به همه کلاینت‌ها روی همه پردازه‌ها برسد.
+نیازمند python-socketio[client].
+
+    python benchmarks/bench_cluster_broadcast.py --workers 3 --clients 30 --messages 20
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import requests
+import socketio
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'port {port} did not open')
+
+
+def register(base, name):
+    session = requests.Session()
+    resp = session.post(f'{base}/register', data={
+        'username': name, 'email': f'{name}@example.com', 'password': 'bench123'
+    })
+    resp.raise_for_status()
+    return session
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--clients', type=int, default=30)
+    parser.add_argument('--messages', type=int, default=20)
+    parser.add_argument('--port', type=int, default=5600)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    env = dict(os.environ,
+               MESSENGER_SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+               MESSENGER_WTF_CSRF_ENABLED='false')
+    cluster = subprocess.Popen(
+        [sys.executable, 'cluster.py', '--workers', str(args.workers), '--port', str(args.port),
+         '--queue', f"sqlite:///{os.path.join(tmp, 'queue.db')}"],
+        cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base = f'http://127.0.0.1:{args.port}'
+    try:
+        # پراکسی پس از آماده شدن همه پردازه‌ها پورت را باز می‌کند
+        wait_for_port(args.port, timeout=60)
+
+        received = Counter()
+        latencies = []
+        lock = threading.Lock()
+        clients = []
+        for i in range(args.clients):
+            client = socketio.Client(http_session=register(base, f'bench{i}'))
+
+            def on_message(data, idx=i):
+                sent_at = float(data['msg'].split('|')[1])
+                with lock:
+                    received[idx] += 1
+                    latencies.append(time.time() - sent_at)
+
+            client.on('message', on_message)
+            client.connect(base, wait_timeout=10)
+            client.emit('join', {'room': 'general'})
+            clients.append(client)
+
+        per_worker = Counter(c.eio.sid.split('.', 1)[0] for c in clients)
+        print(f'clients per worker: {dict(sorted(per_worker.items()))}')
+        time.sleep(1.0)
+
+        sender = clients[0]
+        start = time.time()
+        for n in range(args.messages):
+            sender.emit('message', {'room': 'general', 'msg': f'bench {n}|{time.time()}'})
+        expected = args.clients * args.messages
+        deadline = time.time() + 30
+        while sum(received.values()) < expected and time.time() < deadline:
+            time.sleep(0.05)
+        elapsed = time.time() - start
+
+        delivered = sum(received.values())
+        print(f'delivered {delivered}/{expected} in {elapsed:.2f}s '
+              f'({delivered / elapsed:,.0f} deliveries/s)')
+        if latencies:
+            latencies.sort()
+            print(f'fan-out latency p50={statistics.median(latencies) * 1000:.1f}ms '
+                  f'p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f}ms')
+        missing = [i for i in range(args.clients) if received[i] < args.messages]
+        print('every client on every worker received the broadcast' if not missing
+              else f'clients missing messages: {missing}')
+
+        for client in clients:
+            client.disconnect()
+    finally:
+        cluster.terminate()
+        cluster.wait()
+
+
+if __name__ == '__main__':
+    main()
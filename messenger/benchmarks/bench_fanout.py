@@ -0,0 +1,130 @@
+"""بنچمارک پخش پیام در اتاق بزرگ: emit مستقیم در برابر صف‌های پخش fanout
+
+یک اتاق با --members اتصال ساختگی Engine.IO (با صف خروجی واقعی) ساخته
+می‌شود و یک فرستنده واقعی با test client رویداد message می‌فرستد. برای
+هر اندازه اتاق زمان هندلر فرستنده و زمان رسیدن بسته به همه اعضا در هر دو
+حالت اندازه‌گیری می‌شود. پنجره ارسال --slow عضو از ابتدا پر است و هرگز
+probe را تأیید نمی‌کنند تا سیاست مصرف‌کننده کند (در اینجا drop) هم سنجیده شود.
+
+اجرا از پوشه messenger:
+    python benchmarks/bench_fanout.py --members 5000 --messages 100
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, HERE)
+
+from bench_app import summarize
+
+
+def build_room(server, fanout, slug, members, slow, limit):
+    """اعضای ساختگی با شیء Socket واقعی engineio؛ پنجره ارسال slow عضو اول از ابتدا پر است"""
+    from engineio.socket import Socket
+
+    sockets = []
+    for i in range(members):
+        eio_sid = f'{slug}-{i}'
+        socket = Socket(server.eio, eio_sid)
+        socket.connected = True
+        server.eio.sockets[eio_sid] = socket
+        sid = server.manager.connect(eio_sid, '/')
+        server.manager.enter_room(sid, '/', slug)
+        if i < slow:
+            fanout.ack(sid, 0)
+            fanout._windows[sid].sent = limit
+        sockets.append(socket)
+    return sockets[slow:]
+
+
+def clear(sockets):
+    for socket in sockets:
+        while socket.queue.qsize():
+            socket.queue.get()
+
+
+def run_round(socketio, fanout, sender, slug, messages, sockets, use_fanout):
+    fanout.enabled = use_fanout
+    latencies = []
+    start = time.perf_counter()
+    for i in range(messages):
+        began = time.perf_counter()
+        ack = sender.emit('message', {'room': slug, 'msg': f'bench {i}'}, callback=True)
+        latencies.append(time.perf_counter() - began)
+        if not (ack and ack.get('ok')):
+            raise SystemExit(f'message rejected: {ack}')
+    # کارهای پخش فقط با واگذاری اجرا (gevent) یا در نخ‌های خودشان پیش می‌روند
+    while fanout.backlog or fanout._rooms or any(s.queue.qsize() < messages for s in sockets):
+        socketio.sleep(0.001)
+    delivered = time.perf_counter() - start
+    sender.get_received()
+    result = summarize(latencies, 0, sum(latencies))
+    result['delivery_seconds'] = round(delivered, 3)
+    clear(sockets)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--members', type=int, nargs='+', default=[10, 1000, 5000])
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--slow', type=int, default=10, help='اعضای کند در هر اتاق')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ['MESSENGER_SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+    os.environ['MESSENGER_WTF_CSRF_ENABLED'] = 'false'
+    os.environ['MESSENGER_FANOUT_SLOW_POLICY'] = 'drop'
+    # کلاینت‌های شبیه‌سازی‌شده بی‌وقفه می‌فرستند؛ محدودیت flood اندازه‌گیری را خراب می‌کند
+    for scope in ('CONNECTION', 'USER', 'ROOM'):
+        os.environ[f'MESSENGER_FLOOD_{scope}_BURST'] = os.environ[f'MESSENGER_FLOOD_{scope}_RATE'] = '1e9'
+
+    from app import app, socketio
+    from fanout import fanout
+    from migrations import upgrade, seed_defaults
+    from models import db, Room
+    from persistence import message_writer
+
+    with app.app_context():
+        upgrade()
+        seed_defaults()
+
+    limit = app.config['FANOUT_CLIENT_QUEUE_MAX']
+    http = app.test_client()
+    http.post('/register', data={'username': 'bench-sender', 'email': 'sender@example.com',
+                                 'password': 'bench123'})
+    sender = socketio.test_client(app, flask_test_client=http)
+    server = socketio.server
+    # test client ارسال را برای همه اتصال‌ها جایگزین می‌کند؛ اعضای ساختگی مسیر واقعی engineio را می‌گیرند
+    mock_send = server._send_eio_packet
+
+    def send_eio_packet(eio_sid, pkt):
+        socket = server.eio.sockets.get(eio_sid)
+        if socket is None:
+            return mock_send(eio_sid, pkt)
+        socket.send(pkt)
+    server._send_eio_packet = send_eio_packet
+    print(f'async mode: {server.async_mode}', file=sys.stderr)
+
+    print(f'{"members":>8}{"mode":>9}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}'
+          f'{"delivered s":>13}{"dropped":>9}')
+    for members in args.members:
+        slug = f'bench-{members}'
+        with app.app_context():
+            db.session.add(Room(slug=slug, title=slug))
+            db.session.commit()
+        sender.emit('join', {'room': slug})
+        sockets = build_room(server, fanout, slug, members, min(args.slow, members), limit)
+        for mode in ('direct', 'fanout'):
+            dropped = fanout.stats['dropped']
+            r = run_round(socketio, fanout, sender, slug, args.messages, sockets, mode == 'fanout')
+            print(f'{members:>8}{mode:>9}{r["p50_ms"]:>10.3f}{r["p95_ms"]:>10.3f}{r["p99_ms"]:>10.3f}'
+                  f'{r["delivery_seconds"]:>13.3f}{fanout.stats["dropped"] - dropped:>9}')
+        message_writer.stop()
+
+
+if __name__ == '__main__':
+    main()
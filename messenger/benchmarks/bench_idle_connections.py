@@ -0,0 +1,160 @@
+"""بنچمارک نگه داشتن تعداد زیادی اتصال websocket بیکار روی server.py
+
+یک سرور gevent/eventlet بالا می‌آید، تعداد زیادی کلاینت Socket.IO ساده
+(websocket خام با asyncio) وصل و بیکار می‌مانند و به ping سرور پاسخ می‌دهند؛
+حافظه سرور پیش و پس از اتصال‌ها گزارش می‌شود.
+
+    python benchmarks/bench_idle_connections.py --clients 10000 --hold 30
+"""
+import argparse
+import asyncio
+import base64
+import os
+import resource
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def rss_kb(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def frame(text):
+    """ساخت فریم متنی masked طبق RFC 6455"""
+    payload = text.encode()
+    mask = os.urandom(4)
+    header = bytes([0x81])
+    if len(payload) < 126:
+        header += bytes([0x80 | len(payload)])
+    else:
+        header += bytes([0x80 | 126]) + struct.pack('!H', len(payload))
+    return header + mask + bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+
+async def read_frame(reader):
+    first, second = await reader.readexactly(2)
+    length = second & 0x7f
+    if length == 126:
+        length = struct.unpack('!H', await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', await reader.readexactly(8))[0]
+    data = await reader.readexactly(length)
+    return first & 0x0f, data.decode(errors='replace')
+
+
+class IdleClient:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.connected = False
+
+    async def run(self, stop):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        key = base64.b64encode(os.urandom(16)).decode()
+        writer.write((
+            'GET /socket.io/?EIO=4&transport=websocket HTTP/1.1\r\n'
+            f'Host: {self.host}:{self.port}\r\n'
+            'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+            f'Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n'
+        ).encode())
+        head = await reader.readuntil(b'\r\n\r\n')
+        if b' 101 ' not in head.split(b'\r\n', 1)[0]:
+            raise RuntimeError(head.split(b'\r\n', 1)[0].decode())
+        await read_frame(reader)          # engine.io open
+        writer.write(frame('40'))         # socket.io connect
+        await read_frame(reader)          # socket.io connect ack
+        self.connected = True
+        try:
+            while not stop.is_set():
+                opcode, data = await read_frame(reader)
+                if opcode == 0x8:
+                    break
+                if data == '2':           # engine.io ping -> pong
+                    writer.write(frame('3'))
+        finally:
+            writer.close()
+
+
+async def open_clients(host, port, count, concurrency, stop):
+    clients = [IdleClient(host, port) for _ in range(count)]
+    gate = asyncio.Semaphore(concurrency)
+    tasks = []
+
+    async def start(client):
+        async with gate:
+            task = asyncio.ensure_future(client.run(stop))
+            while not client.connected and not task.done():
+                await asyncio.sleep(0.01)
+            return task
+
+    started = time.perf_counter()
+    tasks = await asyncio.gather(*(start(c) for c in clients))
+    return clients, tasks, time.perf_counter() - started
+
+
+async def bench(args, server_pid):
+    stop = asyncio.Event()
+    base = rss_kb(server_pid)
+    clients, tasks, elapsed = await open_clients('127.0.0.1', args.port, args.clients,
+                                                 args.concurrency, stop)
+    connected = sum(1 for c in clients if c.connected)
+    failed = sum(1 for t in tasks if t.done() and t.exception() is not None)
+    print(f'connected {connected}/{args.clients} in {elapsed:.1f}s ({failed} failed)')
+    print(f'server RSS before: {base / 1024:.1f} MiB')
+    await asyncio.sleep(args.hold)
+    after = rss_kb(server_pid)
+    still = sum(1 for t in tasks if not t.done())
+    print(f'server RSS after {args.hold}s idle: {after / 1024:.1f} MiB '
+          f'(~{(after - base) / max(connected, 1):.1f} KiB per connection, {still} still open)')
+    stop.set()
+    for task in tasks:
+        task.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--hold', type=float, default=30)
+    parser.add_argument('--port', type=int, default=5800)
+    parser.add_argument('--async-mode', default='gevent')
+    args = parser.parse_args()
+
+    # هر اتصال یک file descriptor در هر دو طرف مصرف می‌کند
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, max(soft, args.clients * 2 + 1000)), hard))
+
+    tmp = tempfile.mkdtemp()
+    env = dict(os.environ, MESSENGER_SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+    server = subprocess.Popen(
+        [sys.executable, 'server.py', '--port', str(args.port), '--async-mode', args.async_mode],
+        cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', args.port), timeout=0.5).close()
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.2)
+        asyncio.run(bench(args, server.pid))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""بنچمارک نویسنده‌های همزمان SQLite: پروفایل default در برابر production
+
+چند نخ نویسنده هر پیام را جداگانه commit می‌کنند (مانند حالت همگام
+MESSAGE_WRITE_BEHIND=false) و همزمان چند نخ خواننده تاریخچه می‌خوانند.
+برای هر پروفایل تعداد پیام در ثانیه و خطاهای database is locked گزارش می‌شود.
+
+اجرا از پوشه messenger:
+    python benchmarks/bench_sqlite_profile.py --writers 8 --readers 4 --duration 5
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy.exc import OperationalError
+from models import db, User, Room, Message
+from storage import Storage, retry_on_lock, is_lock_error, lock_stats
+
+
+def make_app(path, profile, seed):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['STORAGE_PROFILE'] = profile
+    storage = Storage(app)
+    db.init_app(app)
+    storage.attach(app)
+    with app.app_context():
+        db.create_all()
+        db.session.add(Room(slug='bench', title='bench'))
+        db.session.add(User(username='bench', email='bench@example.com',
+                            password_hash='x', code='0000000'))
+        db.session.commit()
+        now = datetime.utcnow()
+        db.session.execute(Message.__table__.insert(), [
+            {'room_id': 1, 'user_id': 1, 'content': f'seed {i}', 'created_at': now}
+            for i in range(seed)
+        ])
+        db.session.commit()
+    return app
+
+
+def bench(path, profile, writers, readers, duration, seed):
+    app = make_app(path, profile, seed)
+    # پروفایل default رفتار پیشین را بازسازی می‌کند: بدون تلاش دوباره
+    retry = profile != 'default'
+    counts = {'written': 0, 'lock_errors': 0, 'reads': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def write_one(i):
+        db.session.add(Message(room_id=1, user_id=1, content=f'msg {i}',
+                               created_at=datetime.utcnow()))
+        db.session.commit()
+
+    def writer():
+        with app.app_context():
+            i = 0
+            while time.perf_counter() < deadline:
+                try:
+                    if retry:
+                        retry_on_lock(write_one, i)
+                    else:
+                        write_one(i)
+                    key = 'written'
+                except OperationalError as exc:
+                    if not is_lock_error(exc):
+                        raise
+                    db.session.rollback()
+                    key = 'lock_errors'
+                with lock:
+                    counts[key] += 1
+                i += 1
+
+    def reader():
+        with app.app_context():
+            while time.perf_counter() < deadline:
+                try:
+                    Message.query.filter_by(room_id=1).order_by(
+                        Message.created_at.desc(), Message.id.desc()).limit(200).all()
+                    Message.query.filter(Message.content.like('%9%')).count()
+                    key = 'reads'
+                except OperationalError as exc:
+                    if not is_lock_error(exc):
+                        raise
+                    key = 'lock_errors'
+                db.session.rollback()
+                with lock:
+                    counts[key] += 1
+
+    retries_before = lock_stats['retries']
+    threads = [threading.Thread(target=writer) for _ in range(writers)]
+    threads += [threading.Thread(target=reader) for _ in range(readers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    with app.app_context():
+        db.engine.dispose()
+    counts['retries'] = lock_stats['retries'] - retries_before
+    return counts, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--seed', type=int, default=20000, help='پیام‌های موجود پیش از شروع')
+    parser.add_argument('--profiles', nargs='+', default=['default', 'production'])
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for profile in args.profiles:
+            counts, elapsed = bench(os.path.join(tmp, f'{profile}.db'), profile,
+                                    args.writers, args.readers, args.duration, args.seed)
+            results[profile] = counts['written'] / elapsed
+            print(f'{profile:<11}: {counts["written"] / elapsed:,.0f} msg/s, '
+                  f'{counts["reads"] / elapsed:,.0f} reads/s, '
+                  f'{counts["lock_errors"]} lock errors, {counts["retries"]} retries')
+    if 'default' in results and 'production' in results and results['default']:
+        print(f'speedup     : {results["production"] / results["default"]:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
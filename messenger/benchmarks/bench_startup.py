@@ -0,0 +1,108 @@
+"""بنچمارک هزینه راه‌اندازی: import ماژول app، ساخت برنامه و بالا آمدن پردازه server.py
+
+هر اندازه‌گیری در پردازه تازه پایتون انجام می‌شود تا کش import اثر نگذارد.
+برای import و ساخت برنامه زمان و تعداد دستورهای SQL اجراشده گزارش می‌شود؛
+برای پردازه کارگر زمان از اجرای server.py تا پذیرفتن اولین اتصال TCP.
+اولین اجرای server.py روی دیتابیس خالی است (مهاجرت و داده اولیه، cold) و
+اجراهای بعدی با --worker-args مانند پردازه‌های cluster.py (warm)؛ در پایان
+--parallel کارگر همزمان روی یک دیتابیس بالا می‌آیند.
+
+اجرا از پوشه messenger:
+    python benchmarks/bench_startup.py --runs 5
+"""
+import argparse
+import json
+import os
+import shlex
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# پیش از import برنامه شمارنده دستورهای SQL روی همه Engineها ثبت می‌شود
+PROBE = '''
+import json, time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+statements = [0]
+def count(*args):
+    statements[0] += 1
+event.listen(Engine, 'before_cursor_execute', count)
+start = time.perf_counter()
+import app as module
+imported, at_import = time.perf_counter(), statements[0]
+module.app
+built = time.perf_counter()
+print(json.dumps({'import_ms': (imported - start) * 1000, 'app_ms': (built - imported) * 1000,
+                  'import_statements': at_import, 'app_statements': statements[0] - at_import}))
+'''
+
+
+def probe(env):
+    out = subprocess.run([sys.executable, '-c', PROBE], cwd=HERE, env=env, check=True,
+                         capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def boot(env, port, extra, count=1):
+    """زمان از اجرای count پردازه server.py تا پذیرفتن اتصال در همه، به میلی‌ثانیه"""
+    start = time.perf_counter()
+    servers = [subprocess.Popen([sys.executable, 'server.py', '--port', str(port + i)] + extra,
+                                cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+               for i in range(count)]
+    try:
+        deadline = time.time() + 60
+        for i, server in enumerate(servers):
+            while True:
+                try:
+                    socket.create_connection(('127.0.0.1', port + i), timeout=0.5).close()
+                    break
+                except OSError:
+                    if server.poll() is not None:
+                        raise SystemExit(f'server.py exited with {server.returncode}')
+                    if time.time() > deadline:
+                        raise
+                    time.sleep(0.01)
+        return (time.perf_counter() - start) * 1000
+    finally:
+        for server in servers:
+            server.terminate()
+        for server in servers:
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--port', type=int, default=5900)
+    parser.add_argument('--parallel', type=int, default=8, help='کارگرهای همزمان در اجرای آخر')
+    parser.add_argument('--worker-args', default='--no-migrate',
+                        help='آرگومان‌های server.py در اجراهای warm')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    env = dict(os.environ, MESSENGER_SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+
+    cold = boot(env, args.port, [])
+    extra = shlex.split(args.worker_args)
+    probes = [probe(env) for _ in range(args.runs)]
+    boots = [boot(env, args.port, extra) for _ in range(args.runs)]
+    together = [boot(env, args.port, extra, args.parallel) for _ in range(args.runs)]
+
+    print(f'{"phase":<22}{"median ms":>12}{"min ms":>10}{"statements":>12}')
+    for name, key in (('import app', 'import'), ('create app', 'app')):
+        values = [p[f'{key}_ms'] for p in probes]
+        print(f'{name:<22}{statistics.median(values):>12.1f}{min(values):>10.1f}'
+              f'{probes[-1][f"{key}_statements"]:>12}')
+    print(f'{"worker boot (cold)":<22}{cold:>12.1f}{cold:>10.1f}{"":>12}')
+    print(f'{"worker boot (warm)":<22}{statistics.median(boots):>12.1f}{min(boots):>10.1f}{"":>12}')
+    name = f'{args.parallel} workers (warm)'
+    print(f'{name:<22}{statistics.median(together):>12.1f}{min(together):>10.1f}{"":>12}')
+
+
+if __name__ == '__main__':
+    main()
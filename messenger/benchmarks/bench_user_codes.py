@@ -0,0 +1,125 @@
+"""بنچمارک ثبت‌نام در فضای کد پرشده: جست‌وجوی تصادفی قدیمی در برابر user_codes
+
+جدول user با --occupancy از ۱۰ میلیون کد ۷ رقمی (کدهای تصادفی، مانند
+داده‌های پیش از تخصیص‌دهنده) پر می‌شود، سپس --workers نخ همزمان کاربر
+ثبت می‌کنند. برای هر روش توان عملیاتی، کوئری به ازای هر ثبت‌نام و تعداد
+ثبت‌نام‌هایی که با IntegrityError شکست خوردند (در برنامه یعنی خطای ۵۰۰) گزارش می‌شود.
+هش رمز ثابت است تا bcrypt در اندازه‌گیری نباشد.
+
+اجرا از پوشه messenger:
+    python benchmarks/bench_user_codes.py --occupancy 0.9 --registrations 2000
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def legacy_code(db, User):
+    """روش قبلی: کد تصادفی و یک کوئری برای هر تلاش"""
+    while True:
+        code = ''.join(random.choices(string.digits, k=7))
+        if not User.query.filter_by(code=code).first():
+            return code
+
+
+def seed(app, db, User, occupancy, rng):
+    chunk = 100000
+    with app.app_context():
+        taken = {int(code) for (code,) in db.session.query(User.code)}
+        codes = [c for c in rng.sample(range(10 ** 7), int(10 ** 7 * occupancy)) if c not in taken]
+        count = len(codes)
+        start = time.perf_counter()
+        for offset in range(0, count, chunk):
+            db.session.execute(User.__table__.insert(), [
+                {'username': f'seed{n}', 'email': f'seed{n}@example.com', 'password_hash': 'x',
+                 'code': f'{codes[n]:07d}', 'is_admin': False, 'is_active': True}
+                for n in range(offset, min(count, offset + chunk))
+            ])
+            db.session.commit()
+        return count, time.perf_counter() - start
+
+
+def run(app, db, User, name, register, registrations, workers):
+    statements = [0]
+    errors = [0]
+    lock = threading.Lock()
+
+    def count(*args):
+        with lock:
+            statements[0] += 1
+
+    def worker(index, n):
+        with app.app_context():
+            for i in range(n):
+                user = User(username=f'{name}-{index}-{i}', email=f'{name}-{index}-{i}@example.com',
+                            password_hash='x')
+                try:
+                    register(user)
+                except IntegrityError:
+                    db.session.rollback()
+                    with lock:
+                        errors[0] += 1
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count)
+    per_worker = registrations // workers
+    threads = [threading.Thread(target=worker, args=(i, per_worker)) for i in range(workers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    event.remove(engine, 'before_cursor_execute', count)
+    total = per_worker * workers
+    print(f'{name:<10}{total / elapsed:>12,.0f}{statements[0] / total:>14.2f}{errors[0]:>10}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--occupancy', type=float, default=0.5, help='سهم کدهای گرفته‌شده از ۱۰ میلیون')
+    parser.add_argument('--registrations', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ['MESSENGER_SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+
+    from app import app
+    from codes import user_codes
+    from migrations import upgrade, seed_defaults
+    from models import db, User
+
+    with app.app_context():
+        upgrade()
+        seed_defaults()
+    count, seconds = seed(app, db, User, args.occupancy, random.Random(args.seed))
+    print(f'seeded {count:,} codes in {seconds:.1f}s', file=sys.stderr)
+    # بلوکی که هنگام ساخت کاربر admin رزرو شد پیش از پر شدن جدول فیلتر شده است
+    user_codes.discard()
+
+    def legacy(user):
+        user.code = legacy_code(db, User)
+        db.session.add(user)
+        db.session.commit()
+
+    print(f'{"method":<10}{"users/s":>12}{"queries/user":>14}{"errors":>10}')
+    run(app, db, User, 'legacy', legacy, args.registrations, args.workers)
+    run(app, db, User, 'allocator', user_codes.add_user, args.registrations, args.workers)
+    print(user_codes.stats, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""بنچمارک نوشتن پیام: commit به ازای هر پیام در برابر صف write-behind
+
+اجرا از پوشه messenger:
+    python benchmarks/bench_write_behind.py --messages 5000 --producers 4
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from models import db, User, Room, Message
+from persistence import MessageWriter
+
+
+def make_app(path, **config):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config.update(config)
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        if not Room.query.first():
+            db.session.add(Room(slug='bench', title='bench'))
+            db.session.add(User(username='bench', email='bench@example.com',
+                                password_hash='x', code='0000000'))
+            db.session.commit()
+    return app
+
+
+def run_producers(producers, count, produce):
+    per_thread = count // producers
+    threads = [threading.Thread(target=produce, args=(per_thread,)) for _ in range(producers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return start, per_thread * producers
+
+
+def bench_per_message(path, count, producers):
+    app = make_app(path)
+
+    def produce(n):
+        with app.app_context():
+            for i in range(n):
+                db.session.add(Message(room_id=1, user_id=1, content=f'msg {i}',
+                                       created_at=datetime.utcnow()))
+                db.session.commit()
+
+    start, total = run_producers(producers, count, produce)
+    return total, time.perf_counter() - start
+
+
+def bench_batched(path, count, producers, batch_size, interval):
+    app = make_app(path, MESSAGE_BATCH_SIZE=batch_size, MESSAGE_FLUSH_INTERVAL=interval)
+    writer = MessageWriter(app)
+    last = []
+
+    def produce(n):
+        pending = None
+        for i in range(n):
+            pending = writer.submit(Message(room_id=1, user_id=1, content=f'msg {i}',
+                                            created_at=datetime.utcnow()))
+        last.append(pending)
+
+    start, total = run_producers(producers, count, produce)
+    enqueued = time.perf_counter() - start
+    writer.stop()
+    durable = time.perf_counter() - start
+    assert all(p.durable for p in last)
+    return total, enqueued, durable, writer.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--producers', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--interval', type=float, default=0.05)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        total, elapsed = bench_per_message(os.path.join(tmp, 'per_message.db'),
+                                           args.messages, args.producers)
+        print(f'per-message commit : {total} msgs in {elapsed:.2f}s -> {total / elapsed:,.0f} msg/s')
+
+        total, enqueued, durable, stats = bench_batched(
+            os.path.join(tmp, 'batched.db'), args.messages, args.producers,
+            args.batch_size, args.interval)
+        print(f'write-behind enqueue: {total} msgs in {enqueued:.2f}s -> {total / enqueued:,.0f} msg/s')
+        print(f'write-behind durable: {total} msgs in {durable:.2f}s -> {total / durable:,.0f} msg/s '
+              f'({stats["batches"]} batches, {stats["failed"]} failed)')
+        print(f'speedup (durable)   : {elapsed / durable:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+import threading
+import time
+from collections import OrderedDict
+
+from markupsafe import Markup
+from sqlalchemy.orm import make_transient_to_detached
+
+from models import db, User, Room
+from concurrency import run_in_app_context
+from cluster import cluster_events
+
+_MISSING = object()
+
+class LRUCache:
+    """کش LRU با اندازه محدود و زمان انقضا، امن برای چند نخ"""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires = entry
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses}
+
+def _snapshot(obj):
+    """کپی جدا (detached) از ستون‌های یک شیء تا بتوان آن را بین نشست‌ها نگه داشت"""
+    mapper = obj.__mapper__
+    copy = mapper.class_(**{attr.key: getattr(obj, attr.key) for attr in mapper.column_attrs})
+    make_transient_to_detached(copy)
+    return copy
+
+class LookupCache:
+    """کش جست‌وجوهای پرتکرار: کاربر بر اساس id و کد، اتاق بر اساس slug
+
+    کاربر به صورت کپی جدا نگه داشته می‌شود و هنگام استفاده با
+    merge(load=False) بدون کوئری به نشست جاری متصل می‌شود. ویرایش‌های
+    ادمین باید invalidate_user را صدا بزنند؛ حذف از طریق cluster_events به
+    همه پردازه‌ها می‌رسد تا کاربر غیرفعال‌شده در رویداد بعدی‌اش همه‌جا قطع شود.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.users = LRUCache()
+        self.user_codes = LRUCache()
+        self.rooms = LRUCache()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('USER_CACHE_SIZE', 10000)
+        app.config.setdefault('USER_CACHE_TTL', 30)
+        app.config.setdefault('ROOM_CACHE_SIZE', 1000)
+        app.config.setdefault('ROOM_CACHE_TTL', 300)
+        self.app = app
+        self.users = LRUCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+        self.user_codes = LRUCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+        self.rooms = LRUCache(app.config['ROOM_CACHE_SIZE'], app.config['ROOM_CACHE_TTL'])
+        app.extensions['lookup_cache'] = self
+        cluster_events.on('invalidate_user', self._drop_user)
+        cluster_events.on('invalidate_room', self._drop_room)
+
+    def user(self, user_id):
+        """کاربر متصل به نشست جاری یا None"""
+        snapshot = self.users.get(user_id)
+        if snapshot is None:
+            snapshot = run_in_app_context(self.app, self._load_user, user_id)
+            if snapshot is None:
+                return None
+            self.users.set(user_id, snapshot)
+        return db.session.merge(snapshot, load=False)
+
+    def user_id_by_code(self, code):
+        user_id = self.user_codes.get(code)
+        if user_id is None:
+            user_id = run_in_app_context(self.app, self._load_user_id, code)
+            if user_id is not None:
+                self.user_codes.set(code, user_id)
+        return user_id
+
+    def room_id(self, slug):
+        room_id = self.rooms.get(slug)
+        if room_id is None:
+            room_id = run_in_app_context(self.app, self._load_room_id, slug)
+            if room_id is not None:
+                self.rooms.set(slug, room_id)
+        return room_id
+
+    def invalidate_user(self, user):
+        cluster_events.publish('invalidate_user', {'id': user.id, 'code': user.code})
+
+    def invalidate_room(self, room):
+        cluster_events.publish('invalidate_room', {'slug': room.slug})
+
+    def _drop_user(self, data):
+        self.users.pop(data['id'])
+        self.user_codes.pop(data['code'])
+
+    def _drop_room(self, data):
+        self.rooms.pop(data['slug'])
+
+    def stats(self):
+        return {
+            'users': self.users.stats(),
+            'user_codes': self.user_codes.stats(),
+            'rooms': self.rooms.stats(),
+        }
+
+    @staticmethod
+    def _load_user(user_id):
+        user = db.session.get(User, user_id)
+        return _snapshot(user) if user is not None else None
+
+    @staticmethod
+    def _load_user_id(code):
+        row = db.session.query(User.id).filter_by(code=code).first()
+        return row[0] if row else None
+
+    @staticmethod
+    def _load_room_id(slug):
+        row = db.session.query(Room.id).filter_by(slug=slug).first()
+        return row[0] if row else None
+
+class FragmentCache:
+    """کش HTML بخش‌های مشترک قالب‌ها با کلید وابسته به داده
+
+    کلید هر بخش از داده‌ای ساخته می‌شود که بخش از آن رندر شده است (مثلاً
+    شناسه و خوانده‌نشده مخاطبان)، پس تغییر داده کلید تازه می‌سازد و مقدار
+    کهنه فقط با LRU یا TTL بیرون می‌رود. برای تغییرهایی که در کلید نیستند
+    (ویرایش نام کاربر توسط ادمین) invalidate نسل آن بخش را در همه پردازه‌ها
+    بالا می‌برد.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.cache = LRUCache()
+        self._generations = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FRAGMENT_CACHE_SIZE', 10000)
+        app.config.setdefault('FRAGMENT_CACHE_TTL', 30)
+        self.app = app
+        self.cache = LRUCache(app.config['FRAGMENT_CACHE_SIZE'], app.config['FRAGMENT_CACHE_TTL'])
+        app.extensions['fragment_cache'] = self
+        cluster_events.on('invalidate_fragment', self._bump)
+
+    def render(self, name, key, render):
+        """HTML بخش name برای key؛ render فقط در صورت نبودن در کش صدا زده می‌شود"""
+        full_key = (name, self._generations.get(name, 0), key)
+        html = self.cache.get(full_key)
+        if html is None:
+            html = Markup(render())
+            self.cache.set(full_key, html)
+        return html
+
+    def invalidate(self, name):
+        cluster_events.publish('invalidate_fragment', {'name': name})
+
+    def _bump(self, data):
+        name = data['name']
+        self._generations[name] = self._generations.get(name, 0) + 1
+
+lookup_cache = LookupCache()
+fragment_cache = FragmentCache()
@@ -0,0 +1,337 @@
+"""اجرای چند پردازه پیام‌رسان پشت یک پراکسی با نشست چسبنده
+
+پردازه‌ها اتاق‌ها و پخش پیام را از طریق یک صف پیام مشترک هماهنگ می‌کنند:
+Redis (redis://...) یا برای اجرای محلی بدون Redis یک صف مبتنی بر SQLite
+(sqlite:///...).
+
+    python cluster.py --workers 4 --port 5000
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import pickle
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit, parse_qs
+
+import socketio
+
+# فضای نامی که هیچ کلاینتی به آن وصل نمی‌شود؛ برای پیام‌های داخلی بین پردازه‌ها
+CLUSTER_NAMESPACE = '/cluster'
+
+
+class ClusterEvents:
+    """رویدادهای داخلی که باید در همه پردازه‌ها اجرا شوند (مثل حذف از کش)
+
+    publish روی همان صف پیام Socket.IO فرستاده می‌شود و مدیر صف (ClusterEventsMixin)
+    در هر پردازه، از جمله فرستنده، تابع ثبت‌شده با on را اجرا می‌کند. بدون صف
+    پیام فقط همین پردازه وجود دارد و تابع مستقیم اجرا می‌شود.
+    """
+
+    def __init__(self):
+        self.socketio = None
+        self._handlers = {}
+
+    def init_app(self, app, socketio):
+        self.socketio = socketio
+        self._lock = threading.Lock()
+        app.extensions['cluster_events'] = self
+        app.before_request(self._ensure_listening)
+
+    def on(self, event, handler):
+        self._handlers[event] = handler
+
+    def dispatch(self, event, data):
+        handler = self._handlers.get(event)
+        if handler is not None:
+            handler(data)
+
+    def _ensure_listening(self):
+        """Socket.IO شنیدن صف را با اولین اتصال سوکت شروع می‌کند؛ پردازه‌ای که فقط
+        درخواست HTTP گرفته هم باید حذف از کش را بشنود"""
+        server = self.socketio.server
+        if server.manager_initialized or not isinstance(server.manager, ClusterEventsMixin):
+            return
+        with self._lock:
+            if not server.manager_initialized:
+                server.manager_initialized = True
+                server.manager.initialize()
+
+    def publish(self, event, data):
+        server = self.socketio.server if self.socketio is not None else None
+        if server is not None and isinstance(server.manager, ClusterEventsMixin):
+            self.socketio.emit(event, data, namespace=CLUSTER_NAMESPACE)
+        else:
+            self.dispatch(event, data)
+
+
+cluster_events = ClusterEvents()
+
+
+class ClusterEventsMixin:
+    """تحویل emitهای CLUSTER_NAMESPACE به cluster_events به جای کلاینت‌ها"""
+
+    def _handle_emit(self, message):
+        if message.get('namespace') != CLUSTER_NAMESPACE:
+            return super()._handle_emit(message)
+        # PubSubManager داده یک آرگومانی را در فهرست می‌فرستد
+        cluster_events.dispatch(message['event'], message['data'][0])
+
+
+class ClusterRedisManager(ClusterEventsMixin, socketio.RedisManager):
+    pass
+
+
+class ClusterKombuManager(ClusterEventsMixin, socketio.KombuManager):
+    pass
+
+
+class SQLiteQueueManager(ClusterEventsMixin, socketio.PubSubManager):
+    """مدیر کلاینت Socket.IO که پیام‌های بین پردازه‌ها را در یک فایل SQLite رد و بدل می‌کند
+
+    جایگزین محلی Redis برای اجرا روی یک ماشین؛ هر پردازه ردیف‌های تازه را
+    با فاصله poll_interval می‌خواند و ردیف‌های قدیمی‌تر از retention حذف می‌شوند.
+    """
+    name = 'sqlite'
+
+    def __init__(self, url='sqlite:///socketio-queue.db', channel='flask-socketio',
+                 write_only=False, logger=None, poll_interval=0.02, retention=30):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.path = url[len('sqlite:///'):]
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._published = 0
+        # یک اتصال مشترک برای انتشار (با قفل) و یک اتصال جدا برای شنیدن
+        self._conn = self._connect()
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS socketio_queue ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, '
+            'payload BLOB NOT NULL, created_at REAL NOT NULL)'
+        )
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _publish(self, data):
+        payload = pickle.dumps(data)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO socketio_queue (channel, payload, created_at) VALUES (?, ?, ?)',
+                (self.channel, payload, now)
+            )
+            self._published += 1
+            if self._published % 1000 == 0:
+                self._conn.execute('DELETE FROM socketio_queue WHERE created_at < ?',
+                                   (now - self.retention,))
+
+    def _listen(self):
+        conn = self._connect()
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM socketio_queue').fetchone()[0]
+        sleep = self.server.sleep if self.server is not None else time.sleep
+        while True:
+            rows = conn.execute(
+                'SELECT id, payload FROM socketio_queue WHERE id > ? AND channel = ? ORDER BY id',
+                (last_id, self.channel)
+            ).fetchall()
+            for row_id, payload in rows:
+                last_id = row_id
+                yield pickle.loads(payload)
+            if not rows:
+                sleep(self.poll_interval)
+
+
+def socketio_queue_options(url, channel='flask-socketio'):
+    """آرگومان‌های SocketIO.init_app برای آدرس صف پیام"""
+    if url.startswith('sqlite:///'):
+        return {'client_manager': SQLiteQueueManager(url, channel=channel)}
+    # مانند انتخاب Flask-SocketIO از روی آدرس، با پشتیبانی از cluster_events
+    if url.startswith(('redis://', 'rediss://')):
+        return {'client_manager': ClusterRedisManager(url, channel=channel)}
+    return {'client_manager': ClusterKombuManager(url, channel=channel)}
+
+
+def tag_session_ids(server, worker_id):
+    """افزودن شناسه پردازه به ابتدای sid تا پراکسی درخواست‌ها را به همان پردازه بفرستد"""
+    eio = server.eio
+    generate = eio.generate_id
+    eio.generate_id = lambda: f'{worker_id}.{generate()}'
+
+
+class StickyProxy:
+    """پراکسی TCP ساده با نشست چسبنده بر اساس پیشوند sid
+
+    درخواست‌های بدون sid (handshake) به صورت گردشی بین پردازه‌ها پخش می‌شوند؛
+    درخواست‌های بعدی با همان sid به پردازه سازنده آن می‌روند. برای اینکه هر
+    درخواست polling جداگانه مسیریابی شود، keep-alive به جز برای websocket بسته می‌شود.
+    """
+
+    def __init__(self, backends):
+        self.backends = backends
+        # چرخه جدا برای handshake سوکت‌ها تا درخواست‌های HTTP معمولی توزیع آنها را به هم نزنند
+        self._next_socket = itertools.cycle(range(len(backends)))
+        self._next_http = itertools.cycle(range(len(backends)))
+
+    def pick(self, target):
+        url = urlsplit(target)
+        sid = (parse_qs(url.query).get('sid') or [''])[0]
+        prefix = sid.split('.', 1)[0]
+        if prefix.isdigit() and int(prefix) < len(self.backends):
+            return int(prefix)
+        if url.path.startswith('/socket.io'):
+            return next(self._next_socket)
+        return next(self._next_http)
+
+    async def handle(self, reader, writer):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            return
+        lines = head.decode('latin-1').split('\r\n')
+        target = lines[0].split(' ')[1] if ' ' in lines[0] else '/'
+        upgrade = any(line.lower().startswith('upgrade:') for line in lines)
+        head = self._forwarded_for(head, writer.get_extra_info('peername')[0])
+        if not upgrade:
+            head = self._close_connection(head)
+
+        host, port = self.backends[self.pick(target)]
+        try:
+            up_reader, up_writer = await asyncio.open_connection(host, port)
+        except OSError:
+            writer.write(b'HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            await writer.drain()
+            writer.close()
+            return
+        up_writer.write(head)
+        upstream = asyncio.ensure_future(self._pipe(reader, up_writer))
+        if not upgrade:
+            # به کلاینت هم اعلام می‌شود که اتصال را دوباره استفاده نکند
+            try:
+                response_head = await up_reader.readuntil(b'\r\n\r\n')
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                upstream.cancel()
+                writer.close()
+                return
+            writer.write(self._close_connection(response_head))
+        await asyncio.gather(upstream, self._pipe(up_reader, writer))
+
+    @staticmethod
+    def _close_connection(head):
+        lines = head.decode('latin-1').split('\r\n')
+        lines = [line for line in lines if not line.lower().startswith(('connection:', 'keep-alive:'))]
+        lines.insert(1, 'Connection: close')
+        return '\r\n'.join(lines).encode('latin-1')
+
+    @staticmethod
+    def _forwarded_for(head, client_ip):
+        """افزودن IP کلاینت به X-Forwarded-For تا محدودیت‌های هر IP پشت پراکسی کار کنند"""
+        lines = head.decode('latin-1').split('\r\n')
+        for i, line in enumerate(lines):
+            if line.lower().startswith('x-forwarded-for:'):
+                lines[i] = f'{line}, {client_ip}'
+                break
+        else:
+            lines.insert(1, f'X-Forwarded-For: {client_ip}')
+        return '\r\n'.join(lines).encode('latin-1')
+
+    @staticmethod
+    async def _pipe(reader, writer):
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+def wait_for_backends(backends, procs, timeout=60):
+    """صبر تا همه پردازه‌ها روی پورت خود اتصال بپذیرند"""
+    deadline = time.monotonic() + timeout
+    for (host, port), proc in zip(backends, procs):
+        while True:
+            try:
+                socket.create_connection((host, port), timeout=1).close()
+                break
+            except OSError:
+                if proc.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f'worker on port {port} failed to start')
+                time.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='اجرای چند پردازه پیام‌رسان')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--queue', default=os.environ.get('MESSENGER_SOCKETIO_MESSAGE_QUEUE'),
+                        help='آدرس صف پیام (redis://... یا sqlite:///...)')
+    parser.add_argument('--async-mode', choices=['gevent', 'eventlet'],
+                        default=os.environ.get('MESSENGER_SOCKETIO_ASYNC_MODE', 'gevent'))
+    args = parser.parse_args()
+
+    # مهاجرت، داده اولیه و فایل‌های استاتیک یک بار در پردازه والد، پیش از بالا آمدن پردازه‌ها
+    from app import app
+    from assets import assets
+    from migrations import upgrade, seed_defaults
+    with app.app_context():
+        upgrade()
+        seed_defaults()
+    assets.build()
+    queue = args.queue or f"sqlite:///{os.path.join(app.instance_path, 'socketio-queue.db')}"
+
+    backends = [('127.0.0.1', args.port + 1 + i) for i in range(args.workers)]
+    procs = []
+    for worker_id, (host, port) in enumerate(backends):
+        env = dict(os.environ,
+                   MESSENGER_WORKER_ID=str(worker_id),
+                   MESSENGER_TRUSTED_PROXIES='1',
+                   MESSENGER_SOCKETIO_MESSAGE_QUEUE=queue)
+        procs.append(subprocess.Popen(
+            [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py'),
+             '--host', host, '--port', str(port), '--async-mode', args.async_mode,
+             '--no-migrate'],
+            env=env
+        ))
+
+    def shutdown(*_):
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    wait_for_backends(backends, procs)
+    print(f'🚀 {args.workers} پردازه پشت http://{args.host}:{args.port} (صف: {queue})')
+    try:
+        asyncio.run(StickyProxy(backends).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+import hashlib
+import logging
+import os
+import secrets
+import threading
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, User, CodeCounter
+from storage import retry_on_lock
+
+logger = logging.getLogger(__name__)
+
+# کدهای کاربر ۷ رقمی‌اند؛ جایگشت روی ۲۴ بیت (دو نیمه ۱۲ بیتی) با cycle walking
+SPACE = 10 ** 7
+_HALF_BITS = 12
+_HALF_MASK = (1 << _HALF_BITS) - 1
+_ROUNDS = 4
+
+
+def permute(key, value):
+    """جایگشت کلیددار و برگشت‌پذیر روی [0, SPACE) با شبکه Feistel
+
+    خروجی شبکه روی [0, 2**24) یک به یک است؛ اعمال دوباره تا وقتی حاصل داخل
+    بازه باشد (cycle walking) آن را به جایگشتی روی [0, SPACE) تبدیل می‌کند،
+    پس شمارنده‌های متفاوت هرگز کد یکسان نمی‌گیرند.
+    """
+    while True:
+        left, right = value >> _HALF_BITS, value & _HALF_MASK
+        for i in range(_ROUNDS):
+            digest = hashlib.blake2b(bytes((i, right >> 8, right & 0xFF)), key=key, digest_size=2).digest()
+            left, right = right, left ^ (int.from_bytes(digest, 'big') & _HALF_MASK)
+        value = (left << _HALF_BITS) | right
+        if value < SPACE:
+            return value
+
+
+def is_code_conflict(code):
+    """آیا IntegrityError درج کاربر از کد تکراری بود؛ با کوئری، نه متن خطای هر دیتابیس"""
+    return db.session.query(User.id).filter_by(code=code).first() is not None
+
+
+class UserCodeAllocator:
+    """تخصیص کد ۷ رقمی کاربران بدون کوئری جست‌وجو برای هر کد
+
+    کد هر کاربر جایگشت کلیددار یک شمارنده است. هر پردازه با یک تراکنش کوتاه
+    روی ردیف code_counter یک بلوک USER_CODE_BLOCK شمارنده رزرو می‌کند و
+    کدهای آن را از حافظه می‌دهد؛ بلوک‌ها بین پردازه‌ها جدا هستند. کدهای
+    قدیمی که تصادفی ساخته شده‌اند با یک کوئری IN برای کل بلوک کنار گذاشته
+    می‌شوند. اگر باز هم درج با ایندکس یکتای code برخورد کند (مثلاً کدی که
+    پس از رزرو بلوک بیرون از این مسیر درج شده) add_user با کد بعدی دوباره تلاش می‌کند.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._codes = []
+        self._pid = None
+        self.stats = {'allocated': 0, 'blocks': 0, 'skipped': 0, 'conflicts': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('USER_CODE_BLOCK', 64)
+        app.config.setdefault('USER_CODE_RETRIES', 5)
+        self.app = app
+        app.extensions['user_codes'] = self
+
+    def allocate(self):
+        """یک کد آزاد؛ پیش از هر نوشتن در نشست جاری فراخوانی شود چون رزرو بلوک تراکنش جدا دارد"""
+        with self._lock:
+            if self._pid != os.getpid():
+                # بلوک رزروشده والد پس از fork نباید در فرزند هم خرج شود
+                self._codes = []
+                self._pid = os.getpid()
+            while not self._codes:
+                self._codes = retry_on_lock(self._reserve, self.app.config['USER_CODE_BLOCK'])
+            self.stats['allocated'] += 1
+            return self._codes.pop()
+
+    def discard(self):
+        """کنار گذاشتن کدهای رزروشده؛ پس از درج کد از مسیرهای دیگر (مثلاً import انبوه) فراخوانی شود"""
+        with self._lock:
+            self._codes = []
+
+    def add_user(self, user):
+        """درج کاربر با کد تازه و commit؛ برخورد کد با کد بعدی تکرار می‌شود
+
+        IntegrityError های دیگر (نام کاربری یا ایمیل تکراری) پس از rollback بالا می‌روند.
+        """
+        retries = self.app.config['USER_CODE_RETRIES']
+        for attempt in range(retries + 1):
+            user.code = self.allocate()
+            db.session.add(user)
+            try:
+                db.session.commit()
+                return user
+            except IntegrityError:
+                db.session.rollback()
+                if attempt == retries or not is_code_conflict(user.code):
+                    raise
+                self.stats['conflicts'] += 1
+                logger.warning('user code %s already taken, retrying', user.code)
+
+    @staticmethod
+    def _advance(size):
+        """افزایش شمارنده به اندازه یک بلوک؛ (انتهای بلوک، کلید) یا None اگر ردیف هنوز نیست"""
+        with db.engine.begin() as conn:
+            updated = conn.execute(db.update(CodeCounter).where(CodeCounter.id == 1)
+                                   .values(next_value=CodeCounter.next_value + size)).rowcount
+            if not updated:
+                return None
+            return conn.execute(db.select(CodeCounter.next_value, CodeCounter.key)
+                                .where(CodeCounter.id == 1)).one()
+
+    def _reserve(self, size):
+        block = self._advance(size)
+        if block is None:
+            # اولین رزرو؛ اگر پردازه دیگری همزمان ردیف را ساخته باشد درج با کلید اصلی رد می‌شود
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(db.insert(CodeCounter).values(id=1, next_value=0, key=secrets.token_hex(16)))
+            except IntegrityError:
+                pass
+            block = self._advance(size)
+        end, key = block
+        start = end - size
+        if start >= SPACE:
+            raise RuntimeError('user code space is exhausted')
+        key = bytes.fromhex(key)
+        codes = [f'{permute(key, n):07d}' for n in range(start, min(end, SPACE))]
+
+        # کدهای تصادفی پیش از این تخصیص‌دهنده
+        taken = {code for (code,) in db.session.query(User.code).filter(User.code.in_(codes))}
+        self.stats['blocks'] += 1
+        self.stats['skipped'] += len(taken)
+        # pop از انتها؛ ترتیب شمارنده حفظ می‌شود
+        return [code for code in reversed(codes) if code not in taken]
+
+
+user_codes = UserCodeAllocator()
@@ -0,0 +1,81 @@
+import sys
+
+def async_mode():
+    """مدل هم‌روندی فعال بر اساس monkey patch انجام‌شده: gevent، eventlet یا threading"""
+    if 'gevent' in sys.modules:
+        from gevent import monkey
+        if monkey.is_module_patched('socket'):
+            return 'gevent'
+    if 'eventlet' in sys.modules:
+        from eventlet import patcher
+        if patcher.is_monkey_patched('socket'):
+            return 'eventlet'
+    return 'threading'
+
+def configure_pool(size):
+    """تعیین اندازه استخر نخ واقعی برای کارهای مسدودکننده"""
+    mode = async_mode()
+    if mode == 'gevent':
+        import gevent
+        gevent.get_hub().threadpool.maxsize = size
+    elif mode == 'eventlet':
+        from eventlet import tpool
+        tpool.set_num_threads(size)
+
+def run_blocking(func, *args, **kwargs):
+    """اجرای تابع مسدودکننده (bcrypt، SQLite) در یک نخ واقعی تا حلقه رویداد آزاد بماند
+
+    در حالت threading هر درخواست نخ خودش را دارد و تابع مستقیم اجرا می‌شود.
+    """
+    mode = async_mode()
+    if mode == 'gevent':
+        import gevent
+        return gevent.get_hub().threadpool.apply(func, args, kwargs)
+    if mode == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(func, *args, **kwargs)
+    return func(*args, **kwargs)
+
+def run_in_app_context(app, func, *args, **kwargs):
+    """مانند run_blocking ولی با app context تازه، چون نخ‌های استخر context ندارند
+
+    هر فراخوانی نشست SQLAlchemy جدای خودش را دارد؛ اشیای برگشتی پس از
+    پایان context جدا (detached) هستند و فقط ستون‌های بارگذاری‌شده قابل استفاده‌اند.
+    """
+    if async_mode() == 'threading':
+        return func(*args, **kwargs)
+
+    def call():
+        with app.app_context():
+            return func(*args, **kwargs)
+    return run_blocking(call)
+
+class BlockingPool:
+    """استخر جدا و محدود از نخ‌های واقعی برای یک نوع کار مسدودکننده
+
+    برخلاف run_blocking که استخر مشترک را به کار می‌برد، این استخر فقط
+    size نخ دارد و کارهای اضافه در صف خودش منتظر می‌مانند. در eventlet
+    استخر جدا وجود ندارد و همزمانی روی tpool با یک سمافور محدود می‌شود.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._mode = async_mode()
+        if self._mode == 'gevent':
+            from gevent.threadpool import ThreadPool
+            self._pool = ThreadPool(size)
+        elif self._mode == 'eventlet':
+            from eventlet.semaphore import Semaphore
+            self._pool = Semaphore(size)
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            self._pool = ThreadPoolExecutor(size)
+
+    def run(self, func, *args, **kwargs):
+        if self._mode == 'gevent':
+            return self._pool.apply(func, args, kwargs)
+        if self._mode == 'eventlet':
+            from eventlet import tpool
+            with self._pool:
+                return tpool.execute(func, *args, **kwargs)
+        return self._pool.submit(func, *args, **kwargs).result()
@@ -0,0 +1,184 @@
+import logging
+import threading
+from collections import deque
+
+from engineio import packet as eio_packet
+from socketio import packet
+
+logger = logging.getLogger(__name__)
+
+# پس از این تعداد گیرنده کار پخش به بقیه greenletها فرصت اجرا می‌دهد
+_YIELD_EVERY = 500
+
+
+class _Window:
+    """پنجره ارسال یک اتصال: پخش‌های فرستاده‌شده، تأییدشده و آخرین probe"""
+    __slots__ = ('sent', 'acked', 'probed')
+
+    def __init__(self):
+        self.sent = 0
+        self.acked = 0
+        self.probed = 0
+
+
+class Fanout:
+    """پخش رویدادهای اتاق با یک بار سریال‌سازی و صف ارسال جدا برای هر اتاق
+
+    هندلر فقط بسته‌های Engine.IO آماده را در صف اتاق می‌گذارد و برمی‌گردد،
+    پس زمان آن به اندازه اتاق بستگی ندارد. برای هر اتاقی که صفش خالی نیست
+    یک کار پس‌زمینه بسته‌ها را به ترتیب در صف خروجی اتصال‌های عضو قرار می‌دهد.
+
+    Engine.IO عمق صف اتصال را نشان نمی‌دهد، پس هر اتصال پنجره خودش را دارد:
+    پس از هر FANOUT_PROBE_EVERY پخش یک fanout_probe با شماره پخش فرستاده
+    می‌شود و کلاینت با fanout_ack همان شماره را برمی‌گرداند. اتصالی که
+    FANOUT_CLIENT_QUEUE_MAX پخش تأییدنشده دارد مصرف‌کننده کند است: بسته برای
+    او دور ریخته می‌شود (drop) یا اتصالش قطع می‌شود (disconnect) تا پس از
+    اتصال دوباره پیام‌های از دست رفته را با sync بگیرد. پنجره با اولین
+    fanout_ack اتصال فعال می‌شود؛ کلاینت‌هایی که آن را نمی‌فرستند محدود نمی‌شوند.
+    با صف پیام مشترک (SOCKETIO_MESSAGE_QUEUE) پخش از مسیر عادی Flask-SocketIO
+    می‌رود؛ آنجا پخش محلی هر پردازه از قبل در نخ شنونده صف انجام می‌شود.
+    ارسال با API عمومی Engine.IO (send_packet) است، پس test client در Flask-SocketIO
+    که اتصال Engine.IO ندارد پخش‌ها را فقط با FANOUT_ENABLED=False می‌گیرد.
+    """
+
+    def __init__(self, app=None, socketio=None):
+        self.app = None
+        self.socketio = None
+        self.enabled = False
+        self._rooms = {}     # (namespace، اتاق) -> deque بسته‌های در انتظار
+        self._windows = {}   # sid -> _Window
+        self._lock = threading.Lock()
+        self.stats = {'broadcasts': 0, 'deliveries': 0, 'failed': 0, 'dropped': 0,
+                      'disconnected': 0, 'overflow': 0}
+        if app is not None:
+            self.init_app(app, socketio)
+
+    def init_app(self, app, socketio):
+        app.config.setdefault('FANOUT_ENABLED', True)
+        # بیشترین پخش در انتظار هر اتاق؛ بیشتر از آن پخش تازه دور ریخته می‌شود
+        app.config.setdefault('FANOUT_ROOM_QUEUE_MAX', 1000)
+        # بیشترین پخش تأییدنشده هر اتصال پیش از اعمال سیاست مصرف‌کننده کند
+        app.config.setdefault('FANOUT_CLIENT_QUEUE_MAX', 256)
+        # فاصله probeها بر حسب پخش؛ باید کمتر از FANOUT_CLIENT_QUEUE_MAX باشد
+        app.config.setdefault('FANOUT_PROBE_EVERY', 32)
+        # drop یا disconnect
+        app.config.setdefault('FANOUT_SLOW_POLICY', 'disconnect')
+        self.app = app
+        self.socketio = socketio
+        self.enabled = app.config['FANOUT_ENABLED'] and not app.config.get('SOCKETIO_MESSAGE_QUEUE')
+        app.extensions['fanout'] = self
+
+    @property
+    def backlog(self):
+        with self._lock:
+            return sum(len(q) for q in self._rooms.values())
+
+    def saturated(self, room, namespace='/'):
+        """صف پخش اتاق پر است؛ هندلرها پیام تازه را پیش از ذخیره با busy رد می‌کنند"""
+        if not self.enabled:
+            return False
+        with self._lock:
+            queue = self._rooms.get((namespace, room))
+            return queue is not None and len(queue) >= self.app.config['FANOUT_ROOM_QUEUE_MAX']
+
+    def emit(self, event, data, room, namespace='/'):
+        """قرار دادن یک رویداد در صف پخش اتاق؛ False یعنی صف اتاق پر بود"""
+        if not self.enabled:
+            self.socketio.emit(event, data, to=room, namespace=namespace)
+            return True
+
+        # سریال‌سازی یک بار برای همه گیرنده‌ها
+        packets = self._packets(event, data, namespace)
+        key = (namespace, room)
+        with self._lock:
+            queue = self._rooms.get(key)
+            start = queue is None
+            if start:
+                queue = self._rooms[key] = deque()
+            elif len(queue) >= self.app.config['FANOUT_ROOM_QUEUE_MAX']:
+                self.stats['overflow'] += 1
+                logger.warning('fan-out queue of room %s is full; broadcast dropped', room)
+                return False
+            queue.append(packets)
+            self.stats['broadcasts'] += 1
+        if start:
+            self.socketio.start_background_task(self._drain, key)
+        return True
+
+    def ack(self, sid, n):
+        """کلاینت n پخش اول این اتصال را دریافت کرده است؛ اولین ack پنجره را فعال می‌کند"""
+        window = self._windows.get(sid)
+        if window is None:
+            self._windows[sid] = _Window()
+        elif n > window.acked:
+            window.acked = min(n, window.sent)
+
+    def forget(self, sid):
+        self._windows.pop(sid, None)
+
+    def _packets(self, event, data, namespace):
+        encoded = self.socketio.server.packet_class(
+            packet.EVENT, namespace=namespace, data=[event, data]).encode()
+        if not isinstance(encoded, list):
+            encoded = [encoded]
+        return [eio_packet.Packet(eio_packet.MESSAGE, p) for p in encoded]
+
+    def _drain(self, key):
+        while True:
+            with self._lock:
+                queue = self._rooms[key]
+                if not queue:
+                    del self._rooms[key]
+                    return
+                packets = queue.popleft()
+            try:
+                self._deliver(key, packets)
+            except Exception:
+                logger.exception('fan-out to room %s failed', key[1])
+
+    def _deliver(self, key, packets):
+        namespace, room = key
+        server = self.socketio.server
+        limit = self.app.config['FANOUT_CLIENT_QUEUE_MAX']
+        probe_every = self.app.config['FANOUT_PROBE_EVERY']
+        slow = []
+        delivered = failed = 0
+        for n, (sid, eio_sid) in enumerate(server.manager.get_participants(namespace, room), 1):
+            window = self._windows.get(sid)
+            if window is not None and window.sent - window.acked >= limit:
+                slow.append(sid)
+                continue
+            try:
+                for pkt in packets:
+                    server.eio.send_packet(eio_sid, pkt)
+                if window is not None:
+                    window.sent += 1
+                    if window.sent - window.probed >= probe_every:
+                        window.probed = window.sent
+                        for pkt in self._packets('fanout_probe', window.sent, namespace):
+                            server.eio.send_packet(eio_sid, pkt)
+            except Exception:
+                # یک اتصال خراب نباید پخش به بقیه اعضا را متوقف کند
+                failed += 1
+                logger.debug('fan-out to %s failed', sid, exc_info=True)
+            else:
+                delivered += 1
+            if n % _YIELD_EVERY == 0:
+                self.socketio.sleep(0)
+
+        self.stats['deliveries'] += delivered
+        self.stats['failed'] += failed
+        if failed:
+            logger.warning('fan-out to %d sockets in room %s failed', failed, room)
+        if not slow:
+            return
+        if self.app.config['FANOUT_SLOW_POLICY'] == 'disconnect':
+            self.stats['disconnected'] += len(slow)
+            logger.warning('disconnecting %d slow consumers in room %s', len(slow), room)
+            for sid in slow:
+                server.disconnect(sid, namespace=namespace)
+        else:
+            self.stats['dropped'] += len(slow)
+
+
+fanout = Fanout()
@@ -0,0 +1,89 @@
+import logging
+
+from flask_socketio import emit, disconnect
+
+from ratelimit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+class FloodControl:
+    """محدودیت نرخ و اندازه پیام‌های سوکت (message و dm)
+
+    هر پیام از سه token bucket می‌گذرد: اتصال (sid)، کاربر (همه اتصال‌های او در
+    این پردازه) و اتاق یا گفتگوی مقصد (مجموع همه فرستنده‌ها
+    تا پخش به اعضا اشباع نشود). اندازه متن پیش از هر کار دیتابیسی با
+    MESSAGE_MAX_LENGTH سنجیده می‌شود و اندازه خام بسته‌ها را Engine.IO با
+    SOCKET_MAX_PAYLOAD محدود می‌کند. پیام ردشده فقط یک رویداد rate_limited
+    به فرستنده دارد؛ هر رد یک توکن از bucket تخلف اتصال مصرف می‌کند و با
+    تمام شدن آن (FLOOD_STRIKES رد در FLOOD_STRIKE_WINDOW ثانیه) اتصال قطع می‌شود.
+    هزینه هر رویداد O(1) است و وضعیت فقط در حافظه همین پردازه است.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.stats = {'allowed': 0, 'limited': 0, 'oversized': 0, 'disconnected': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MESSAGE_MAX_LENGTH', 4000)
+        app.config.setdefault('SOCKET_MAX_PAYLOAD', 64 * 1024)
+        # ظرفیت و نرخ پر شدن (پیام در ثانیه) هر bucket
+        app.config.setdefault('FLOOD_CONNECTION_BURST', 10)
+        app.config.setdefault('FLOOD_CONNECTION_RATE', 2)
+        app.config.setdefault('FLOOD_USER_BURST', 20)
+        app.config.setdefault('FLOOD_USER_RATE', 4)
+        app.config.setdefault('FLOOD_ROOM_BURST', 100)
+        app.config.setdefault('FLOOD_ROOM_RATE', 30)
+        app.config.setdefault('FLOOD_STRIKES', 20)
+        app.config.setdefault('FLOOD_STRIKE_WINDOW', 60)
+        config = app.config
+        self.connections = RateLimiter(config['FLOOD_CONNECTION_RATE'], config['FLOOD_CONNECTION_BURST'])
+        self.users = RateLimiter(config['FLOOD_USER_RATE'], config['FLOOD_USER_BURST'])
+        self.rooms = RateLimiter(config['FLOOD_ROOM_RATE'], config['FLOOD_ROOM_BURST'])
+        self.strikes = RateLimiter(config['FLOOD_STRIKES'] / config['FLOOD_STRIKE_WINDOW'],
+                                   config['FLOOD_STRIKES'])
+        self.app = app
+        app.extensions['flood'] = self
+
+    def check(self, sid, user_id, content):
+        """اندازه و bucketهای اتصال و کاربر، پیش از هر جست‌وجو در کش یا دیتابیس
+
+        None اگر پیام مجاز باشد، وگرنه پاسخ ack خطا.
+        """
+        if len(content) > self.app.config['MESSAGE_MAX_LENGTH']:
+            self.stats['oversized'] += 1
+            return self._reject(sid, 'too_large', None)
+        return self._take(sid, ((self.connections, sid), (self.users, user_id)))
+
+    def check_room(self, sid, room):
+        """bucket اتاق یا گفتگو؛ پس از معتبر شدن مقصد تا نام‌های ساختگی bucket نسازند"""
+        rejected = self._take(sid, ((self.rooms, room),))
+        if rejected is None:
+            self.stats['allowed'] += 1
+        return rejected
+
+    def _take(self, sid, buckets):
+        for limiter, key in buckets:
+            if not limiter.allow(key):
+                self.stats['limited'] += 1
+                return self._reject(sid, 'rate_limited', round(limiter.retry_after(key), 2))
+        return None
+
+    def _reject(self, sid, error, retry_after):
+        if not self.strikes.allow(sid):
+            self.stats['disconnected'] += 1
+            logger.warning('disconnecting flooding socket %s', sid)
+            disconnect()
+            return {'ok': False, 'error': 'disconnected'}
+        emit('rate_limited', {'error': error, 'retry_after': retry_after})
+        return {'ok': False, 'error': error, 'retry_after': retry_after}
+
+    def forget(self, sid):
+        """پاک کردن وضعیت اتصال بسته‌شده"""
+        self.connections.reset(sid)
+        self.strikes.reset(sid)
+
+
+flood = FloodControl()
@@ -1,5 +1,5 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField
+from wtforms import StringField, PasswordField, SubmitField, BooleanField
 from wtforms.validators import DataRequired, Email, Length, ValidationError
 import re
 
@@ -42,4 +42,18 @@ class AddFriendForm(FlaskForm):
         DataRequired(message='کد الزامی است'),
         Length(min=7, max=7, message='کد باید دقیقاً ۷ رقمی باشد')
     ])
-    submit = SubmitField('🔍 پیدا کردن مخاطب')
\ No newline at end of file
+    submit = SubmitField('🔍 پیدا کردن مخاطب')
+
+class AdminUserForm(FlaskForm):
+    username = StringField('نام کاربری', validators=[
+        DataRequired(message='نام کاربری الزامی است'),
+        Length(min=3, max=80, message='نام کاربری باید بین ۳ تا ۸۰ کاراکتر باشد')
+    ])
+    email = StringField('ایمیل', validators=[
+        DataRequired(message='ایمیل الزامی است'),
+        Email(message='لطفاً یک ایمیل معتبر وارد کنید'),
+        Length(max=120)
+    ])
+    is_admin = BooleanField('ادمین')
+    is_active = BooleanField('فعال')
+    submit = SubmitField('💾 ذخیره')
\ No newline at end of file
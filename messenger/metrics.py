@@ -0,0 +1,271 @@
+import logging
+import re
+import threading
+import time
+from functools import wraps
+
+from flask import g, has_app_context, request, template_rendered, before_render_template
+from sqlalchemy import event
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+# مرزهای هیستوگرام زمان پاسخ بر حسب ثانیه
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_SPACES = re.compile(r'\s+')
+
+class _Unit:
+    """آمار یک درخواست HTTP یا یک رویداد سوکت در حال اجرا"""
+    __slots__ = ('kind', 'name', 'start', 'statements', 'sql_seconds', 'orm_objects',
+                 'template_seconds', 'template_stack', 'selects', 'status', 'failed')
+
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+        self.start = time.perf_counter()
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.orm_objects = 0
+        self.template_seconds = 0.0
+        self.template_stack = []
+        self.selects = {}
+        self.status = None
+        self.failed = False
+
+class _Series:
+    __slots__ = ('calls', 'errors', 'seconds', 'buckets', 'statements', 'sql_seconds',
+                 'orm_objects', 'template_seconds', 'nplusone', 'slow')
+
+    def __init__(self):
+        self.calls = self.errors = self.statements = self.orm_objects = self.nplusone = self.slow = 0
+        self.seconds = self.sql_seconds = self.template_seconds = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(**labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+class Metrics:
+    """زمان، تعداد کوئری، اشیای ORM بارگذاری‌شده و زمان قالب برای هر مسیر و رویداد سوکت
+
+    درخواست‌های HTTP با before_request/teardown_request و رویدادهای سوکت با
+    دکوراتور socket_event اندازه‌گیری می‌شوند. رویدادهای SQLAlchemy فقط وقتی
+    شمرده می‌شوند که واحد کاری در g فعال باشد، پس نخ write-behind و کارهای
+    پس‌زمینه در آمار درخواست‌ها نمی‌آیند. یک SELECT یکسان که در یک واحد
+    METRICS_NPLUSONE_THRESHOLD بار یا بیشتر اجرا شود به عنوان N+1 ثبت می‌شود.
+    """
+
+    def __init__(self, app=None):
+        self._series = {}
+        self._statuses = {}
+        self._collectors = []
+        self._reported = set()
+        self._lock = threading.Lock()
+        self.enabled = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', True)
+        # درخواست‌ها و رویدادهای کندتر از این (میلی‌ثانیه) در لاگ ثبت می‌شوند
+        app.config.setdefault('METRICS_SLOW_MS', 500)
+        app.config.setdefault('METRICS_NPLUSONE_THRESHOLD', 5)
+        # توکن Bearer برای خواندن /admin/metrics توسط Prometheus بدون ورود
+        app.config.setdefault('METRICS_TOKEN', None)
+        app.extensions['metrics'] = self
+        self.enabled = app.config['METRICS_ENABLED']
+        if not self.enabled:
+            return
+        self.slow_seconds = app.config['METRICS_SLOW_MS'] / 1000
+        self.nplusone_threshold = app.config['METRICS_NPLUSONE_THRESHOLD']
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._rendered, app)
+
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', self._before_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_execute)
+        event.listen(db.Model, 'load', self._loaded, propagate=True)
+
+    def collector(self, func):
+        """ثبت تابعی که نمونه‌های اضافه (name, type, help, [(labels, value)]) برمی‌گرداند"""
+        self._collectors.append(func)
+        return func
+
+    # --- واحدهای کار -----------------------------------------------------
+
+    @staticmethod
+    def _unit():
+        return g.get('_metrics_unit') if has_app_context() else None
+
+    def _before_request(self):
+        g._metrics_unit = _Unit('http', request.endpoint or '<unmatched>')
+
+    def _after_request(self, response):
+        unit = self._unit()
+        if unit is not None:
+            unit.status = response.status_code
+        return response
+
+    def _teardown_request(self, exc):
+        unit = g.pop('_metrics_unit', None)
+        if unit is not None:
+            unit.failed = exc is not None or (unit.status or 500) >= 500
+            self._finish(unit)
+
+    def socket_event(self, handler):
+        """دکوراتور هندلرهای socketio.on؛ نام رویداد از request.event خوانده می‌شود"""
+        @wraps(handler)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return handler(*args, **kwargs)
+            name = getattr(request, 'event', None)
+            unit = g._metrics_unit = _Unit('socket', name['message'] if name else handler.__name__)
+            try:
+                return handler(*args, **kwargs)
+            except Exception:
+                unit.failed = True
+                raise
+            finally:
+                g.pop('_metrics_unit', None)
+                self._finish(unit)
+        return wrapper
+
+    # --- رویدادهای SQLAlchemy و قالب ------------------------------------
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        unit = self._unit()
+        if unit is not None:
+            conn.info.setdefault('metrics_start', []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        unit = self._unit()
+        if unit is None:
+            return
+        starts = conn.info.get('metrics_start')
+        if starts:
+            unit.sql_seconds += time.perf_counter() - starts.pop()
+        unit.statements += 1
+        if statement.lstrip()[:6].upper() == 'SELECT':
+            unit.selects[statement] = unit.selects.get(statement, 0) + 1
+
+    def _loaded(self, target, context):
+        unit = self._unit()
+        if unit is not None:
+            unit.orm_objects += 1
+
+    def _before_render(self, sender, template, context, **extra):
+        unit = self._unit()
+        if unit is not None:
+            unit.template_stack.append(time.perf_counter())
+
+    def _rendered(self, sender, template, context, **extra):
+        unit = self._unit()
+        if unit is not None and unit.template_stack:
+            started = unit.template_stack.pop()
+            # قالب‌های تو در تو فقط یک بار در زمان قالب بیرونی شمرده می‌شوند
+            if not unit.template_stack:
+                unit.template_seconds += time.perf_counter() - started
+
+    # --- جمع‌بندی -------------------------------------------------------
+
+    def _finish(self, unit):
+        elapsed = time.perf_counter() - unit.start
+        repeated = [(sql, count) for sql, count in unit.selects.items()
+                    if count >= self.nplusone_threshold]
+        slow = elapsed >= self.slow_seconds
+        key = (unit.kind, unit.name)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series()
+            series.calls += 1
+            series.errors += unit.failed
+            series.seconds += elapsed
+            for i, bound in enumerate(BUCKETS):
+                if elapsed <= bound:
+                    series.buckets[i] += 1
+                    break
+            series.statements += unit.statements
+            series.sql_seconds += unit.sql_seconds
+            series.orm_objects += unit.orm_objects
+            series.template_seconds += unit.template_seconds
+            series.nplusone += bool(repeated)
+            series.slow += slow
+            if unit.status is not None:
+                status_key = (unit.name, unit.status)
+                self._statuses[status_key] = self._statuses.get(status_key, 0) + 1
+            new = [(sql, count) for sql, count in repeated if (key, sql) not in self._reported]
+            self._reported.update((key, sql) for sql, _ in new)
+
+        for sql, count in new:
+            logger.warning('possible N+1 in %s %s: %d x %s', unit.kind, unit.name, count,
+                           _SPACES.sub(' ', sql)[:300])
+        if slow:
+            logger.warning('slow %s %s: %.1fms, %d queries (%.1fms), %d orm objects, template %.1fms',
+                           unit.kind, unit.name, elapsed * 1000, unit.statements,
+                           unit.sql_seconds * 1000, unit.orm_objects, unit.template_seconds * 1000)
+
+    def render(self):
+        """خروجی متنی قالب Prometheus"""
+        with self._lock:
+            series = sorted(self._series.items())
+            statuses = sorted(self._statuses.items())
+            snapshot = [(key, s.calls, s.errors, s.seconds, list(s.buckets), s.statements,
+                         s.sql_seconds, s.orm_objects, s.template_seconds, s.nplusone, s.slow)
+                        for key, s in series]
+
+        lines = []
+        def family(name, kind, help_text, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{name}{_labels(**labels)} {value}')
+
+        handler = lambda key: {'kind': key[0], 'name': key[1]}
+        family('messenger_handler_calls_total', 'counter', 'Handled HTTP requests and socket events.',
+               [(handler(k), calls) for k, calls, *_ in snapshot])
+        family('messenger_handler_errors_total', 'counter', 'Handlers that raised or returned 5xx.',
+               [(handler(row[0]), row[2]) for row in snapshot])
+
+        lines.append('# HELP messenger_handler_duration_seconds Wall time per request or socket event.')
+        lines.append('# TYPE messenger_handler_duration_seconds histogram')
+        for key, calls, errors, seconds, buckets, *_ in snapshot:
+            cumulative = 0
+            for bound, count in zip(BUCKETS, buckets):
+                cumulative += count
+                lines.append(f'messenger_handler_duration_seconds_bucket'
+                             f'{_labels(**handler(key), le=bound)} {cumulative}')
+            lines.append(f'messenger_handler_duration_seconds_bucket{_labels(**handler(key), le="+Inf")} {calls}')
+            lines.append(f'messenger_handler_duration_seconds_sum{_labels(**handler(key))} {seconds:.6f}')
+            lines.append(f'messenger_handler_duration_seconds_count{_labels(**handler(key))} {calls}')
+
+        for index, name, help_text in (
+            (5, 'messenger_handler_sql_statements_total', 'SQL statements executed by the handler.'),
+            (6, 'messenger_handler_sql_seconds_total', 'Time spent in SQL statements.'),
+            (7, 'messenger_handler_orm_objects_total', 'ORM instances loaded; projection and Core queries are not counted.'),
+            (8, 'messenger_handler_template_seconds_total', 'Time spent rendering templates.'),
+            (9, 'messenger_handler_nplusone_total', 'Calls that repeated one SELECT at least the N+1 threshold.'),
+            (10, 'messenger_handler_slow_total', 'Calls slower than METRICS_SLOW_MS.'),
+        ):
+            family(name, 'counter', help_text, [(handler(row[0]), round(row[index], 6)) for row in snapshot])
+
+        family('messenger_http_responses_total', 'counter', 'HTTP responses by endpoint and status.',
+               [({'name': name, 'status': status}, count) for (name, status), count in statuses])
+
+        for collect in self._collectors:
+            for name, kind, help_text, samples in collect():
+                family(name, kind, help_text, samples)
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
@@ -0,0 +1,221 @@
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import inspect, text
+
+from codes import user_codes
+from models import db, User, Room, Message, DirectMessage, Conversation, UserPresence
+from search import search_index
+from utils import hash_password
+
+# فهرست مهاجرت‌ها به صورت (نسخه، تابع)؛ هر مهاجرت باید تکرارپذیر باشد
+# چون روی دیتابیس تازه، create_all جدول‌ها را از قبل با طرح جدید ساخته است
+MIGRATIONS = []
+
+def migration(version):
+    def decorator(func):
+        MIGRATIONS.append((version, func))
+        return func
+    return decorator
+
+def _add_column(table, column, ddl):
+    """افزودن ستون در صورت نبودن"""
+    columns = {c['name'] for c in inspect(db.engine).get_columns(table)}
+    if column not in columns:
+        db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+        db.session.commit()
+
+def _create_indexes(*models):
+    """ساخت ایندکس‌های تعریف‌شده در مدل‌ها روی جدول‌های موجود
+
+    ایندکسی که ستونش هنوز اضافه نشده رد می‌شود؛ مهاجرت افزودن آن ستون آن را می‌سازد.
+    """
+    for model in models:
+        columns = {c['name'] for c in inspect(db.engine).get_columns(model.__table__.name)}
+        for index in model.__table__.indexes:
+            if all(c.name in columns for c in index.columns):
+                index.create(db.engine, checkfirst=True)
+
+def _dm_pair():
+    """عبارت‌های SQL شناسه کوچک‌تر و بزرگ‌تر دو طرف یک DM"""
+    lo = db.case((DirectMessage.sender_id < DirectMessage.receiver_id, DirectMessage.sender_id),
+                 else_=DirectMessage.receiver_id)
+    hi = db.case((DirectMessage.sender_id < DirectMessage.receiver_id, DirectMessage.receiver_id),
+                 else_=DirectMessage.sender_id)
+    return lo, hi
+
+def upgrade():
+    """ساخت جدول‌های تازه و اجرای مهاجرت‌های اعمال‌نشده به ترتیب نسخه؛ نسخه‌های اعمال‌شده برمی‌گردند"""
+    db.create_all()
+    db.session.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_version '
+        '(version INTEGER PRIMARY KEY, applied_at DATETIME)'
+    ))
+    db.session.commit()
+    applied = {row[0] for row in db.session.execute(text('SELECT version FROM schema_version'))}
+
+    done = []
+    for version, func in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version in applied:
+            continue
+        func()
+        db.session.execute(
+            text('INSERT INTO schema_version (version, applied_at) VALUES (:v, :t)'),
+            {'v': version, 't': datetime.utcnow()}
+        )
+        db.session.commit()
+        done.append(version)
+    return done
+
+DEFAULT_ROOMS = [
+    ('general', '💬 اتاق عمومی'),
+    ('random', '🎮 اتاق متفرقه'),
+    ('help', '❓ اتاق کمک'),
+]
+
+def seed_defaults():
+    """اتاق‌های پیش‌فرض و کاربر admin در دیتابیس خالی؛ اجرای دوباره تغییری نمی‌دهد"""
+    created = []
+    if Room.query.count() == 0:
+        for slug, title in DEFAULT_ROOMS:
+            db.session.add(Room(slug=slug, title=title))
+        db.session.commit()
+        created.append('rooms')
+
+    if not User.query.filter_by(username='admin').first():
+        admin_user = User(
+            username='admin',
+            email='admin@example.com',
+            password_hash=hash_password('admin123'),
+            is_admin=True
+        )
+        user_codes.add_user(admin_user)
+        created.append('admin')
+    return created
+
+@migration(1)
+def history_indexes():
+    """کلید مکالمه برای DM و ایندکس‌های ترکیبی تاریخچه"""
+    _add_column('direct_message', 'conversation_key', 'VARCHAR(32)')
+
+    lo, hi = _dm_pair()
+    db.session.execute(
+        db.update(DirectMessage)
+        .where(DirectMessage.conversation_key.is_(None))
+        .values(conversation_key=db.cast(lo, db.String) + '_' + db.cast(hi, db.String))
+    )
+    db.session.commit()
+
+    _create_indexes(Message, DirectMessage)
+
+@migration(2)
+def conversations():
+    """پر کردن جدول conversation از پیام‌های خصوصی موجود"""
+    lo, hi = _dm_pair()
+    unread = DirectMessage.is_read.isnot(True)
+    rows = db.session.query(
+        DirectMessage.conversation_key,
+        db.func.min(lo),
+        db.func.min(hi),
+        db.func.max(DirectMessage.id),
+        db.func.max(DirectMessage.created_at),
+        db.func.sum(db.case((unread & (DirectMessage.receiver_id == lo), 1), else_=0)),
+        db.func.sum(db.case((unread & (DirectMessage.receiver_id == hi), 1), else_=0)),
+        db.func.sum(db.case((DirectMessage.sender_id == lo, 1), else_=0)),
+        db.func.sum(db.case((DirectMessage.sender_id == hi, 1), else_=0)),
+    ).group_by(DirectMessage.conversation_key).all()
+
+    existing = {key for (key,) in db.session.query(Conversation.key)}
+    for key, a, b, last_id, last_at, unread_a, unread_b, sent_a, sent_b in rows:
+        if key in existing:
+            continue
+        db.session.add(Conversation(
+            key=key, user_a_id=a, user_b_id=b,
+            last_message_id=last_id, last_activity_at=last_at,
+            unread_a=unread_a, unread_b=unread_b,
+            sent_by_a=sent_a, sent_by_b=sent_b
+        ))
+    db.session.commit()
+
+@migration(3)
+def full_text_search():
+    """ساخت و پر کردن نمایه FTS5؛ نمایه حافظه در اولین جست‌وجو ساخته می‌شود"""
+    if search_index.backend.name == 'fts5':
+        search_index.rebuild()
+
+@migration(4)
+def admin_listing_indexes():
+    """ایندکس joined_at برای صفحه‌بندی فهرست کاربران ادمین"""
+    _create_indexes(User)
+
+def _backfill_seq(model, scope):
+    """شماره‌گذاری ردیف‌های موجود هر محدوده به ترتیب (created_at, id) با UPDATE ... FROM"""
+    numbered = db.select(model.id, db.func.row_number().over(
+        partition_by=scope, order_by=(model.created_at, model.id)).label('seq')
+    ).where(model.seq.is_(None)).subquery()
+    db.session.execute(db.update(model).values(seq=numbered.c.seq)
+                       .where(model.id == numbered.c.id)
+                       .execution_options(synchronize_session=False))
+
+@migration(5)
+def message_sequences():
+    """شماره ترتیبی پیام‌ها برای همگام‌سازی تفاضلی و شمارنده هر اتاق و مکالمه"""
+    _add_column('message', 'seq', 'INTEGER')
+    _add_column('direct_message', 'seq', 'INTEGER')
+    _add_column('room', 'last_seq', "INTEGER NOT NULL DEFAULT 0")
+    _add_column('conversation', 'last_seq', "INTEGER NOT NULL DEFAULT 0")
+
+    _backfill_seq(Message, Message.room_id)
+    _backfill_seq(DirectMessage, DirectMessage.conversation_key)
+    db.session.execute(db.update(Room).values(last_seq=db.func.coalesce(
+        db.select(db.func.max(Message.seq)).where(Message.room_id == Room.id).scalar_subquery(), 0)))
+    db.session.execute(db.update(Conversation).values(last_seq=db.func.coalesce(
+        db.select(db.func.max(DirectMessage.seq))
+        .where(DirectMessage.conversation_key == Conversation.key).scalar_subquery(), 0)))
+    db.session.commit()
+    _create_indexes(Message, DirectMessage)
+
+@migration(6)
+def read_receipts():
+    """high-water mark خواندن هر طرف مکالمه: seq پیش از اولین پیام خوانده‌نشده"""
+    _add_column('conversation', 'read_seq_a', "INTEGER NOT NULL DEFAULT 0")
+    _add_column('conversation', 'read_seq_b', "INTEGER NOT NULL DEFAULT 0")
+    for column, reader in ((Conversation.read_seq_a, Conversation.user_a_id),
+                           (Conversation.read_seq_b, Conversation.user_b_id)):
+        first_unread = db.select(db.func.min(DirectMessage.seq) - 1).where(
+            DirectMessage.conversation_key == Conversation.key,
+            DirectMessage.receiver_id == reader,
+            DirectMessage.is_read.isnot(True)
+        ).scalar_subquery()
+        db.session.execute(db.update(Conversation).values(
+            {column: db.func.coalesce(first_unread, Conversation.last_seq)}))
+    db.session.commit()
+
+@migration(7)
+def attachments():
+    """ارجاع پیام‌ها به پیوست؛ جدول attachment را create_all می‌سازد"""
+    _add_column('message', 'attachment_id', 'INTEGER REFERENCES attachment(id)')
+    _add_column('direct_message', 'attachment_id', 'INTEGER REFERENCES attachment(id)')
+
+@migration(8)
+def presence_per_worker():
+    """کلید (user_id, worker) برای user_presence؛ داده‌اش گذراست پس جدول از نو ساخته می‌شود"""
+    columns = {c['name'] for c in inspect(db.engine).get_columns('user_presence')}
+    if 'worker' not in columns:
+        UserPresence.__table__.drop(db.engine)
+        UserPresence.__table__.create(db.engine)
+
+@click.command('migrate')
+@with_appcontext
+def migrate_command():
+    """ساخت جدول‌ها و اجرای مهاجرت‌های اعمال‌نشده"""
+    done = upgrade()
+    click.echo(f"applied migrations: {', '.join(map(str, done))}" if done else 'schema is up to date')
+
+@click.command('seed')
+@with_appcontext
+def seed_command():
+    """ساخت اتاق‌های پیش‌فرض و کاربر admin"""
+    created = seed_defaults()
+    click.echo(f"created: {', '.join(created)}" if created else 'nothing to seed')
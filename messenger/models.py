@@ -1,13 +1,27 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy.orm import aliased
 from datetime import datetime
-import random
-import string
 
 db = SQLAlchemy()
 
+def canonical_dm_key(a_id, b_id):
+    """کلید یکتای مکالمه دو کاربر، مستقل از جهت پیام"""
+    return f"{min(a_id, b_id)}_{max(a_id, b_id)}"
+
+def _dm_conversation_key(context):
+    params = context.get_current_parameters()
+    return canonical_dm_key(params['sender_id'], params['receiver_id'])
+
+def _greatest(expr, value):
+    """بزرگ‌تر از دو مقدار در SQL؛ max دوتایی فقط در SQLite تابع اسکالر است"""
+    return db.case((expr < value, value), else_=expr)
+
 class User(db.Model, UserMixin):
     __tablename__ = 'user'
+    __table_args__ = (
+        db.Index('ix_user_joined', 'joined_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -22,64 +36,324 @@ class User(db.Model, UserMixin):
     sent_dms = db.relationship('DirectMessage', foreign_keys='DirectMessage.sender_id', backref='sender', lazy=True)
     received_dms = db.relationship('DirectMessage', foreign_keys='DirectMessage.receiver_id', backref='receiver', lazy=True)
 
-    @staticmethod
-    def generate_code():
-        """تولید کد ۷ رقمی منحصر به فرد"""
-        while True:
-            code = ''.join(random.choices(string.digits, k=7))
-            if not User.query.filter_by(code=code).first():
-                return code
-
     def get_conversations(self):
-        """گرفتن تمام مکالمات کاربر"""
-        sent_conversations = db.session.query(
-            DirectMessage.receiver_id
-        ).filter(
-            DirectMessage.sender_id == self.id
-        ).distinct().all()
-        
-        received_conversations = db.session.query(
-            DirectMessage.sender_id
-        ).filter(
-            DirectMessage.receiver_id == self.id
-        ).distinct().all()
-        
-        all_conversation_ids = set()
-        for conv in sent_conversations:
-            all_conversation_ids.add(conv[0])
-        for conv in received_conversations:
-            all_conversation_ids.add(conv[0])
-        
-        return list(all_conversation_ids)
+        """گرفتن شناسه تمام کاربرانی که با آنها مکالمه داریم"""
+        return [conv.other_user_id(self.id) for conv in Conversation.for_user(self.id)]
+
+class CodeCounter(db.Model):
+    """شمارنده و کلید جایگشت تخصیص کد کاربران؛ فقط یک ردیف دارد"""
+    __tablename__ = 'code_counter'
+    id = db.Column(db.Integer, primary_key=True)
+    next_value = db.Column(db.Integer, nullable=False, default=0)
+    key = db.Column(db.String(32), nullable=False)
 
 class Room(db.Model):
     __tablename__ = 'room'
     id = db.Column(db.Integer, primary_key=True)
     slug = db.Column(db.String(50), unique=True, nullable=False)
     title = db.Column(db.String(100), nullable=False)
+    # آخرین شماره ترتیبی پیام‌های اتاق؛ فقط allocate_sequences آن را افزایش می‌دهد
+    last_seq = db.Column(db.Integer, nullable=False, server_default='0')
 
     messages = db.relationship('Message', backref='room', lazy=True)
 
+class Attachment(db.Model):
+    """فایل پیوست پیام؛ محتوا با sha256 یک بار روی دیسک ذخیره می‌شود
+
+    هر بارگذاری ردیف خودش را دارد (نام، نوع و فرستنده) و ردیف‌های هم‌محتوا فایل
+    مشترک دارند. هنگام فرستادن اولین پیام، پیوست به اتاق یا مکالمه آن بسته می‌شود
+    (kind و scope مانند archive_segment) و دسترسی دیگران از همین محدوده تعیین می‌شود.
+    """
+    __tablename__ = 'attachment'
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False, index=True)
+    size = db.Column(db.Integer, nullable=False)
+    content_type = db.Column(db.String(100), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    uploader_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    kind = db.Column(db.String(1))
+    scope = db.Column(db.String(32))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def readable_by(self, user_id):
+        """فرستنده همیشه؛ پیوست اتاق هر کاربر واردشده؛ پیوست DM فقط دو طرف مکالمه"""
+        if self.uploader_id == user_id or self.kind == 'm':
+            return True
+        return self.kind == 'd' and str(user_id) in self.scope.split('_')
+
 class Message(db.Model):
     __tablename__ = 'message'
+    __table_args__ = (
+        db.Index('ix_message_room_created', 'room_id', 'created_at'),
+        db.Index('ix_message_room_seq', 'room_id', 'seq', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     room_id = db.Column(db.Integer, db.ForeignKey('room.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     content = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    seq = db.Column(db.Integer)
+    attachment_id = db.Column(db.Integer, db.ForeignKey('attachment.id'))
+
+    # selectin فقط برای پیام‌هایی که پیوست دارند یک کوئری IN برای کل صفحه می‌زند
+    attachment = db.relationship('Attachment', lazy='selectin')
 
 class DirectMessage(db.Model):
     __tablename__ = 'direct_message'
+    __table_args__ = (
+        db.Index('ix_dm_conversation_created', 'conversation_key', 'created_at'),
+        db.Index('ix_dm_conversation_seq', 'conversation_key', 'seq', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     receiver_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    conversation_key = db.Column(db.String(32), nullable=False, default=_dm_conversation_key)
     content = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_read = db.Column(db.Boolean, default=False)
+    seq = db.Column(db.Integer)
+    attachment_id = db.Column(db.Integer, db.ForeignKey('attachment.id'))
+
+    attachment = db.relationship('Attachment', lazy='selectin')
 
     def get_other_user(self, current_user_id):
         """گرفتن کاربر مقابل در مکالمه"""
         if self.sender_id == current_user_id:
             return self.receiver
         else:
-            return self.sender
\ No newline at end of file
+            return self.sender
+
+class UserPresence(db.Model):
+    """آخرین زمان آنلاین بودن کاربر روی هر پردازه؛ هر پردازه فقط ردیف خودش را تازه یا حذف می‌کند"""
+    __tablename__ = 'user_presence'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    worker = db.Column(db.String(80), primary_key=True)
+    last_seen = db.Column(db.DateTime, nullable=False, index=True)
+
+class ArchiveSegment(db.Model):
+    """یک تکه gzip از پیام‌های بایگانی‌شده در فایل ماهانه یک اتاق یا مکالمه
+
+    فایل‌ها فقط افزوده می‌شوند؛ هر اجرای بایگانی تکه تازه‌ای در انتهای فایل
+    می‌نویسد و offset و length آن اینجا ثبت می‌شود تا بتوان فقط همان تکه را خواند.
+    """
+    __tablename__ = 'archive_segment'
+    __table_args__ = (
+        db.Index('ix_archive_scope_last', 'kind', 'scope', 'last_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    # m برای پیام اتاق (scope = room_id) و d برای DM (scope = conversation_key)
+    kind = db.Column(db.String(1), nullable=False)
+    scope = db.Column(db.String(32), nullable=False)
+    month = db.Column(db.String(7), nullable=False)
+    offset = db.Column(db.Integer, nullable=False)
+    length = db.Column(db.Integer, nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+    raw_bytes = db.Column(db.Integer, nullable=False)
+    first_id = db.Column(db.Integer, nullable=False)
+    last_id = db.Column(db.Integer, nullable=False)
+    first_at = db.Column(db.DateTime, nullable=False)
+    last_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Conversation(db.Model):
+    """خلاصه هر مکالمه خصوصی؛ با هر DM به صورت افزایشی به‌روز می‌شود"""
+    __tablename__ = 'conversation'
+    __table_args__ = (
+        db.Index('ix_conversation_a_activity', 'user_a_id', 'last_activity_at'),
+        db.Index('ix_conversation_b_activity', 'user_b_id', 'last_activity_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(32), unique=True, nullable=False)
+    # user_a همیشه شناسه کوچک‌تر است
+    user_a_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_b_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    last_message_id = db.Column(db.Integer, db.ForeignKey('direct_message.id'))
+    last_activity_at = db.Column(db.DateTime)
+    unread_a = db.Column(db.Integer, nullable=False, default=0)
+    unread_b = db.Column(db.Integer, nullable=False, default=0)
+    sent_by_a = db.Column(db.Integer, nullable=False, default=0)
+    sent_by_b = db.Column(db.Integer, nullable=False, default=0)
+    last_seq = db.Column(db.Integer, nullable=False, server_default='0')
+    # بزرگ‌ترین seq خوانده‌شده هر طرف (high-water mark رسید خواندن)
+    read_seq_a = db.Column(db.Integer, nullable=False, server_default='0')
+    read_seq_b = db.Column(db.Integer, nullable=False, server_default='0')
+
+    user_a = db.relationship('User', foreign_keys=[user_a_id])
+    user_b = db.relationship('User', foreign_keys=[user_b_id])
+    last_message = db.relationship('DirectMessage', foreign_keys=[last_message_id])
+
+    @staticmethod
+    def for_user(user_id):
+        """مکالمات کاربر به ترتیب آخرین فعالیت"""
+        return Conversation.query.filter(
+            (Conversation.user_a_id == user_id) | (Conversation.user_b_id == user_id)
+        ).order_by(Conversation.last_activity_at.desc())
+
+    @staticmethod
+    def friend_rows(user_id):
+        """(شناسه کاربر مقابل، خوانده‌نشده) مکالمات کاربر به ترتیب آخرین فعالیت، بدون بارگذاری کاربران"""
+        is_a = Conversation.user_a_id == user_id
+        return db.session.query(
+            db.case((is_a, Conversation.user_b_id), else_=Conversation.user_a_id),
+            db.case((is_a, Conversation.unread_a), else_=Conversation.unread_b),
+        ).filter(
+            (Conversation.user_a_id == user_id) | (Conversation.user_b_id == user_id)
+        ).order_by(Conversation.last_activity_at.desc()).all()
+
+    @staticmethod
+    def inbox_page(user_id, page, size):
+        """یک صفحه از مکالمات کاربر فقط با ستون‌های لازم؛ خروجی (ردیف‌ها، صفحه بعد دارد)
+
+        کاربر مقابل و آخرین پیام در همان کوئری join می‌شوند، پس تعداد کوئری
+        مستقل از تعداد مکالمات است.
+        """
+        is_a = Conversation.user_a_id == user_id
+        other = aliased(User)
+        rows = db.session.query(
+            other.username,
+            other.code,
+            DirectMessage.content.label('last_content'),
+            DirectMessage.sender_id.label('last_sender_id'),
+            DirectMessage.created_at.label('last_at'),
+            db.case((is_a, Conversation.unread_a), else_=Conversation.unread_b).label('unread'),
+        ).select_from(Conversation).join(
+            other, other.id == db.case((is_a, Conversation.user_b_id), else_=Conversation.user_a_id)
+        ).join(
+            DirectMessage, DirectMessage.id == Conversation.last_message_id
+        ).filter(
+            (Conversation.user_a_id == user_id) | (Conversation.user_b_id == user_id)
+        ).order_by(
+            Conversation.last_activity_at.desc(), Conversation.id.desc()
+        ).offset((page - 1) * size).limit(size + 1).all()
+        return rows[:size], len(rows) > size
+
+    @staticmethod
+    def totals_for(user_id):
+        """تعداد کل پیام‌های ارسالی و دریافتی کاربر با یک کوئری تجمیعی روی شمارنده‌ها"""
+        is_a = Conversation.user_a_id == user_id
+        sent, received = db.session.query(
+            db.func.coalesce(db.func.sum(db.case((is_a, Conversation.sent_by_a), else_=Conversation.sent_by_b)), 0),
+            db.func.coalesce(db.func.sum(db.case((is_a, Conversation.sent_by_b), else_=Conversation.sent_by_a)), 0),
+        ).filter(
+            (Conversation.user_a_id == user_id) | (Conversation.user_b_id == user_id)
+        ).one()
+        return sent, received
+
+    def other_user_id(self, user_id):
+        return self.user_b_id if self.user_a_id == user_id else self.user_a_id
+
+    def other_user(self, user_id):
+        return self.user_b if self.user_a_id == user_id else self.user_a
+
+    def unread_for(self, user_id):
+        return self.unread_a if self.user_a_id == user_id else self.unread_b
+
+    def sent_by(self, user_id):
+        return self.sent_by_a if self.user_a_id == user_id else self.sent_by_b
+
+    def read_seq_for(self, user_id):
+        return self.read_seq_a if self.user_a_id == user_id else self.read_seq_b
+
+    def mark_read(self, user_id, seq):
+        """خوانده شدن پیام‌های دریافتی کاربر تا seq با یک UPDATE بازه‌ای روی (conversation_key, seq)
+
+        شمارنده unread به اندازه ردیف‌های تغییرکرده کم می‌شود؛ خروجی high-water
+        mark تازه یا None اگر چیزی جلو نرفت.
+        """
+        seq = min(seq, self.last_seq)
+        read_seq = self.read_seq_for(user_id)
+        if seq <= read_seq:
+            return None
+        rows = DirectMessage.query.filter(
+            DirectMessage.conversation_key == self.key,
+            DirectMessage.seq > read_seq,
+            DirectMessage.seq <= seq,
+            DirectMessage.receiver_id == user_id,
+            DirectMessage.is_read.isnot(True)
+        ).update({DirectMessage.is_read: True}, synchronize_session=False)
+        # مقایسه و کاهش در سمت دیتابیس تا گزارش هم‌زمان پردازه دیگر گم نشود
+        if self.user_a_id == user_id:
+            self.read_seq_a = _greatest(Conversation.read_seq_a, seq)
+            if rows:
+                self.unread_a = _greatest(Conversation.unread_a - rows, 0)
+        else:
+            self.read_seq_b = _greatest(Conversation.read_seq_b, seq)
+            if rows:
+                self.unread_b = _greatest(Conversation.unread_b - rows, 0)
+        return seq
+
+    @staticmethod
+    def apply_messages(objs):
+        """به‌روزرسانی مکالمات برای یک دسته DM تازه؛ پس از flush اجرا می‌شود"""
+        by_key = {}
+        for msg in objs:
+            if isinstance(msg, DirectMessage):
+                by_key.setdefault(msg.conversation_key, []).append(msg)
+        if not by_key:
+            return
+
+        existing = {
+            conv.key: conv
+            for conv in Conversation.query.filter(Conversation.key.in_(list(by_key)))
+        }
+        for key, messages in by_key.items():
+            first = messages[0]
+            lo, hi = min(first.sender_id, first.receiver_id), max(first.sender_id, first.receiver_id)
+            last = max(messages, key=lambda m: m.id)
+            unread_a = sum(1 for m in messages if m.receiver_id == lo)
+            unread_b = len(messages) - unread_a
+
+            conv = existing.get(key)
+            if conv is None:
+                conv = Conversation(key=key, user_a_id=lo, user_b_id=hi,
+                                    unread_a=unread_a, unread_b=unread_b,
+                                    sent_by_a=unread_b, sent_by_b=unread_a)
+                db.session.add(conv)
+            else:
+                # افزایش در سمت دیتابیس تا به‌روزرسانی‌های هم‌زمان گم نشوند
+                conv.unread_a = Conversation.unread_a + unread_a
+                conv.unread_b = Conversation.unread_b + unread_b
+                conv.sent_by_a = Conversation.sent_by_a + unread_b
+                conv.sent_by_b = Conversation.sent_by_b + unread_a
+            conv.last_message_id = last.id
+            conv.last_activity_at = last.created_at
+
+def allocate_sequences(objs):
+    """شماره ترتیبی (seq) پیوسته برای پیام‌های هر اتاق و هر مکالمه؛ پیش از flush دسته اجرا می‌شود
+
+    ابتدا شمارنده با UPDATE افزایش می‌یابد تا قفل نوشتن گرفته شود و دو
+    پردازه هرگز یک شماره را نگیرند، سپس مقدار جدید خوانده می‌شود. برای
+    اولین DM یک مکالمه، ردیف conversation همین‌جا ساخته می‌شود.
+    """
+    groups = {}
+    for obj in objs:
+        if isinstance(obj, DirectMessage):
+            if obj.conversation_key is None:
+                obj.conversation_key = canonical_dm_key(obj.sender_id, obj.receiver_id)
+            groups.setdefault((Conversation, obj.conversation_key), []).append(obj)
+        elif isinstance(obj, Message):
+            groups.setdefault((Room, obj.room_id), []).append(obj)
+
+    for (model, scope), members in groups.items():
+        column = model.key if model is Conversation else model.id
+        count = len(members)
+        updated = db.session.execute(
+            db.update(model).where(column == scope).values(last_seq=model.last_seq + count)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if updated:
+            last = db.session.execute(db.select(model.last_seq).where(column == scope)).scalar()
+        elif model is Conversation:
+            first = members[0]
+            db.session.add(Conversation(
+                key=scope,
+                user_a_id=min(first.sender_id, first.receiver_id),
+                user_b_id=max(first.sender_id, first.receiver_id),
+                last_seq=count
+            ))
+            last = count
+        else:
+            # اتاق ناموجود؛ درج پیام با خطای کلید خارجی رد می‌شود
+            continue
+        for i, obj in enumerate(members):
+            obj.seq = last - count + i + 1
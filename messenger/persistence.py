@@ -0,0 +1,210 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from queue import Queue, Full, Empty
+
+from models import db
+from concurrency import run_blocking
+from storage import retry_on_lock, is_lock_error
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class WriteBackpressure(Exception):
+    """صف نوشتن پر است و پیام جدید پذیرفته نشد"""
+
+
+class PendingWrite:
+    """یک ردیف در صف نوشتن که پس از commit پایدار می‌شود
+
+    on_commit پس از commit موفق با خود PendingWrite (که id و seq دارد)
+    در نخ/greenlet نویسنده فراخوانی می‌شود.
+    """
+
+    __slots__ = ('obj', 'id', 'seq', 'error', 'on_commit', '_done')
+
+    def __init__(self, obj, on_commit=None):
+        self.obj = obj
+        self.id = None
+        self.seq = None
+        self.error = None
+        self.on_commit = on_commit
+        self._done = threading.Event()
+
+    @property
+    def durable(self):
+        return self._done.is_set() and self.error is None
+
+    def wait(self, timeout=None):
+        """منتظر ماندن تا ذخیره شدن ردیف؛ True یعنی ردیف پایدار شده است"""
+        if not self._done.wait(timeout):
+            return False
+        return self.error is None
+
+    def _resolve(self, error=None):
+        self.error = error
+        self._done.set()
+        if error is None and self.on_commit is not None:
+            try:
+                self.on_commit(self)
+            except Exception:
+                logger.exception('on_commit callback failed')
+
+
+class MessageWriter:
+    """صف write-behind برای درج دسته‌ای Message و DirectMessage
+
+    هندلرهای سوکت ردیف را در صف می‌گذارند و بلافاصله برمی‌گردند؛
+    یک نخ پس‌زمینه ردیف‌ها را بر اساس اندازه یا زمان جمع می‌کند و
+    در یک تراکنش commit می‌کند، سپس on_commit هر ردیف (مثلاً پخش آن) را اجرا می‌کند.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._prepare_hooks = []
+        self._flush_hooks = []
+        self.stats = {'enqueued': 0, 'written': 0, 'failed': 0, 'batches': 0, 'rejected': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MESSAGE_WRITE_BEHIND', True)
+        app.config.setdefault('MESSAGE_BATCH_SIZE', 200)
+        app.config.setdefault('MESSAGE_FLUSH_INTERVAL', 0.05)
+        app.config.setdefault('MESSAGE_QUEUE_MAX', 10000)
+        app.config.setdefault('MESSAGE_ENQUEUE_TIMEOUT', 1.0)
+        app.config.setdefault('MESSAGE_ACK_DURABLE', False)
+        app.config.setdefault('MESSAGE_ACK_TIMEOUT', 5.0)
+        # پخش پیام زنده فقط پس از commit (با id و seq)؛ پیش‌فرض پخش بی‌درنگ و سپس رویداد _saved
+        app.config.setdefault('MESSAGE_BROADCAST_AFTER_COMMIT', False)
+        self.app = app
+        app.extensions['message_writer'] = self
+        atexit.register(self.stop)
+
+    def before_flush(self, func):
+        """ثبت تابعی که در همان تراکنش، پیش از افزودن اشیای دسته به نشست اجرا می‌شود"""
+        if func not in self._prepare_hooks:
+            self._prepare_hooks.append(func)
+        return func
+
+    def on_flush(self, func):
+        """ثبت تابعی که پس از flush و پیش از commit هر دسته اجرا می‌شود"""
+        if func not in self._flush_hooks:
+            self._flush_hooks.append(func)
+        return func
+
+    @property
+    def backlog(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def submit(self, obj, on_commit=None):
+        """قرار دادن یک ردیف در صف؛ در صورت پر بودن صف WriteBackpressure"""
+        pending = PendingWrite(obj, on_commit)
+        if not self.app.config['MESSAGE_WRITE_BEHIND']:
+            # حالت همگام: همان مسیر commit در نخ جاری
+            pending._resolve(self._commit([pending])[0])
+            return pending
+
+        self._ensure_started()
+        try:
+            self._queue.put(pending, timeout=self.app.config['MESSAGE_ENQUEUE_TIMEOUT'])
+        except Full:
+            self.stats['rejected'] += 1
+            raise WriteBackpressure('message queue is full')
+        self.stats['enqueued'] += 1
+        return pending
+
+    def stop(self, timeout=10.0):
+        """خالی کردن صف و متوقف کردن نخ نویسنده"""
+        with self._lock:
+            thread = self._thread
+            if thread is None or self._pid != os.getpid():
+                return
+            self._queue.put(_STOP)
+            self._thread = None
+        thread.join(timeout)
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            # پس از fork نخ والد در فرزند وجود ندارد
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._queue = Queue(maxsize=self.app.config['MESSAGE_QUEUE_MAX'])
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='message-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        queue = self._queue
+        batch_size = self.app.config['MESSAGE_BATCH_SIZE']
+        interval = self.app.config['MESSAGE_FLUSH_INTERVAL']
+        stopping = False
+        while not stopping:
+            item = queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + interval
+            while len(batch) < batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = queue.get(timeout=remaining) if remaining > 0 else queue.get_nowait()
+                except Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            # commit در نخ واقعی تا در حالت gevent/eventlet حلقه رویداد مسدود نشود؛
+            # اعلام نتیجه به منتظرها دوباره در همین نخ/greenlet انجام می‌شود
+            errors = run_blocking(self._commit_in_context, batch)
+            for pending, error in zip(batch, errors):
+                pending._resolve(error)
+
+    def _commit_in_context(self, batch):
+        with self.app.app_context():
+            return self._commit(batch)
+
+    def _commit(self, batch):
+        """نوشتن یک دسته؛ خروجی فهرست خطا (یا None) برای هر ردیف است"""
+        try:
+            retry_on_lock(self._write, batch)
+        except Exception as exc:
+            db.session.rollback()
+            if len(batch) == 1 or is_lock_error(exc):
+                # قفل پس از همه تلاش‌ها: تکرار تک‌تک ردیف‌ها هم به همان قفل می‌خورد
+                logger.exception('failed to persist %d message(s)', len(batch))
+                self.stats['failed'] += len(batch)
+                return [exc] * len(batch)
+            # جدا کردن ردیف خراب از بقیه دسته
+            logger.warning('batch of %d failed, retrying one by one: %s', len(batch), exc)
+            return [self._commit([pending])[0] for pending in batch]
+        self.stats['batches'] += 1
+        self.stats['written'] += len(batch)
+        return [None] * len(batch)
+
+    def _write(self, batch):
+        objs = [pending.obj for pending in batch]
+        for hook in self._prepare_hooks:
+            hook(objs)
+        db.session.add_all(objs)
+        db.session.flush()
+        for hook in self._flush_hooks:
+            hook(objs)
+        for pending in batch:
+            pending.id = pending.obj.id
+            pending.seq = getattr(pending.obj, 'seq', None)
+        db.session.commit()
+
+
+message_writer = MessageWriter()
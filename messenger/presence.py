@@ -0,0 +1,254 @@
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from models import db, UserPresence
+from concurrency import run_in_app_context
+from storage import retry_on_lock
+
+logger = logging.getLogger(__name__)
+
+
+class _Session:
+    __slots__ = ('user_id', 'rooms', 'last_seen')
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.rooms = set()
+        self.last_seen = time.monotonic()
+
+
+class PresenceRegistry:
+    """وضعیت آنلاین بودن و در حال نوشتن بودن کاربران در اتاق‌ها و DMها
+
+    رویدادها فقط وضعیت را در حافظه تغییر می‌دهند و اتاق را کثیف علامت
+    می‌زنند؛ یک کار پس‌زمینه هر PRESENCE_FLUSH_INTERVAL ثانیه برای هر اتاق
+    تغییرکرده یک رویداد presence با تفاضل خالص (joined/left/typing) می‌فرستد.
+    نشست‌هایی که PRESENCE_TIMEOUT ثانیه رویداد یا heartbeat نفرستاده‌اند
+    قطع می‌شوند. کاربران آنلاین این پردازه در جدول user_presence تازه نگه
+    داشته می‌شوند تا داشبورد در حالت چند پردازه‌ای هم وضعیت درست را ببیند.
+    """
+
+    def __init__(self, app=None, socketio=None):
+        self.app = None
+        self.socketio = None
+        self._lock = threading.Lock()
+        self._reset()
+        if app is not None:
+            self.init_app(app, socketio)
+
+    def init_app(self, app, socketio):
+        app.config.setdefault('PRESENCE_FLUSH_INTERVAL', 1.0)
+        app.config.setdefault('PRESENCE_TIMEOUT', 60)
+        app.config.setdefault('TYPING_TIMEOUT', 5)
+        app.config.setdefault('PRESENCE_DB_REFRESH', 20)
+        self.app = app
+        self.socketio = socketio
+        app.extensions['presence'] = self
+
+    def _reset(self):
+        self._sessions = {}      # sid -> _Session
+        self._members = {}       # اتاق -> {user_id: تعداد نشست}
+        self._typing = {}        # اتاق -> {user_id: زمان انقضا}
+        self._names = {}         # user_id -> نام کاربری
+        self._sent = {}          # اتاق -> (آنلاین‌ها، نویسنده‌ها) آخرین ارسال
+        self._dirty = set()
+        self._local = {}         # user_id -> تعداد نشست در این پردازه
+        self._written = {}       # user_id -> آخرین نوشتن در user_presence
+        self._gone = set()
+        self._task_pid = None
+
+    # --- رویدادها -------------------------------------------------------
+
+    def connect(self, sid, user_id, username):
+        self._ensure_started()
+        with self._lock:
+            self._sessions[sid] = _Session(user_id)
+            self._names[user_id] = username
+            self._local[user_id] = self._local.get(user_id, 0) + 1
+            self._gone.discard(user_id)
+
+    def disconnect(self, sid):
+        with self._lock:
+            self._remove(sid)
+
+    def touch(self, sid):
+        session = self._sessions.get(sid)
+        if session is not None:
+            session.last_seen = time.monotonic()
+
+    def join(self, sid, room):
+        with self._lock:
+            session = self._sessions.get(sid)
+            if session is None or room in session.rooms:
+                return
+            session.rooms.add(room)
+            members = self._members.setdefault(room, {})
+            members[session.user_id] = members.get(session.user_id, 0) + 1
+            self._dirty.add(room)
+
+    def leave(self, sid, room):
+        with self._lock:
+            session = self._sessions.get(sid)
+            if session is not None and room in session.rooms:
+                self._leave(session, room)
+
+    def typing(self, sid, room, active=True):
+        """فقط برای اتاق‌هایی که این نشست عضو آنهاست پذیرفته می‌شود"""
+        with self._lock:
+            session = self._sessions.get(sid)
+            if session is None or room not in session.rooms:
+                return
+            typers = self._typing.setdefault(room, {})
+            if active:
+                if session.user_id not in typers:
+                    self._dirty.add(room)
+                typers[session.user_id] = time.monotonic() + self.app.config['TYPING_TIMEOUT']
+            elif typers.pop(session.user_id, None) is not None:
+                self._dirty.add(room)
+
+    # --- پرس‌وجو --------------------------------------------------------
+
+    def snapshot(self, room):
+        """وضعیت کامل یک اتاق برای کلاینتی که تازه عضو شده است"""
+        with self._lock:
+            online = list(self._members.get(room, ()))
+            typing = list(self._typing.get(room, ()))
+        return {
+            'room': room,
+            'full': True,
+            'online': [{'id': uid, 'name': self._names.get(uid)} for uid in online],
+            'typing': [self._names.get(uid) for uid in typing],
+        }
+
+    def online_user_ids(self, user_ids):
+        """زیرمجموعه آنلاین user_ids با یک کوئری روی کلید اصلی user_presence"""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+        online = {uid for uid in user_ids if self._local.get(uid)}
+        cutoff = datetime.utcnow() - timedelta(seconds=self.app.config['PRESENCE_TIMEOUT'])
+        rest = [uid for uid in user_ids if uid not in online]
+        if rest:
+            online.update(uid for (uid,) in db.session.query(UserPresence.user_id).filter(
+                UserPresence.user_id.in_(rest), UserPresence.last_seen > cutoff).distinct())
+        return online
+
+    # --- داخلی ----------------------------------------------------------
+
+    def _leave(self, session, room):
+        session.rooms.discard(room)
+        members = self._members.get(room, {})
+        count = members.get(session.user_id, 0) - 1
+        if count > 0:
+            members[session.user_id] = count
+        else:
+            members.pop(session.user_id, None)
+            self._typing.get(room, {}).pop(session.user_id, None)
+        if not members:
+            self._members.pop(room, None)
+        self._dirty.add(room)
+
+    def _remove(self, sid):
+        session = self._sessions.pop(sid, None)
+        if session is None:
+            return
+        for room in list(session.rooms):
+            self._leave(session, room)
+        count = self._local.get(session.user_id, 0) - 1
+        if count > 0:
+            self._local[session.user_id] = count
+        else:
+            self._local.pop(session.user_id, None)
+            self._written.pop(session.user_id, None)
+            self._gone.add(session.user_id)
+
+    def _ensure_started(self):
+        if self._task_pid == os.getpid():
+            return
+        with self._lock:
+            if self._task_pid == os.getpid():
+                return
+            self._task_pid = os.getpid()
+        self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        interval = self.app.config['PRESENCE_FLUSH_INTERVAL']
+        while True:
+            self.socketio.sleep(interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('presence flush failed')
+
+    def flush(self):
+        """ارسال تفاضل‌های جمع‌شده، حذف وضعیت‌های منقضی و تازه کردن user_presence"""
+        now = time.monotonic()
+        timeout = self.app.config['PRESENCE_TIMEOUT']
+        refresh = self.app.config['PRESENCE_DB_REFRESH']
+        with self._lock:
+            stale = [sid for sid, s in self._sessions.items() if now - s.last_seen > timeout]
+            for sid in stale:
+                self._remove(sid)
+            for room, typers in self._typing.items():
+                for uid in [uid for uid, expires in typers.items() if expires < now]:
+                    del typers[uid]
+                    self._dirty.add(room)
+
+            diffs = []
+            for room in self._dirty:
+                online = frozenset(self._members.get(room, ()))
+                typing = frozenset(self._typing.get(room, ()))
+                sent_online, sent_typing = self._sent.get(room, (frozenset(), frozenset()))
+                if online == sent_online and typing == sent_typing:
+                    continue
+                diffs.append((room, {
+                    'room': room,
+                    'joined': [{'id': uid, 'name': self._names.get(uid)} for uid in online - sent_online],
+                    'left': list(sent_online - online),
+                    'typing': [self._names.get(uid) for uid in typing],
+                }))
+                if online or typing:
+                    self._sent[room] = (online, typing)
+                else:
+                    self._sent.pop(room, None)
+            self._dirty.clear()
+            for room in [r for r, typers in self._typing.items() if not typers]:
+                del self._typing[room]
+
+            seen = [uid for uid in self._local if now - self._written.get(uid, 0) > refresh]
+            for uid in seen:
+                self._written[uid] = now
+            gone = list(self._gone)
+            self._gone.clear()
+
+        for sid in stale:
+            self.socketio.server.disconnect(sid)
+        for room, payload in diffs:
+            self.socketio.emit('presence', payload, to=room)
+        if seen or gone:
+            # در حالت threading run_in_app_context خودش context نمی‌سازد
+            with self.app.app_context():
+                run_in_app_context(self.app, retry_on_lock, self._write, self._worker_key(), seen, gone)
+
+    def _worker_key(self):
+        """کلید این پردازه در user_presence؛ بدون WORKER_ID شماره پردازه"""
+        worker_id = self.app.config.get('WORKER_ID')
+        return f'{socket.gethostname()}:{os.getpid() if worker_id is None else worker_id}'
+
+    def _write(self, worker, seen, gone):
+        # فقط ردیف‌های همین پردازه؛ اتصال همان کاربر روی پردازه دیگر ردیف خودش را دارد
+        UserPresence.query.filter(UserPresence.worker == worker,
+                                  UserPresence.user_id.in_(seen + gone)).delete(synchronize_session=False)
+        now = datetime.utcnow()
+        # ردیف‌های منقضی پردازه‌های ازکارافتاده یا راه‌اندازی‌شده دوباره
+        cutoff = now - timedelta(seconds=self.app.config['PRESENCE_TIMEOUT'])
+        UserPresence.query.filter(UserPresence.last_seen < cutoff).delete(synchronize_session=False)
+        db.session.add_all(UserPresence(user_id=uid, worker=worker, last_seen=now) for uid in seen)
+        db.session.commit()
+
+
+presence = PresenceRegistry()
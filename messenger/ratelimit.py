@@ -0,0 +1,43 @@
+import threading
+import time
+from collections import OrderedDict
+
+class RateLimiter:
+    """محدودکننده token bucket به ازای هر کلید (IP، نام کاربری، ...)
+
+    هر کلید حداکثر burst توکن دارد و در هر ثانیه rate توکن پر می‌شود.
+    تعداد کلیدها با max_keys محدود است و کلیدهای قدیمی‌تر دور ریخته
+    می‌شوند. وضعیت در حافظه همین پردازه است.
+    """
+
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, key, cost=1):
+        """مصرف cost توکن؛ False اگر توکن کافی نباشد"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed
+
+    def retry_after(self, key, cost=1):
+        """ثانیه‌های لازم تا پر شدن cost توکن برای این کلید"""
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.burst, time.monotonic()))
+        tokens = min(self.burst, tokens + (time.monotonic() - last) * self.rate)
+        return max(0.0, (cost - tokens) / self.rate) if self.rate else float('inf')
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
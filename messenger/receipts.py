@@ -0,0 +1,102 @@
+import logging
+import os
+import threading
+
+from models import db, Conversation
+from concurrency import run_in_app_context
+from storage import retry_on_lock
+
+logger = logging.getLogger(__name__)
+
+
+class ReadReceipts:
+    """رسید خواندن پیام‌های خصوصی با high-water mark و نوشتن دسته‌ای
+
+    کلاینت بزرگ‌ترین seq دیده‌شده هر مکالمه را گزارش می‌دهد. گزارش‌ها فقط در
+    حافظه با بیشینه ادغام می‌شوند و یک کار پس‌زمینه هر READ_RECEIPT_INTERVAL
+    ثانیه همه را در یک تراکنش می‌نویسد: برای هر مکالمه و خواننده یک UPDATE
+    بازه‌ای (Conversation.mark_read) که شمارنده unread را هم کم می‌کند. پس از
+    commit برای هر خواننده‌ای که جلو رفته یک رویداد read به اتاق DM فرستاده می‌شود.
+    """
+
+    def __init__(self, app=None, socketio=None):
+        self.app = None
+        self.socketio = None
+        self._lock = threading.Lock()
+        self._pending = {}       # (کلید مکالمه، user_id) -> (seq، اتاق DM)
+        self._task_pid = None
+        self.stats = {'reports': 0, 'coalesced': 0, 'flushes': 0, 'advanced': 0}
+        if app is not None:
+            self.init_app(app, socketio)
+
+    def init_app(self, app, socketio):
+        app.config.setdefault('READ_RECEIPT_INTERVAL', 1.0)
+        self.app = app
+        self.socketio = socketio
+        app.extensions['receipts'] = self
+
+    def report(self, key, user_id, seq, room):
+        """ثبت high-water mark خواننده؛ گزارش‌های تکراری تا نوشتن بعدی یکی می‌شوند"""
+        self._ensure_started()
+        with self._lock:
+            self.stats['reports'] += 1
+            pending = self._pending.get((key, user_id))
+            if pending is not None:
+                self.stats['coalesced'] += 1
+                if pending[0] >= seq:
+                    return
+            self._pending[(key, user_id)] = (seq, room)
+
+    def _ensure_started(self):
+        if self._task_pid == os.getpid():
+            return
+        with self._lock:
+            if self._task_pid == os.getpid():
+                return
+            self._task_pid = os.getpid()
+            # گزارش‌های والد پیش از fork را والد خودش می‌نویسد
+            self._pending = {}
+        self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        interval = self.app.config['READ_RECEIPT_INTERVAL']
+        while True:
+            self.socketio.sleep(interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('read receipt flush failed')
+
+    def flush(self):
+        """نوشتن گزارش‌های جمع‌شده و ارسال رویدادهای read"""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        # در حالت threading run_in_app_context خودش context نمی‌سازد
+        with self.app.app_context():
+            marked = run_in_app_context(self.app, retry_on_lock, self._write, batch)
+        self.stats['flushes'] += 1
+        self.stats['advanced'] += len(marked)
+        for key, user_id, seq in marked:
+            self.socketio.emit('read', {'user_id': user_id, 'seq': seq}, to=batch[(key, user_id)][1])
+
+    @staticmethod
+    def _write(batch):
+        conversations = {
+            conv.key: conv
+            for conv in Conversation.query.filter(Conversation.key.in_({key for key, _ in batch}))
+        }
+        marked = []
+        for (key, user_id), (seq, room) in batch.items():
+            conv = conversations.get(key)
+            if conv is None or user_id not in (conv.user_a_id, conv.user_b_id):
+                continue
+            seq = conv.mark_read(user_id, seq)
+            if seq is not None:
+                marked.append((key, user_id, seq))
+        db.session.commit()
+        return marked
+
+
+receipts = ReadReceipts()
@@ -0,0 +1,381 @@
+import bisect
+import math
+import re
+import threading
+import unicodedata
+from collections import namedtuple
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from markupsafe import Markup, escape
+from sqlalchemy import text
+from sqlalchemy.orm import joinedload
+
+from models import db, User, Room, Message, DirectMessage, Conversation
+
+# یکسان‌سازی نویسه‌های عربی/فارسی، حذف نیم‌فاصله و کشیده، ارقام فارسی و عربی
+_CHAR_MAP = {
+    'ي': 'ی', 'ى': 'ی', 'ك': 'ک', 'ة': 'ه', 'ۀ': 'ه',
+    'أ': 'ا', 'إ': 'ا', 'ٱ': 'ا', 'ؤ': 'و',
+    '\u200c': '', '\u200d': '', '\u200e': '', '\u200f': '', 'ـ': '',
+}
+_CHAR_MAP.update({d: str(i) for i, d in enumerate('۰۱۲۳۴۵۶۷۸۹')})
+_CHAR_MAP.update({d: str(i) for i, d in enumerate('٠١٢٣٤٥٦٧٨٩')})
+
+_WORD = re.compile(r'\w+')
+MAX_QUERY_TERMS = 10
+
+SearchHit = namedtuple('SearchHit', 'kind message snippet')
+
+def _normalized_chars(content):
+    """برای هر نویسه متن اصلی: (اندیس، نویسه‌های نرمال‌شده)"""
+    for i, ch in enumerate(content):
+        out = []
+        for c in unicodedata.normalize('NFKC', ch).lower():
+            c = _CHAR_MAP.get(c, c)
+            # حذف اعراب (فتحه، تشدید، تنوین، ...)
+            if c and unicodedata.category(c) != 'Mn':
+                out.append(c)
+        yield i, ''.join(out)
+
+def normalize_text(content):
+    """نرمال‌سازی متن فارسی برای نمایه و پرس‌وجو"""
+    return ''.join(chars for _, chars in _normalized_chars(content))
+
+def tokenize(content):
+    return _WORD.findall(normalize_text(content))
+
+def make_snippet(content, terms, width=120):
+    """برشی از متن اصلی با <mark> روی واژه‌هایی که با یکی از terms شروع می‌شوند"""
+    norm, origin = [], []
+    for i, chars in _normalized_chars(content):
+        for c in chars:
+            norm.append(c)
+            origin.append(i)
+    norm = ''.join(norm)
+
+    spans = []
+    for match in _WORD.finditer(norm):
+        if any(match.group().startswith(term) for term in terms):
+            end = origin[match.end()] if match.end() < len(origin) else len(content)
+            spans.append((origin[match.start()], end))
+
+    start = max(0, spans[0][0] - width // 3) if spans else 0
+    end = min(len(content), start + width)
+    parts = [Markup('…')] if start > 0 else []
+    pos = start
+    for span_start, span_end in spans:
+        if span_start < pos or span_end > end:
+            continue
+        parts.append(escape(content[pos:span_start]))
+        parts.append(Markup('<mark>%s</mark>') % content[span_start:span_end])
+        pos = span_end
+    parts.append(escape(content[pos:end]))
+    if end < len(content):
+        parts.append(Markup('…'))
+    return Markup('').join(parts)
+
+def _row(kind, msg_id, content, scope):
+    """(rowid، متن نرمال، نوع، محدوده)؛ rowid زوج برای پیام اتاق و فرد برای DM"""
+    return msg_id * 2 + (kind == 'd'), normalize_text(content), kind, scope
+
+def _doc(obj):
+    if isinstance(obj, DirectMessage):
+        return _row('d', obj.id, obj.content, obj.conversation_key)
+    return _row('m', obj.id, obj.content, str(obj.room_id))
+
+def _iter_docs(chunk=2000):
+    """همه پیام‌های جدول‌های داغ و سپس بایگانی، دسته به دسته"""
+    sources = (('m', Message, Message.room_id), ('d', DirectMessage, DirectMessage.conversation_key))
+    for kind, model, scope in sources:
+        result = db.session.execute(
+            db.select(model.id, model.content, scope).order_by(model.id)
+            .execution_options(yield_per=chunk)
+        )
+        for rows in result.partitions():
+            yield [_row(kind, msg_id, content, str(value)) for msg_id, content, value in rows]
+    archive = current_app.extensions.get('archive')
+    if archive is not None:
+        for records in archive.documents():
+            yield [_row(*record) for record in records]
+
+class FTS5Backend:
+    """نمایه در جدول مجازی FTS5 همان دیتابیس؛ در تراکنش درج پیام به‌روز می‌شود"""
+
+    name = 'fts5'
+
+    @staticmethod
+    def available():
+        if db.engine.dialect.name != 'sqlite':
+            return False
+        options = {row[0] for row in db.session.execute(text('PRAGMA compile_options'))}
+        return 'ENABLE_FTS5' in options
+
+    def create(self):
+        # متن از پیش نرمال شده است؛ unicode61 فقط بر اساس حروف و ارقام جدا می‌کند
+        db.session.execute(text(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5('
+            "body, kind UNINDEXED, scope UNINDEXED, tokenize='unicode61 remove_diacritics 2')"
+        ))
+
+    def add(self, docs):
+        db.session.execute(
+            text('INSERT OR REPLACE INTO search_index (rowid, body, kind, scope) '
+                 'VALUES (:rowid, :body, :kind, :scope)'),
+            [{'rowid': r, 'body': b, 'kind': k, 'scope': s} for r, b, k, s in docs]
+        )
+
+    def remove(self, rowids):
+        db.session.execute(text('DELETE FROM search_index WHERE rowid = :rowid'),
+                           [{'rowid': r} for r in rowids])
+
+    def clear(self):
+        db.session.execute(text('DELETE FROM search_index'))
+
+    def query(self, terms, user_id, scope, limit, offset):
+        match = ' '.join(f'"{term}"*' for term in terms)
+        sql = 'SELECT rowid, scope FROM search_index WHERE search_index MATCH :match AND '
+        params = {'match': match, 'user_id': user_id, 'limit': limit, 'offset': offset}
+        if scope is not None:
+            sql += 'kind = :kind AND scope = :scope '
+            params.update(kind=scope[0], scope=scope[1])
+        else:
+            # همه اتاق‌ها عمومی‌اند؛ از DMها فقط مکالمات خود کاربر
+            sql += ("(kind = 'm' OR scope IN (SELECT key FROM conversation "
+                    'WHERE user_a_id = :user_id OR user_b_id = :user_id)) ')
+        sql += 'ORDER BY bm25(search_index) LIMIT :limit OFFSET :offset'
+        return [(rowid, value) for rowid, value in db.session.execute(text(sql), params)]
+
+class MemoryBackend:
+    """نمایه معکوس در حافظه با رتبه‌بندی BM25، وقتی FTS5 در دسترس نیست
+
+    در اولین جست‌وجو از روی دیتابیس ساخته می‌شود و فقط درج‌های همین پردازه
+    را دنبال می‌کند؛ در حالت چند پردازه‌ای FTS5 را ترجیح دهید.
+    """
+
+    name = 'memory'
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    def create(self):
+        pass
+
+    def clear(self):
+        with self._lock:
+            self.postings = {}      # واژه -> {rowid: تعداد}
+            self.vocabulary = []    # فهرست مرتب واژه‌ها برای جست‌وجوی پیشوندی
+            self.docs = {}          # rowid -> (نوع، محدوده، طول، واژه‌ها)
+            self.total_length = 0
+            self.loaded = False
+
+    def add(self, docs):
+        with self._lock:
+            for rowid, body, kind, scope in docs:
+                if rowid in self.docs:
+                    continue
+                tokens = _WORD.findall(body)
+                self.docs[rowid] = (kind, scope, len(tokens), frozenset(tokens))
+                self.total_length += len(tokens)
+                for token in tokens:
+                    postings = self.postings.get(token)
+                    if postings is None:
+                        postings = self.postings[token] = {}
+                        bisect.insort(self.vocabulary, token)
+                    postings[rowid] = postings.get(rowid, 0) + 1
+
+    def remove(self, rowids):
+        with self._lock:
+            for rowid in rowids:
+                doc = self.docs.pop(rowid, None)
+                if doc is None:
+                    continue
+                self.total_length -= doc[2]
+                # فقط فهرست واژه‌های همین سند، نه کل واژگان
+                for token in doc[3]:
+                    postings = self.postings[token]
+                    del postings[rowid]
+                    if not postings:
+                        del self.postings[token]
+                        del self.vocabulary[bisect.bisect_left(self.vocabulary, token)]
+
+    def _load(self):
+        with self._lock:
+            if self.loaded:
+                return
+            for docs in _iter_docs():
+                self.add(docs)
+            self.loaded = True
+
+    def _expand(self, term):
+        """ادغام فهرست‌های همه واژه‌هایی که با term شروع می‌شوند"""
+        merged = {}
+        i = bisect.bisect_left(self.vocabulary, term)
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(term):
+            for rowid, tf in self.postings[self.vocabulary[i]].items():
+                merged[rowid] = merged.get(rowid, 0) + tf
+            i += 1
+        return merged
+
+    def query(self, terms, user_id, scope, limit, offset):
+        self._load()
+        if scope is None:
+            keys = {key for (key,) in db.session.query(Conversation.key).filter(
+                (Conversation.user_a_id == user_id) | (Conversation.user_b_id == user_id))}
+
+            def visible(doc):
+                return doc[0] == 'm' or doc[1] in keys
+        else:
+            def visible(doc):
+                return doc[0] == scope[0] and doc[1] == scope[1]
+
+        with self._lock:
+            matches = [self._expand(term) for term in terms]
+            count = len(self.docs) or 1
+            avg_length = self.total_length / count or 1
+            scores = {}
+            for rowid in set.intersection(*(set(m) for m in matches)):
+                doc = self.docs[rowid]
+                if not visible(doc):
+                    continue
+                score = 0.0
+                for postings in matches:
+                    tf = postings[rowid]
+                    idf = math.log((count - len(postings) + 0.5) / (len(postings) + 0.5) + 1)
+                    score += idf * tf * (self.K1 + 1) / (
+                        tf + self.K1 * (1 - self.B + self.B * doc[2] / avg_length))
+                scores[rowid] = score
+            ranked = sorted(scores, key=lambda r: (-scores[r], -r))
+            return [(rowid, self.docs[rowid][1]) for rowid in ranked[offset:offset + limit]]
+
+class SearchIndex:
+    """جست‌وجوی متن کامل پیام‌های اتاق و پیام‌های خصوصی
+
+    SEARCH_BACKEND یکی از auto، fts5 یا memory است؛ auto در صورت وجود
+    FTS5 از آن استفاده می‌کند. نمایه با هوک flush نویسنده پیام‌ها در همان
+    تراکنش درج به‌روز می‌شود. بایگانی پیام‌ها را از نمایه حذف نمی‌کند؛
+    نتیجه‌هایی که در جدول‌های داغ نیستند از بایگانی خوانده می‌شوند.
+    """
+
+    def __init__(self, app=None):
+        self._backend = None
+        self._memory = MemoryBackend()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SEARCH_BACKEND', 'auto')
+        app.config.setdefault('SEARCH_PAGE_SIZE', 20)
+        self._backend = None
+        app.extensions['search'] = self
+        app.cli.add_command(rebuild_command)
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            choice = current_app.config['SEARCH_BACKEND']
+            if choice == 'fts5' or (choice == 'auto' and FTS5Backend.available()):
+                self._backend = FTS5Backend()
+            else:
+                self._backend = self._memory
+        return self._backend
+
+    def index_messages(self, objs):
+        """هوک flush: افزودن پیام‌های تازه به نمایه"""
+        docs = [_doc(obj) for obj in objs if isinstance(obj, (Message, DirectMessage))]
+        if docs:
+            self.backend.add(docs)
+
+    def remove_messages(self, objs):
+        self.backend.remove([_doc(obj)[0] for obj in objs])
+
+    def rebuild(self):
+        """بازسازی کامل نمایه از روی جدول‌های پیام؛ خروجی تعداد پیام‌ها"""
+        backend = self.backend
+        backend.create()
+        backend.clear()
+        count = 0
+        for docs in _iter_docs():
+            backend.add(docs)
+            count += len(docs)
+        if backend is self._memory:
+            backend.loaded = True
+        db.session.commit()
+        return count
+
+    def search(self, user_id, query, page=1, room_id=None, conversation_key=None):
+        """نتایج رتبه‌بندی‌شده (SearchHit) و اینکه صفحه بعدی وجود دارد یا نه"""
+        terms = tokenize(query)[:MAX_QUERY_TERMS]
+        if not terms:
+            return [], False
+        scope = None
+        if room_id is not None:
+            scope = ('m', str(room_id))
+        elif conversation_key is not None:
+            scope = ('d', conversation_key)
+
+        size = current_app.config['SEARCH_PAGE_SIZE']
+        results = self.backend.query(terms, user_id, scope, size + 1, (page - 1) * size)
+        has_more = len(results) > size
+        results = results[:size]
+        rowids = [rowid for rowid, _ in results]
+
+        message_ids = [r // 2 for r in rowids if r % 2 == 0]
+        dm_ids = [r // 2 for r in rowids if r % 2 == 1]
+        found = {}
+        if message_ids:
+            for msg in Message.query.filter(Message.id.in_(message_ids)).options(
+                    joinedload(Message.user), joinedload(Message.room)):
+                found[msg.id * 2] = msg
+        if dm_ids:
+            for msg in DirectMessage.query.filter(DirectMessage.id.in_(dm_ids)).options(
+                    joinedload(DirectMessage.sender), joinedload(DirectMessage.receiver)):
+                found[msg.id * 2 + 1] = msg
+        self._fetch_archived([r for r in results if r[0] not in found], found)
+
+        hits = [
+            SearchHit('dm' if r % 2 else 'room', found[r], make_snippet(found[r].content, terms))
+            for r in rowids if r in found
+        ]
+        return hits, has_more
+
+    @staticmethod
+    def _fetch_archived(missing, found):
+        """پر کردن found با نتیجه‌های بایگانی‌شده؛ یک خواندن برای هر اتاق یا مکالمه"""
+        archive = current_app.extensions.get('archive')
+        if not missing or archive is None:
+            return
+        groups = {}
+        for rowid, scope in missing:
+            groups.setdefault(('d' if rowid % 2 else 'm', scope), []).append(rowid // 2)
+        messages = []
+        for (kind, scope), ids in groups.items():
+            for msg in archive.get_many(kind, scope, ids).values():
+                found[msg.id * 2 + (kind == 'd')] = msg
+                messages.append(msg)
+
+        room_ids = {msg.room_id for msg in messages if hasattr(msg, 'room_id')}
+        user_ids = {uid for msg in messages if hasattr(msg, 'sender_id')
+                    for uid in (msg.sender_id, msg.receiver_id)}
+        rooms = {room.id: room for room in Room.query.filter(Room.id.in_(room_ids))} if room_ids else {}
+        users = {user.id: user for user in User.query.filter(User.id.in_(user_ids))} if user_ids else {}
+        for msg in messages:
+            if hasattr(msg, 'room_id'):
+                msg.room = rooms.get(msg.room_id)
+            else:
+                msg.sender = users.get(msg.sender_id)
+                msg.receiver = users.get(msg.receiver_id)
+
+search_index = SearchIndex()
+
+@click.command('search-rebuild')
+@with_appcontext
+def rebuild_command():
+    """بازسازی نمایه جست‌وجو برای دیتابیس‌های موجود"""
+    index = current_app.extensions['search']
+    count = index.rebuild()
+    click.echo(f'{count} messages indexed ({index.backend.name})')
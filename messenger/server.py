@@ -0,0 +1,54 @@
+"""اجرای پیام‌رسان روی سرور ناهمگام gevent یا eventlet
+
+هر اتصال websocket یک greenlet سبک است نه یک نخ سیستم‌عامل، بنابراین
+هزاران اتصال بیکار با حافظه محدود نگه داشته می‌شوند. کارهای مسدودکننده
+(SQLite) از طریق concurrency.run_blocking و bcrypt در استخر جدای utils اجرا می‌شوند.
+پیش از گوش دادن مهاجرت‌ها، داده اولیه و ساخت فایل‌های استاتیک اجرا می‌شوند
+مگر با --no-migrate (پردازه‌های cluster.py که والدشان این کار را کرده است).
+
+    python server.py --host 0.0.0.0 --port 5000 --async-mode gevent
+"""
+import argparse
+import os
+import sys
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='اجرای پیام‌رسان روی سرور ناهمگام')
+    parser.add_argument('--host', default=os.environ.get('MESSENGER_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('MESSENGER_PORT', 5000)))
+    parser.add_argument('--async-mode', choices=['gevent', 'eventlet'],
+                        default=os.environ.get('MESSENGER_SOCKETIO_ASYNC_MODE', 'gevent'))
+    parser.add_argument('--no-migrate', action='store_true', help='بدون مهاجرت، داده اولیه و ساخت فایل‌های استاتیک')
+    return parser.parse_args(argv)
+
+
+def patch(mode):
+    """monkey patch باید پیش از import شدن Flask، SQLAlchemy و socket انجام شود"""
+    if mode == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+    else:
+        import eventlet
+        eventlet.monkey_patch()
+    os.environ['MESSENGER_SOCKETIO_ASYNC_MODE'] = mode
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    patch(args.async_mode)
+
+    from app import app, socketio
+    if not args.no_migrate:
+        from assets import assets
+        from migrations import upgrade, seed_defaults
+        with app.app_context():
+            upgrade()
+            seed_defaults()
+        assets.build()
+    print(f'🚀 پیام‌رسان ({args.async_mode}) روی http://{args.host}:{args.port}', file=sys.stderr)
+    socketio.run(app, host=args.host, port=args.port, log_output=False)
+
+
+if __name__ == '__main__':
+    main()
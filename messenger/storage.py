@@ -0,0 +1,128 @@
+import logging
+import random
+import time
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+# پروفایل‌های PRAGMA برای SQLite؛ default یعنی تنظیمات خود SQLite (rollback journal)
+PROFILES = {
+    'default': {},
+    'production': {
+        # آزادسازی تدریجی صفحه‌ها پس از بایگانی؛ برای دیتابیس موجود فقط پس از یک VACUUM اثر دارد
+        'auto_vacuum': 'INCREMENTAL',
+        # WAL: خواننده‌ها نویسنده را مسدود نمی‌کنند و commit فقط به انتهای فایل WAL می‌نویسد
+        'journal_mode': 'WAL',
+        # در WAL، NORMAL فقط هنگام checkpoint همگام‌سازی می‌کند و در برابر crash برنامه امن است
+        'synchronous': 'NORMAL',
+        'cache_size': -64000,
+        'mmap_size': 256 * 1024 * 1024,
+        'busy_timeout': 5000,
+        'temp_store': 'MEMORY',
+    },
+}
+
+lock_stats = {'retries': 0, 'failures': 0}
+
+def is_lock_error(exc):
+    """خطای database is locked / busy از SQLite"""
+    if not isinstance(exc, OperationalError):
+        return False
+    message = str(exc.orig).lower()
+    return 'locked' in message or 'busy' in message
+
+def retry_on_lock(func, *args, **kwargs):
+    """اجرای یک واحد کار تا commit و تکرار آن با backoff وقتی SQLite قفل است
+
+    پس از rollback تغییرات نشست از بین می‌رود، بنابراین func باید کل کار
+    (افزودن اشیا، به‌روزرسانی‌ها و commit) را از نو انجام دهد.
+    """
+    retries = current_app.config.get('DB_LOCK_RETRIES', 5)
+    backoff = current_app.config.get('DB_LOCK_BACKOFF', 0.02)
+    attempt = 0
+    while True:
+        try:
+            return func(*args, **kwargs)
+        except OperationalError as exc:
+            if not is_lock_error(exc):
+                raise
+            db.session.rollback()
+            if attempt >= retries:
+                lock_stats['failures'] += 1
+                raise
+            lock_stats['retries'] += 1
+            logger.warning('database locked, retry %d/%d', attempt + 1, retries)
+            time.sleep(backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+            attempt += 1
+
+class Storage:
+    """تنظیم engine پایگاه داده بر اساس پروفایل
+
+    init_app پیش از db.init_app گزینه‌های engine (استخر اتصال و busy timeout)
+    را تعیین می‌کند و attach پس از آن PRAGMAها را روی هر اتصال جدید اجرا
+    می‌کند. برای پایگاه‌های غیر SQLite (MESSENGER_SQLALCHEMY_DATABASE_URI)
+    فقط pool_pre_ping فعال می‌شود.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('STORAGE_PROFILE', 'production')
+        # بازنویسی تک‌تک PRAGMAها، مثلاً {"synchronous": "FULL"}
+        app.config.setdefault('SQLITE_PRAGMAS', {})
+        app.config.setdefault('SQLITE_POOL_SIZE', 10)
+        app.config.setdefault('SQLITE_POOL_TIMEOUT', 30)
+        app.config.setdefault('DB_LOCK_RETRIES', 5)
+        app.config.setdefault('DB_LOCK_BACKOFF', 0.02)
+        app.extensions['storage'] = self
+
+        options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+        url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+        if url.get_backend_name() != 'sqlite':
+            options.setdefault('pool_pre_ping', True)
+            return
+
+        pragmas = self.pragmas(app)
+        if 'busy_timeout' in pragmas:
+            # timeout درایور sqlite3 همان busy handler است، بر حسب ثانیه
+            options.setdefault('connect_args', {}).setdefault('timeout', pragmas['busy_timeout'] / 1000)
+        if url.database and url.database != ':memory:':
+            options.setdefault('pool_size', app.config['SQLITE_POOL_SIZE'])
+            options.setdefault('max_overflow', app.config['SQLITE_POOL_SIZE'])
+            options.setdefault('pool_timeout', app.config['SQLITE_POOL_TIMEOUT'])
+
+    def attach(self, app):
+        """ثبت اجرای PRAGMAها روی اتصال‌های engine ساخته‌شده توسط db.init_app"""
+        with app.app_context():
+            engine = db.engine
+        if engine.dialect.name != 'sqlite':
+            return
+        pragmas = self.pragmas(app)
+        if not pragmas:
+            return
+
+        @event.listens_for(engine, 'connect')
+        def set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+            cursor.close()
+
+    @staticmethod
+    def pragmas(app):
+        profile = app.config['STORAGE_PROFILE']
+        if profile not in PROFILES:
+            raise ValueError(f'unknown STORAGE_PROFILE {profile!r}')
+        pragmas = dict(PROFILES[profile])
+        pragmas.update(app.config['SQLITE_PRAGMAS'])
+        return pragmas
+
+storage = Storage()
@@ -0,0 +1,151 @@
+"""پیکربندی مشترک آزمون‌ها
+
+برنامه یک بار روی دیتابیس و پوشه‌های موقت ساخته می‌شود؛ هر آزمون کاربر و
+اتاق تازه خودش را می‌سازد تا به داده‌های آزمون‌های دیگر وابسته نباشد.
+اجرا از پوشه messenger:
+    python -m pytest -q tests
+"""
+import itertools
+import os
+import sys
+import tempfile
+import time
+from collections import namedtuple
+
+import pytest
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, HERE)
+
+_TMP = tempfile.mkdtemp(prefix='messenger-tests-')
+os.environ.update({
+    'MESSENGER_SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(_TMP, 'messenger.db')}",
+    'MESSENGER_WTF_CSRF_ENABLED': 'false',
+    'MESSENGER_BCRYPT_LOG_ROUNDS': '4',
+    'MESSENGER_ARCHIVE_DIR': os.path.join(_TMP, 'archive'),
+    'MESSENGER_ATTACHMENTS_DIR': os.path.join(_TMP, 'attachments'),
+    'MESSENGER_ASSETS_OUTPUT': os.path.join(_TMP, 'assets'),
+})
+# آزمون‌ها پشت سر هم پیام می‌فرستند؛ آزمون flood محدودیت‌های خودش را می‌سازد
+for _scope in ('CONNECTION', 'USER', 'ROOM'):
+    os.environ[f'MESSENGER_FLOOD_{_scope}_BURST'] = os.environ[f'MESSENGER_FLOOD_{_scope}_RATE'] = '1e9'
+
+_names = itertools.count(1)
+
+TestUser = namedtuple('TestUser', 'http id code name')
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app
+    from migrations import upgrade, seed_defaults
+    from persistence import message_writer
+
+    with app.app_context():
+        upgrade()
+        seed_defaults()
+    yield app
+    message_writer.stop()
+
+
+@pytest.fixture
+def ctx(app):
+    with app.app_context():
+        yield
+
+
+@pytest.fixture
+def make_user(app):
+    """ثبت‌نام یک کاربر تازه؛ http همان test client واردشده است"""
+    from models import User
+
+    def make():
+        name = f'user{next(_names)}'
+        http = app.test_client()
+        http.post('/register', data={'username': name, 'email': f'{name}@example.com',
+                                     'password': 'secret123'})
+        with app.app_context():
+            user = User.query.filter_by(username=name).one()
+            return TestUser(http, user.id, user.code, name)
+    return make
+
+
+@pytest.fixture
+def room(app):
+    """slug یک اتاق تازه"""
+    from models import db, Room
+
+    slug = f'room-{next(_names)}'
+    with app.app_context():
+        db.session.add(Room(slug=slug, title=slug))
+        db.session.commit()
+    return slug
+
+
+@pytest.fixture
+def room_id(app, room):
+    from models import Room
+    with app.app_context():
+        return Room.query.filter_by(slug=room).one().id
+
+
+@pytest.fixture
+def write_messages(app):
+    """نوشتن مستقیم پیام‌ها با هوک‌های نویسنده پیام‌ها (seq، شمارنده‌ها، نمایه)؛ خروجی شناسه‌ها"""
+    from persistence import PendingWrite, message_writer
+
+    def write(objs):
+        batch = [PendingWrite(obj) for obj in objs]
+        with app.app_context():
+            assert message_writer._commit(batch) == [None] * len(batch)
+        return [pending.id for pending in batch]
+    return write
+
+
+@pytest.fixture
+def connect(app):
+    """اتصال Socket.IO برای یک کاربر ساخته‌شده با make_user"""
+    from app import socketio
+
+    clients = []
+
+    def connect(user):
+        client = socketio.test_client(app, flask_test_client=user.http)
+        clients.append(client)
+        return client
+    yield connect
+    for client in clients:
+        if client.is_connected():
+            client.disconnect()
+
+
+@pytest.fixture
+def drain():
+    """صبر تا نوشته شدن همه پیام‌های صف نویسنده"""
+    from persistence import message_writer
+    return message_writer.stop
+
+
+@pytest.fixture
+def direct_emit(monkeypatch):
+    """پخش از مسیر عادی Flask-SocketIO تا test client رویدادهای اتاق را بگیرد"""
+    from fanout import fanout
+    monkeypatch.setattr(fanout, 'enabled', False)
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError('condition not reached')
+        time.sleep(0.005)
+
+
+def received(client, *names):
+    """(نام، داده) رویدادهای دریافتی client با یکی از names"""
+    events = []
+    for event in client.get_received():
+        if event['name'] in names:
+            args = event['args']
+            events.append((event['name'], args[0] if isinstance(args, list) else args))
+    return events
@@ -0,0 +1,96 @@
+"""بایگانی پیام‌های قدیمی در تکه‌های gzip و خواندن دوباره آنها"""
+import fcntl
+import os
+from datetime import datetime, timedelta
+
+
+def old_room_messages(room_id, user_id, count, days_ago, prefix='old'):
+    from models import Message
+    start = datetime.utcnow() - timedelta(days=days_ago)
+    return [Message(room_id=room_id, user_id=user_id, content=f'{prefix} {i}',
+                    created_at=start + timedelta(minutes=i)) for i in range(count)]
+
+
+def test_room_messages_move_to_segments(app, room_id, make_user, write_messages):
+    from archive import archiver
+    from models import Message, ArchiveSegment
+
+    user = make_user()
+    ids = write_messages(old_room_messages(room_id, user.id, 5, 300))
+    ids += write_messages(old_room_messages(room_id, user.id, 3, 299, 'later'))
+    recent = write_messages(old_room_messages(room_id, user.id, 2, 1, 'new'))
+    with app.app_context():
+        report = archiver.run(days=180)
+        assert report['rows'] >= 8 and report['stored_bytes'] > 0
+        assert [m.id for m in Message.query.filter_by(room_id=room_id)] == recent
+        [segment] = ArchiveSegment.query.filter_by(kind='m', scope=str(room_id)).all()
+        assert (segment.count, segment.first_id, segment.last_id) == (8, ids[0], ids[-1])
+
+        msg = archiver.get('m', room_id, ids[6])
+        assert (msg.content, msg.user_id, msg.archived) == ('later 1', user.id, True)
+        assert archiver.get('m', room_id, recent[0]) is None
+        page = archiver.history('m', room_id, limit=3)
+        assert [m.id for m in page] == ids[:-4:-1]
+        assert page[0].user.id == user.id
+        older = archiver.history('m', room_id, before=(page[-1].created_at, page[-1].id), limit=10)
+        assert [m.id for m in older] == ids[-4::-1]
+
+
+def test_second_run_appends_to_month_file(app, room_id, make_user, write_messages):
+    from archive import archiver
+    from models import ArchiveSegment
+
+    user = make_user()
+    first = write_messages(old_room_messages(room_id, user.id, 3, 300))
+    with app.app_context():
+        archiver.run(days=180)
+    second = write_messages(old_room_messages(room_id, user.id, 2, 300, 'late'))
+    with app.app_context():
+        archiver.run(days=180)
+        segments = ArchiveSegment.query.filter_by(kind='m', scope=str(room_id)).order_by(ArchiveSegment.id).all()
+        assert [s.count for s in segments] == [3, 2]
+        assert segments[1].offset == segments[0].offset + segments[0].length
+        assert set(archiver.get_many('m', room_id, first + second)) == set(first + second)
+
+
+def test_unread_and_last_direct_messages_stay_hot(app, make_user, write_messages):
+    from archive import archiver
+    from models import DirectMessage
+
+    user, friend = make_user(), make_user()
+    start = datetime.utcnow() - timedelta(days=300)
+    ids = write_messages([
+        DirectMessage(sender_id=user.id, receiver_id=friend.id, content=f'd{i}', is_read=i != 1,
+                      created_at=start + timedelta(minutes=i)) for i in range(4)])
+    with app.app_context():
+        archiver.run(days=180)
+        hot = [m.id for m in DirectMessage.query.filter(DirectMessage.id.in_(ids)).order_by(DirectMessage.id)]
+    assert hot == [ids[1], ids[3]]
+    page = friend.http.get(f'/dm/{user.code}/history').get_json()
+    assert [m['id'] for m in page['messages']] == ids
+
+
+def test_archived_messages_stay_searchable(app, room_id, make_user, write_messages):
+    from archive import archiver
+    from search import search_index
+
+    user = make_user()
+    [msg_id] = write_messages(old_room_messages(room_id, user.id, 1, 300, 'quokkaarchived'))
+    with app.app_context():
+        archiver.run(days=180)
+        hits, _ = search_index.search(user.id, 'quokkaarchived')
+        assert [(hit.message.id, hit.message.room.id, hit.message.archived) for hit in hits] == \
+            [(msg_id, room_id, True)]
+        # بازسازی نمایه پیام‌های بایگانی را هم از فایل‌ها برمی‌دارد
+        search_index.rebuild()
+        assert len(search_index.search(user.id, 'quokkaarchived')[0]) == 1
+
+
+def test_concurrent_run_is_skipped(app):
+    from archive import archiver
+
+    os.makedirs(app.config['ARCHIVE_DIR'], exist_ok=True)
+    with app.app_context():
+        with open(os.path.join(app.config['ARCHIVE_DIR'], '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            assert archiver.run(days=180)['skipped']
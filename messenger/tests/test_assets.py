@@ -0,0 +1,103 @@
+"""فایل‌های استاتیک اثرانگشت‌دار و پیش‌فشرده، جایگزین CDN و کش بخش‌های قالب"""
+import gzip
+import logging
+
+import pytest
+from flask import Flask
+
+
+@pytest.fixture
+def site(tmp_path):
+    """برنامه کوچک با پوشه assets موقت"""
+    from assets import Assets
+
+    source = tmp_path / 'assets'
+    (source / 'fonts').mkdir(parents=True)
+    (source / 'fonts' / 'icons.woff2').write_bytes(b'wOF2 font data')
+    (source / 'app.css').write_text('/* note */\nbody {\n  color : red ;\n}\n'
+                                    '@font-face { src: url("fonts/icons.woff2?v=1#x") }\n')
+    (source / 'app.js').write_text('// comment\nfunction hi() {\n    return 1\n}\n' * 50)
+    app = Flask('assets_site', root_path=str(tmp_path))
+    app.config.update(ASSETS_SOURCE=str(source), ASSETS_OUTPUT=str(tmp_path / 'dist'))
+    return app, Assets(app)
+
+
+def test_build_fingerprints_and_minifies(site):
+    app, assets = site
+    report = assets.build()
+    assert report['files'] == 3
+    css = assets.manifest['app.css']
+    font = assets.manifest['fonts/icons.woff2']
+    assert css.startswith('app.') and css.endswith('.css') and css != 'app.css'
+    built = f"{app.config['ASSETS_OUTPUT']}/{css}"
+    with open(built) as f:
+        text = f.read()
+    assert text.startswith('body{color : red}@font-face{')
+    # آدرس فونت به نام اثرانگشت‌دار بازنویسی می‌شود
+    assert f'url("{font}#x")' in text
+    with open(built + '.gz', 'rb') as f:
+        assert gzip.decompress(f.read()).decode() == text
+    # build دوباره فایلی نمی‌نویسد مگر manifest
+    assert assets.build()['written'] == 0
+
+
+def test_built_assets_are_immutable_and_precompressed(site):
+    app, assets = site
+    assets.build()
+    with app.test_request_context():
+        url = assets.url('app.js')
+    assert url == f"/assets/{assets.manifest['app.js']}"
+    client = app.test_client()
+    response = client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'max-age=31536000' in response.headers['Cache-Control']
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert 'Set-Cookie' not in response.headers
+    plain = client.get(url)
+    assert 'Content-Encoding' not in plain.headers
+    assert gzip.decompress(response.data) == plain.data
+
+
+def test_unbuilt_assets_fall_back(site, caplog):
+    app, assets = site
+    with app.test_request_context():
+        assert assets.url('app.css') == '/assets/app.css'
+        with caplog.at_level(logging.WARNING, logger='assets'):
+            assert assets.url('vendor/socket.io/socket.io.min.js').startswith('https://cdn.socket.io/')
+            assets.url('vendor/socket.io/socket.io.min.js')
+        assert len(caplog.records) == 1
+    response = app.test_client().get('/assets/app.css')
+    assert response.status_code == 200 and 'immutable' not in response.headers.get('Cache-Control', '')
+
+    app.config['ASSETS_CDN_FALLBACK'] = False
+    with pytest.raises(RuntimeError):
+        assets.build()
+
+
+def test_fragment_cache_renders_once_per_key(app):
+    from cache import FragmentCache
+
+    fragments = FragmentCache(app)
+    calls = []
+
+    def render():
+        calls.append(1)
+        return '<li>x</li>'
+    with app.app_context():
+        assert fragments.render('friends', (1, 2), render) == '<li>x</li>'
+        fragments.render('friends', (1, 2), render)
+        fragments.render('friends', (1, 3), render)
+        assert len(calls) == 2
+        fragments.invalidate('friends')
+        fragments.render('friends', (1, 2), render)
+        assert len(calls) == 3
+
+
+def test_dashboard_uses_built_assets(app, make_user):
+    from assets import assets
+
+    assets.build()
+    page = make_user().http.get('/dashboard').get_data(as_text=True)
+    assert f"/assets/{assets.manifest['app.js']}" in page
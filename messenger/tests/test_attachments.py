@@ -0,0 +1,113 @@
+"""پیوست‌ها: بستن به محدوده در تراکنش پیام، دانلود با Range و blob گم‌شده"""
+import os
+
+import pytest
+
+
+def upload(user, data=b'hello world' * 100, name='notes.txt'):
+    response = user.http.post('/attachments', data=data, headers={
+        'X-Filename': name, 'Content-Type': 'application/octet-stream'})
+    assert response.status_code == 201
+    return response.json
+
+
+def bound(app, attachment_id):
+    from models import db, Attachment
+    with app.app_context():
+        attachment = db.session.get(Attachment, attachment_id)
+        return attachment.kind, attachment.scope
+
+
+def test_claimed_in_message_batch(app, room, make_user, connect, drain):
+    from models import Room
+
+    user = make_user()
+    attachment = upload(user)
+    client = connect(user)
+    client.emit('join', {'room': room})
+    assert client.emit('message', {'room': room, 'msg': '', 'attachment_id': attachment['id']},
+                       callback=True) == {'ok': True}
+    # تا commit دسته پیوست هنوز آزاد است
+    drain()
+    with app.app_context():
+        room_id = Room.query.filter_by(slug=room).one().id
+    assert bound(app, attachment['id']) == ('m', str(room_id))
+
+
+def test_concurrent_claims_keep_one_scope(app, room, make_user, connect, drain, monkeypatch):
+    """دو پیام در یک دسته که یک پیوست آزاد را به دو محدوده می‌برند؛ دومی رد می‌شود"""
+    from models import Message, DirectMessage
+
+    # نخ نویسنده تازه با فاصله flush بلند هر دو پیام را در یک دسته می‌گیرد
+    drain()
+    monkeypatch.setitem(app.config, 'MESSAGE_FLUSH_INTERVAL', 0.5)
+    user, friend = make_user(), make_user()
+    attachment = upload(user)
+    client = connect(user)
+    client.emit('join', {'room': room})
+    first = client.emit('message', {'room': room, 'msg': 'a', 'attachment_id': attachment['id']},
+                        callback=True)
+    second = client.emit('dm', {'to': friend.code, 'msg': 'b', 'attachment_id': attachment['id']},
+                         callback=True)
+    assert first == second == {'ok': True}
+    drain()
+    with app.app_context():
+        assert Message.query.filter_by(attachment_id=attachment['id']).count() == 1
+        assert DirectMessage.query.filter_by(attachment_id=attachment['id']).count() == 0
+    assert bound(app, attachment['id'])[0] == 'm'
+
+
+def test_rejects_foreign_and_bound_attachments(app, room, make_user, connect, monkeypatch):
+    monkeypatch.setitem(app.config, 'MESSAGE_WRITE_BEHIND', False)
+    user, other = make_user(), make_user()
+    mine, theirs = upload(user), upload(other, b'other data')
+    client = connect(user)
+    client.emit('join', {'room': room})
+    rejected = {'ok': False, 'error': 'bad_attachment'}
+    assert client.emit('message', {'room': room, 'msg': '', 'attachment_id': theirs['id']},
+                       callback=True) == rejected
+    assert client.emit('message', {'room': room, 'msg': '', 'attachment_id': 'x'},
+                       callback=True) == rejected
+    assert client.emit('dm', {'to': other.code, 'msg': '', 'attachment_id': mine['id']},
+                       callback=True) == {'ok': True}
+    assert client.emit('message', {'room': room, 'msg': '', 'attachment_id': mine['id']},
+                       callback=True) == rejected
+
+
+def test_range_request(app, make_user):
+    user = make_user()
+    data = os.urandom(5000)
+    attachment = upload(user, data, 'r%C3%A9sum%C3%A9.bin')
+    response = user.http.get(attachment['url'], headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.data == data[100:200]
+    assert response.headers['Content-Range'] == 'bytes 100-199/5000'
+    assert "filename*=UTF-8''r%C3%A9sum%C3%A9.bin" in response.headers['Content-Disposition']
+    etag = user.http.get(attachment['url']).headers['ETag']
+    assert user.http.get(attachment['url'], headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_unbound_attachment_is_private(app, make_user):
+    user, other = make_user(), make_user()
+    attachment = upload(user)
+    assert other.http.get(attachment['url']).status_code == 404
+
+
+def test_missing_blob_is_404(app, make_user):
+    from attachments import attachments
+    from models import db, Attachment
+
+    user = make_user()
+    attachment = upload(user, os.urandom(64))
+    with app.app_context():
+        sha256 = db.session.get(Attachment, attachment['id']).sha256
+    os.remove(attachments.blob_path(sha256))
+    assert user.http.get(attachment['url']).status_code == 404
+
+
+@pytest.mark.parametrize('size, status', [(10, 201), (2000, 413)])
+def test_upload_size_limit(app, make_user, monkeypatch, size, status):
+    monkeypatch.setitem(app.config, 'ATTACHMENT_MAX_SIZE', 1000)
+    user = make_user()
+    response = user.http.post('/attachments', data=b'x' * size, headers={'X-Filename': 'f.bin'})
+    assert response.status_code == status
@@ -0,0 +1,44 @@
+"""اجرای کوچک بنچمارک‌ها تا با تغییر برنامه از کار نیفتند؛ اعداد سنجیده نمی‌شوند"""
+import json
+import os
+import subprocess
+import sys
+
+from conftest import HERE
+
+sys.path.insert(0, os.path.join(HERE, 'benchmarks'))
+
+
+def test_percentile_and_summary():
+    from bench_app import percentile, summarize
+
+    values = list(range(1, 101))
+    assert [percentile(values, p) for p in (50, 90, 99)] == [50, 90, 99]
+    assert percentile([], 50) is None
+    summary = summarize([0.002, 0.001, 0.003], 1, 0.5)
+    assert (summary['count'], summary['errors'], summary['throughput']) == (3, 1, 6.0)
+    assert (summary['p50_ms'], summary['max_ms']) == (2.0, 3.0)
+
+
+def test_bench_app_smoke_run(tmp_path):
+    output = tmp_path / 'run.json'
+    # پوشه‌های موقت conftest به ارث می‌رسند؛ بنچمارک دیتابیس خودش را تنظیم می‌کند
+    env = dict(os.environ)
+    command = [sys.executable, os.path.join(HERE, 'benchmarks', 'bench_app.py'),
+               '--users', '20', '--rooms', '2', '--friends', '2', '--messages', '200', '--dms', '200',
+               '--unread', '5', '--clients', '2', '--requests', '2', '--events', '2',
+               '--db', str(tmp_path / 'bench.db'), '--output', str(output)]
+    result = subprocess.run(command, cwd=str(tmp_path), env=env, capture_output=True, text=True, timeout=240)
+    assert result.returncode == 0, result.stderr
+    report = json.loads(output.read_text())
+    assert set(report['results']) == {'dashboard', 'my_messages', 'dm', 'room',
+                                      'socket_message', 'socket_dm', 'socket_sync', 'socket_read'}
+    assert all(r['errors'] == 0 and r['count'] > 0 for r in report['results'].values())
+
+    # اجرای دوباره روی همان دیتابیس پر نمی‌کند و با اجرای قبلی مقایسه می‌شود
+    again = subprocess.run(command[:-1] + [str(tmp_path / 'again.json'), '--compare', str(output),
+                                           '--only', 'room'],
+                           cwd=str(tmp_path), env=env, capture_output=True, text=True, timeout=240)
+    assert again.returncode == 0, again.stderr
+    assert 'vs baseline' in again.stderr
+    assert json.loads((tmp_path / 'again.json').read_text())['meta']['seeded'] is None
@@ -0,0 +1,97 @@
+"""کش جست‌وجوی کاربر و اتاق و حذف از آن پس از ویرایش ادمین"""
+import threading
+import time
+
+from sqlalchemy import event
+
+
+def make_admin(app, user):
+    from cache import lookup_cache
+    from models import db, User
+
+    with app.app_context():
+        row = db.session.get(User, user.id)
+        row.is_admin = True
+        db.session.commit()
+        lookup_cache.invalidate_user(row)
+
+
+def test_lru_evicts_oldest_and_expires():
+    from cache import LRUCache
+
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (1, None, 3)
+    expiring = LRUCache(ttl=0.01)
+    expiring.set('a', 1)
+    time.sleep(0.02)
+    assert expiring.get('a') is None
+    assert expiring.stats() == {'size': 0, 'hits': 0, 'misses': 1}
+
+
+def test_user_is_served_from_cache(app, make_user):
+    from cache import lookup_cache
+    from models import db
+
+    user = make_user()
+    with app.app_context():
+        assert lookup_cache.user(user.id).username == user.name
+        statements = []
+        engine = db.engine
+        thread = threading.get_ident()
+
+        def count(*args):
+            # نخ نویسنده پیام‌ها هم روی همین engine کوئری می‌زند
+            if threading.get_ident() == thread:
+                statements.append(args)
+        event.listen(engine, 'before_cursor_execute', count)
+        try:
+            cached = lookup_cache.user(user.id)
+            assert lookup_cache.user_id_by_code(user.code) == user.id
+            assert lookup_cache.user_id_by_code(user.code) == user.id
+        finally:
+            event.remove(engine, 'before_cursor_execute', count)
+        assert cached.username == user.name
+        assert cached in db.session
+        assert len(statements) == 1
+        assert lookup_cache.user(10 ** 9) is None
+
+
+def test_room_slug_lookup(app, room, room_id):
+    from cache import lookup_cache
+    from models import db, Room
+
+    with app.app_context():
+        assert lookup_cache.room_id(room) == room_id
+        db.session.get(Room, room_id).slug = f'{room}-renamed'
+        db.session.commit()
+        # تا invalidate_room شناسه کش‌شده برمی‌گردد
+        assert lookup_cache.room_id(room) == room_id
+        lookup_cache.invalidate_room(Room(slug=room))
+        assert lookup_cache.room_id(room) is None
+
+
+def test_deactivated_user_is_logged_out(app, make_user):
+    admin, user = make_user(), make_user()
+    make_admin(app, admin)
+    assert user.http.get('/dashboard').status_code == 200
+    response = admin.http.post(f'/admin/users/{user.id}/deactivate')
+    assert response.status_code == 302
+    assert user.http.get('/dashboard').status_code == 302
+
+
+def test_admin_rename_reaches_cached_user(app, make_user):
+    from cache import lookup_cache
+
+    admin, user = make_user(), make_user()
+    make_admin(app, admin)
+    with app.app_context():
+        lookup_cache.user(user.id)
+    response = admin.http.post(f'/admin/users/{user.id}', data={
+        'username': f'{user.name}x', 'email': f'{user.name}x@example.com', 'is_active': 'y'})
+    assert response.status_code == 302
+    with app.app_context():
+        assert lookup_cache.user(user.id).username == f'{user.name}x'
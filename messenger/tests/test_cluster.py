@@ -0,0 +1,89 @@
+"""اجرای چندپردازه‌ای: صف پیام SQLite، مسیریابی چسبنده پراکسی و رویدادهای داخلی"""
+import threading
+import time
+
+from conftest import wait_for
+
+
+class Polling:
+    """جای server در مدیر صف؛ اولین sleep یعنی شنونده جای شروعش را خوانده است"""
+
+    def __init__(self):
+        self.idle = threading.Event()
+
+    def sleep(self, seconds):
+        self.idle.set()
+        time.sleep(seconds)
+
+
+def test_sqlite_queue_round_trip(tmp_path):
+    from cluster import SQLiteQueueManager
+
+    url = f"sqlite:///{tmp_path / 'queue.db'}"
+    publisher = SQLiteQueueManager(url, write_only=True)
+    publisher._publish({'method': 'emit', 'event': 'old'})
+    listener = SQLiteQueueManager(url, write_only=True)
+    listener.server = Polling()
+    messages = []
+
+    def run():
+        for message in listener._listen():
+            messages.append(message)
+            if len(messages) == 2:
+                return
+    threading.Thread(target=run, daemon=True).start()
+    assert listener.server.idle.wait(5)
+    publisher._publish({'method': 'emit', 'event': 'a'})
+    publisher._publish({'method': 'emit', 'event': 'b'})
+    wait_for(lambda: len(messages) == 2)
+    # پیام‌های پیش از شروع شنیدن دوباره پخش نمی‌شوند
+    assert [m['event'] for m in messages] == ['a', 'b']
+
+
+def test_queue_options_pick_manager(tmp_path):
+    from cluster import SQLiteQueueManager, socketio_queue_options
+
+    options = socketio_queue_options(f"sqlite:///{tmp_path / 'queue.db'}", channel='c')
+    assert isinstance(options['client_manager'], SQLiteQueueManager)
+    assert options['client_manager'].channel == 'c'
+
+
+def test_sticky_proxy_routes_by_sid_prefix():
+    from cluster import StickyProxy
+
+    proxy = StickyProxy([('127.0.0.1', 5001), ('127.0.0.1', 5002), ('127.0.0.1', 5003)])
+    assert proxy.pick('/socket.io/?EIO=4&transport=polling&sid=2.abc') == 2
+    assert proxy.pick('/socket.io/?EIO=4&transport=websocket&sid=0.xyz') == 0
+    # handshake‌ها گردشی پخش می‌شوند و پیشوند نامعتبر هم handshake حساب می‌شود
+    assert [proxy.pick('/socket.io/?EIO=4&transport=polling') for _ in range(4)] == [0, 1, 2, 0]
+    assert proxy.pick('/socket.io/?EIO=4&sid=9.abc') == 1
+    assert [proxy.pick('/r/general') for _ in range(2)] == [0, 1]
+
+
+def test_forwarded_for_is_appended():
+    from cluster import StickyProxy
+
+    head = b'GET / HTTP/1.1\r\nHost: x\r\nX-Forwarded-For: 10.0.0.1\r\n\r\n'
+    assert b'X-Forwarded-For: 10.0.0.1, 10.0.0.2' in StickyProxy._forwarded_for(head, '10.0.0.2')
+    head = StickyProxy._forwarded_for(b'GET / HTTP/1.1\r\nHost: x\r\n\r\n', '10.0.0.2')
+    assert head.startswith(b'GET / HTTP/1.1\r\nX-Forwarded-For: 10.0.0.2\r\n')
+    closed = StickyProxy._close_connection(b'GET / HTTP/1.1\r\nConnection: keep-alive\r\n\r\n')
+    assert closed.count(b'Connection:') == 1 and b'Connection: close' in closed
+
+
+def test_tagged_session_ids():
+    from cluster import tag_session_ids
+    from socketio import Server
+
+    server = Server()
+    tag_session_ids(server, 3)
+    assert server.eio.generate_id().startswith('3.')
+
+
+def test_cluster_events_dispatch_locally_without_queue(app):
+    from cluster import cluster_events
+
+    seen = []
+    cluster_events.on('test_event', seen.append)
+    cluster_events.publish('test_event', {'id': 1})
+    assert seen == [{'id': 1}]
@@ -0,0 +1,58 @@
+"""کد ۷ رقمی کاربران: جایگشت Feistel یک شمارنده، رزرو بلوکی و تکرار روی برخورد"""
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+
+def new_user(name, code=None):
+    from models import User
+    return User(username=name, email=f'{name}@example.com', password_hash='x', code=code)
+
+
+def test_permutation_is_injective_and_in_range():
+    from codes import SPACE, permute
+
+    key = bytes(range(16))
+    values = list(range(20000)) + list(range(SPACE - 20000, SPACE))
+    codes = [permute(key, n) for n in values]
+    assert len(set(codes)) == len(codes)
+    assert all(0 <= code < SPACE for code in codes)
+    assert permute(key, 12345) == permute(key, 12345)
+    assert [permute(bytes(16), n) for n in range(10)] != codes[:10]
+
+
+def test_registered_users_get_distinct_codes(app, make_user):
+    users = [make_user() for _ in range(5)]
+    codes = [user.code for user in users]
+    assert len(set(codes)) == 5
+    assert all(len(code) == 7 and code.isdigit() for code in codes)
+
+
+def test_block_skips_codes_already_taken(app, ctx):
+    from codes import permute, user_codes
+    from models import db, CodeCounter
+
+    user_codes.discard()
+    counter = db.session.get(CodeCounter, 1)
+    taken = f'{permute(bytes.fromhex(counter.key), counter.next_value + 3):07d}'
+    db.session.add(new_user('legacy-code-holder', taken))
+    db.session.commit()
+    skipped = user_codes.stats['skipped']
+    block = user_codes._reserve(8)
+    assert len(block) == 7 and taken not in block
+    assert user_codes.stats['skipped'] == skipped + 1
+
+
+def test_add_user_retries_on_code_conflict(app, ctx, make_user, monkeypatch):
+    from codes import user_codes
+
+    existing = make_user()
+    fresh = user_codes.allocate()
+    # pop از انتها؛ اول کد گرفته‌شده برمی‌گردد
+    monkeypatch.setattr(user_codes, '_codes', [fresh, existing.code])
+    conflicts = user_codes.stats['conflicts']
+    user = user_codes.add_user(new_user('conflict-retry'))
+    assert user.code == fresh
+    assert user_codes.stats['conflicts'] == conflicts + 1
+
+    with pytest.raises(IntegrityError):
+        user_codes.add_user(new_user('conflict-retry'))
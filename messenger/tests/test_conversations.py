@@ -0,0 +1,73 @@
+"""جدول conversation: شمارنده‌های افزایشی، آخرین پیام و صندوق ورودی"""
+from datetime import datetime, timedelta
+
+
+def dms(sender, receiver, count, start):
+    from models import DirectMessage
+    return [DirectMessage(sender_id=sender.id, receiver_id=receiver.id, content=f'{sender.name} {i}',
+                          created_at=start + timedelta(seconds=i)) for i in range(count)]
+
+
+def conversation(a, b):
+    from models import Conversation, canonical_dm_key
+    return Conversation.query.filter_by(key=canonical_dm_key(a.id, b.id)).one()
+
+
+def test_counters_follow_batches(app, make_user, write_messages):
+    user, friend = make_user(), make_user()
+    start = datetime.utcnow()
+    write_messages(dms(user, friend, 3, start))
+    ids = write_messages(dms(friend, user, 2, start + timedelta(minutes=1)) + dms(user, friend, 1, start + timedelta(minutes=2)))
+    with app.app_context():
+        conv = conversation(user, friend)
+        assert (conv.sent_by(user.id), conv.sent_by(friend.id)) == (4, 2)
+        assert (conv.unread_for(user.id), conv.unread_for(friend.id)) == (2, 4)
+        assert conv.last_message_id == ids[-1]
+        assert conv.last_seq == 6
+
+
+def test_mark_read_decrements_unread(app, make_user, write_messages):
+    from models import db, DirectMessage
+
+    user, friend = make_user(), make_user()
+    write_messages(dms(friend, user, 5, datetime.utcnow()))
+    with app.app_context():
+        conv = conversation(user, friend)
+        assert conv.mark_read(user.id, 3) == 3
+        db.session.commit()
+        conv = conversation(user, friend)
+        assert (conv.unread_for(user.id), conv.read_seq_for(user.id)) == (2, 3)
+        # گزارش قدیمی‌تر یا تکراری چیزی را تغییر نمی‌دهد
+        assert conv.mark_read(user.id, 2) is None
+        assert conv.mark_read(user.id, 99) == 5
+        db.session.commit()
+        assert conversation(user, friend).unread_for(user.id) == 0
+        assert DirectMessage.query.filter_by(receiver_id=user.id, is_read=False).count() == 0
+
+
+def test_inbox_page_orders_by_activity(app, make_user, write_messages):
+    from models import Conversation
+
+    user = make_user()
+    friends = [make_user() for _ in range(3)]
+    start = datetime.utcnow()
+    for i, friend in enumerate(friends):
+        write_messages(dms(friend, user, i + 1, start + timedelta(minutes=i)))
+    write_messages(dms(user, friends[0], 1, start + timedelta(minutes=5)))
+    with app.app_context():
+        rows, has_more = Conversation.inbox_page(user.id, 1, 2)
+        assert [row.username for row in rows] == [friends[0].name, friends[2].name]
+        assert [row.unread for row in rows] == [1, 3]
+        assert rows[0].last_sender_id == user.id
+        assert has_more
+        rows, has_more = Conversation.inbox_page(user.id, 2, 2)
+        assert [row.username for row in rows] == [friends[1].name] and not has_more
+        assert Conversation.totals_for(user.id) == (1, 6)
+
+
+def test_my_messages_page(app, make_user, write_messages):
+    user, friend = make_user(), make_user()
+    write_messages(dms(friend, user, 2, datetime.utcnow()))
+    page = user.http.get('/my_messages')
+    assert page.status_code == 200
+    assert friend.name in page.get_data(as_text=True)
@@ -0,0 +1,165 @@
+"""پخش اتاق با fanout روشن: پنجره ارسال هر اتصال و گزارش پخش‌های دورریخته"""
+import pytest
+from engineio.socket import Socket
+from socketio import packet
+
+from conftest import wait_for, received
+
+
+@pytest.fixture
+def members(app, monkeypatch):
+    """اعضای اتاق با شیء Socket واقعی engineio؛ بسته‌ها در صف خروجی همان Socket می‌مانند"""
+    from app import socketio
+    from fanout import fanout
+
+    server = socketio.server
+    monkeypatch.setattr(fanout, 'enabled', True)
+    # test client ارسال را برای همه اتصال‌ها جایگزین می‌کند؛ اعضا مسیر واقعی engineio را می‌گیرند
+    mock_send = server._send_eio_packet
+
+    def send_eio_packet(eio_sid, pkt):
+        socket = server.eio.sockets.get(eio_sid)
+        if socket is None:
+            return mock_send(eio_sid, pkt)
+        socket.send(pkt)
+    monkeypatch.setattr(server, '_send_eio_packet', send_eio_packet)
+
+    created = []
+
+    def add(room, count):
+        sids = []
+        for _ in range(count):
+            eio_sid = f'member-{len(created)}'
+            socket = Socket(server.eio, eio_sid)
+            socket.connected = True
+            server.eio.sockets[eio_sid] = socket
+            sid = server.manager.connect(eio_sid, '/')
+            server.manager.enter_room(sid, '/', room)
+            created.append((eio_sid, sid))
+            sids.append((sid, socket))
+        return sids
+    yield add
+    for eio_sid, sid in created:
+        server.eio.sockets.pop(eio_sid, None)
+        if server.manager.is_connected(sid, '/'):
+            server.manager.disconnect(sid, '/')
+        fanout.forget(sid)
+
+
+def events(socket):
+    """رویدادهای Socket.IO در صف خروجی یک Socket؛ صف خالی می‌شود"""
+    found = []
+    while socket.queue.qsize():
+        pkt = socket.queue.get()
+        decoded = packet.Packet(encoded_packet=pkt.data)
+        if decoded.packet_type == packet.EVENT:
+            found.append(tuple(decoded.data))
+    return found
+
+
+def settle():
+    from fanout import fanout
+    wait_for(lambda: not fanout._rooms)
+
+
+def test_broadcast_reaches_every_member(app, room, members):
+    from fanout import fanout
+
+    sockets = members(room, 3)
+    assert fanout.emit('message', {'msg': 'hi'}, room)
+    settle()
+    for _, socket in sockets:
+        assert events(socket) == [('message', {'msg': 'hi'})]
+
+
+def test_message_event_goes_through_fanout(app, room, members, make_user, connect, drain):
+    [(_, socket)] = members(room, 1)
+    client = connect(make_user())
+    client.emit('join', {'room': room})
+    assert client.emit('message', {'room': room, 'msg': 'hello'}, callback=True) == {'ok': True}
+    drain()
+    settle()
+    (name, live), (saved_name, saved) = events(socket)
+    assert (name, live['msg'], 'seq' in live) == ('message', 'hello', False)
+    assert saved_name == 'message_saved'
+    assert saved['key'] == live['key'] and saved['seq'] == 1
+
+
+@pytest.mark.parametrize('policy', ['drop', 'disconnect'])
+def test_slow_consumer_window(app, room, members, monkeypatch, policy):
+    from app import socketio
+    from fanout import fanout
+
+    monkeypatch.setitem(app.config, 'FANOUT_CLIENT_QUEUE_MAX', 4)
+    monkeypatch.setitem(app.config, 'FANOUT_PROBE_EVERY', 2)
+    monkeypatch.setitem(app.config, 'FANOUT_SLOW_POLICY', policy)
+    (fast_sid, fast), (slow_sid, slow), (_, legacy) = members(room, 3)
+    # دو عضو اول پنجره را فعال می‌کنند؛ عضو سوم هرگز ack نمی‌فرستد و محدود نمی‌شود
+    fanout.ack(fast_sid, 0)
+    fanout.ack(slow_sid, 0)
+    stats = dict(fanout.stats)
+
+    fast_messages = 0
+    for i in range(10):
+        fanout.emit('message', {'n': i}, room)
+        settle()
+        for name, *args in events(fast):
+            if name == 'fanout_probe':
+                fanout.ack(fast_sid, args[0])
+            else:
+                fast_messages += 1
+
+    assert fast_messages == 10
+    assert len([e for e in events(legacy) if e[0] == 'message']) == 10
+    slow_events = events(slow)
+    assert [e[0] for e in slow_events].count('message') == 4
+    assert ('fanout_probe', 2) in slow_events and ('fanout_probe', 4) in slow_events
+    if policy == 'drop':
+        assert fanout.stats['dropped'] - stats['dropped'] == 6
+        assert socketio.server.manager.is_connected(slow_sid, '/')
+    else:
+        assert fanout.stats['disconnected'] - stats['disconnected'] >= 1
+        assert not socketio.server.manager.is_connected(slow_sid, '/')
+
+
+def test_ack_reopens_window(app, room, members, monkeypatch):
+    from fanout import fanout
+
+    monkeypatch.setitem(app.config, 'FANOUT_CLIENT_QUEUE_MAX', 2)
+    monkeypatch.setitem(app.config, 'FANOUT_PROBE_EVERY', 1)
+    monkeypatch.setitem(app.config, 'FANOUT_SLOW_POLICY', 'drop')
+    [(sid, socket)] = members(room, 1)
+    fanout.ack(sid, 0)
+    for i in range(3):
+        fanout.emit('message', {'n': i}, room)
+        settle()
+    assert [e[1] for e in events(socket) if e[0] == 'message'] == [{'n': 0}, {'n': 1}]
+    fanout.ack(sid, 2)
+    fanout.emit('message', {'n': 3}, room)
+    settle()
+    assert [e[1] for e in events(socket) if e[0] == 'message'] == [{'n': 3}]
+
+
+def test_full_room_queue_is_reported_in_ack(app, room, make_user, connect, monkeypatch):
+    from fanout import fanout
+
+    user = make_user()
+    client = connect(user)
+    client.emit('join', {'room': room})
+    monkeypatch.setattr(fanout, 'emit', lambda *args, **kwargs: False)
+    ack = client.emit('message', {'room': room, 'msg': 'hi'}, callback=True)
+    assert ack == {'ok': True, 'broadcast': False}
+
+
+def test_dropped_broadcast_after_commit_notifies_sender(app, room, make_user, connect, drain, monkeypatch):
+    from fanout import fanout
+
+    monkeypatch.setitem(app.config, 'MESSAGE_BROADCAST_AFTER_COMMIT', True)
+    user = make_user()
+    client = connect(user)
+    client.emit('join', {'room': room})
+    client.get_received()
+    monkeypatch.setattr(fanout, 'emit', lambda *args, **kwargs: False)
+    assert client.emit('message', {'room': room, 'msg': 'hi'}, callback=True) == {'ok': True}
+    drain()
+    assert received(client, 'broadcast_dropped') == [('broadcast_dropped', {'room': room})]
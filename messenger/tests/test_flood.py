@@ -0,0 +1,100 @@
+"""محدودیت نرخ پیام‌های سوکت برای هر اتصال، کاربر و اتاق و قطع اتصال‌های سیل‌آسا"""
+import time
+
+import pytest
+
+from conftest import received
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    """bucketهای تازه به جای محدودیت‌های باز conftest؛ نرخ ۰ یعنی بدون پر شدن در طول آزمون"""
+    from flood import flood
+    from ratelimit import RateLimiter
+
+    def set_limits(connection=1e9, user=1e9, room=1e9, strikes=1e9):
+        monkeypatch.setattr(flood, 'connections', RateLimiter(0, connection))
+        monkeypatch.setattr(flood, 'users', RateLimiter(0, user))
+        monkeypatch.setattr(flood, 'rooms', RateLimiter(0, room))
+        monkeypatch.setattr(flood, 'strikes', RateLimiter(0, strikes))
+    return set_limits
+
+
+def send(client, room, msg='hi'):
+    return client.emit('message', {'room': room, 'msg': msg}, callback=True)
+
+
+def joined(connect, user, room):
+    client = connect(user)
+    client.emit('join', {'room': room})
+    client.get_received()
+    return client
+
+
+def test_token_bucket_refills():
+    from ratelimit import RateLimiter
+
+    limiter = RateLimiter(rate=100, burst=2)
+    assert [limiter.allow('k') for _ in range(3)] == [True, True, False]
+    assert 0 < limiter.retry_after('k') <= 0.01
+    time.sleep(0.02)
+    assert limiter.allow('k')
+    assert limiter.allow('other')
+    small = RateLimiter(rate=1, burst=1, max_keys=2)
+    for key in 'abc':
+        small.allow(key)
+    assert small.allow('a')
+
+
+def test_connection_bucket(app, room, make_user, connect, drain, limits):
+    limits(connection=2)
+    client = joined(connect, make_user(), room)
+    acks = [send(client, room) for _ in range(3)]
+    assert [ack['ok'] for ack in acks] == [True, True, False]
+    assert acks[2]['error'] == 'rate_limited'
+    [(_, event)] = received(client, 'rate_limited')
+    assert event['error'] == 'rate_limited'
+    drain()
+
+
+def test_user_bucket_spans_connections(app, room, make_user, connect, drain, limits):
+    limits(user=2)
+    user = make_user()
+    first, second = joined(connect, user, room), joined(connect, user, room)
+    assert send(first, room)['ok'] and send(second, room)['ok']
+    assert send(first, room)['error'] == 'rate_limited'
+    # کاربر دیگر bucket خودش را دارد
+    assert send(joined(connect, make_user(), room), room)['ok']
+    drain()
+
+
+def test_room_bucket_is_shared_by_senders(app, room, make_user, connect, drain, limits):
+    limits(room=2)
+    clients = [joined(connect, make_user(), room) for _ in range(3)]
+    assert [send(client, room)['ok'] for client in clients] == [True, True, False]
+    drain()
+
+
+def test_oversized_message(app, room, make_user, connect, limits, monkeypatch):
+    from flood import flood
+
+    limits()
+    monkeypatch.setitem(app.config, 'MESSAGE_MAX_LENGTH', 10)
+    client = joined(connect, make_user(), room)
+    oversized = flood.stats['oversized']
+    ack = send(client, room, 'x' * 11)
+    assert ack == {'ok': False, 'error': 'too_large', 'retry_after': None}
+    assert flood.stats['oversized'] == oversized + 1
+
+
+def test_repeated_strikes_disconnect(app, room, make_user, connect, limits):
+    from flood import flood
+
+    limits(connection=0, strikes=2)
+    client = joined(connect, make_user(), room)
+    disconnected = flood.stats['disconnected']
+    acks = [send(client, room) for _ in range(2)]
+    assert [ack['error'] for ack in acks] == ['rate_limited', 'rate_limited']
+    assert send(client, room) == {'ok': False, 'error': 'disconnected'}
+    assert not client.is_connected()
+    assert flood.stats['disconnected'] == disconnected + 1
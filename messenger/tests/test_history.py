@@ -0,0 +1,81 @@
+"""تاریخچه keyset روی (created_at, id) و ادغام آن با تکه‌های بایگانی"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+
+def walk(http, url, limit):
+    """همه صفحه‌های تاریخچه از جدید به قدیم؛ خروجی شناسه‌ها از قدیم به جدید"""
+    ids, before = [], None
+    while True:
+        query = f'?limit={limit}' + (f'&before_id={before}' if before else '')
+        page = http.get(url + query).get_json()
+        ids = [m['id'] for m in page['messages']] + ids
+        before = page['next_before_id']
+        if before is None:
+            return ids
+
+
+def room_messages(room_id, user_id, count, start, step=timedelta(minutes=1)):
+    from models import Message
+    # هر دو پیام created_at یکسان دارند تا ترتیب id در کلید آزموده شود
+    return [Message(room_id=room_id, user_id=user_id, content=f'm{i}',
+                    created_at=start + step * (i // 2)) for i in range(count)]
+
+
+def test_room_history_keyset_pages(app, room, room_id, make_user, write_messages):
+    user = make_user()
+    ids = write_messages(room_messages(room_id, user.id, 23, datetime.utcnow() - timedelta(hours=1)))
+    assert walk(user.http, f'/r/{room}/history', 5) == ids
+    page = user.http.get(f'/r/{room}/history?limit=5').get_json()
+    assert [m['id'] for m in page['messages']] == ids[-5:]
+    assert page['next_before_id'] == ids[-5]
+
+
+def test_dm_history_keyset_pages(app, make_user, write_messages):
+    from models import DirectMessage
+
+    user, friend = make_user(), make_user()
+    start = datetime.utcnow() - timedelta(hours=1)
+    ids = write_messages([
+        DirectMessage(sender_id=(user, friend)[i % 2].id, receiver_id=(friend, user)[i % 2].id,
+                      content=f'd{i}', created_at=start + timedelta(minutes=i // 3))
+        for i in range(11)])
+    assert walk(user.http, f'/dm/{friend.code}/history', 4) == ids
+    assert walk(friend.http, f'/dm/{user.code}/history', 4) == ids
+
+
+def test_unknown_cursor_is_404(app, room, make_user):
+    user = make_user()
+    assert user.http.get(f'/r/{room}/history?before_id=999999').status_code == 404
+
+
+def test_history_merges_archived_segments(app, room, room_id, make_user, write_messages):
+    from archive import archiver
+    from models import Message
+
+    user = make_user()
+    old = room_messages(room_id, user.id, 30, datetime.utcnow() - timedelta(days=400), timedelta(days=1))
+    recent = room_messages(room_id, user.id, 7, datetime.utcnow() - timedelta(hours=1))
+    ids = write_messages(old + recent)
+    before = walk(user.http, f'/r/{room}/history', 6)
+    assert before == ids
+
+    with app.app_context():
+        report = archiver.run(days=180)
+        assert report['rows'] >= 30
+        assert Message.query.filter_by(room_id=room_id).count() == 7
+    assert walk(user.http, f'/r/{room}/history', 6) == ids
+    # مکان‌نمای یک پیام بایگانی‌شده
+    page = user.http.get(f'/r/{room}/history?limit=3&before_id={ids[10]}').get_json()
+    assert [m['id'] for m in page['messages']] == ids[7:10]
+
+
+def test_history_query_uses_composite_index(app, ctx, room_id):
+    from models import db
+
+    plan = ' '.join(str(row[-1]) for row in db.session.execute(text(
+        'EXPLAIN QUERY PLAN SELECT id FROM message WHERE room_id = :room '
+        'ORDER BY created_at DESC, id DESC LIMIT 51'), {'room': room_id}))
+    assert 'ix_message_room_created' in plan
+    assert 'TEMP B-TREE' not in plan
@@ -0,0 +1,68 @@
+"""اندازه‌گیری مسیرها و رویدادهای سوکت و خروجی Prometheus در /admin/metrics"""
+import logging
+
+
+def sample(text, family, **labels):
+    """مقدار یک نمونه در خروجی Prometheus یا None"""
+    wanted = family + ('{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}' if labels else '')
+    for line in text.splitlines():
+        if line.startswith(wanted + ' '):
+            return float(line.rsplit(' ', 1)[1])
+    return None
+
+
+def test_endpoint_needs_token_or_admin(app, make_user, monkeypatch):
+    from cache import lookup_cache
+    from models import db, User
+
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', 'scrape-token')
+    user = make_user()
+    assert user.http.get('/admin/metrics').status_code == 403
+    assert app.test_client().get('/admin/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    response = app.test_client().get('/admin/metrics', headers={'Authorization': 'Bearer scrape-token'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    with app.app_context():
+        admin = db.session.get(User, user.id)
+        admin.is_admin = True
+        db.session.commit()
+        lookup_cache.invalidate_user(admin)
+    assert user.http.get('/admin/metrics').status_code == 200
+
+
+def test_http_requests_are_counted(app, make_user):
+    from metrics import metrics
+
+    user = make_user()
+    before = sample(metrics.render(), 'messenger_handler_calls_total', kind='http', name='chat_dashboard') or 0
+    for _ in range(3):
+        assert user.http.get('/dashboard').status_code == 200
+    text = metrics.render()
+    assert sample(text, 'messenger_handler_calls_total', kind='http', name='chat_dashboard') == before + 3
+    assert sample(text, 'messenger_http_responses_total', name='chat_dashboard', status=200) >= 3
+    assert sample(text, 'messenger_handler_sql_statements_total', kind='http', name='chat_dashboard') > 0
+    assert sample(text, 'messenger_handler_duration_seconds_count', kind='http', name='chat_dashboard') == before + 3
+    assert sample(text, 'messenger_writer_backlog') is not None
+
+
+def test_socket_events_are_counted(app, room, make_user, connect):
+    from metrics import metrics
+
+    before = sample(metrics.render(), 'messenger_handler_calls_total', kind='socket', name='join') or 0
+    client = connect(make_user())
+    client.emit('join', {'room': room})
+    assert sample(metrics.render(), 'messenger_handler_calls_total', kind='socket', name='join') == before + 1
+
+
+def test_repeated_select_is_reported_once(app, caplog):
+    from metrics import metrics, _Unit
+
+    def run():
+        unit = _Unit('http', 'nplusone_test')
+        unit.selects['SELECT * FROM user WHERE id = ?'] = metrics.nplusone_threshold
+        metrics._finish(unit)
+    with caplog.at_level(logging.WARNING, logger='metrics'):
+        run()
+        run()
+    assert sum('possible N+1' in record.message for record in caplog.records) == 1
+    assert sample(metrics.render(), 'messenger_handler_nplusone_total', kind='http', name='nplusone_test') == 2
@@ -0,0 +1,77 @@
+"""ساخت تنبل برنامه و مهاجرت‌های جدا از import"""
+import os
+import subprocess
+import sys
+import textwrap
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from conftest import HERE
+
+FRESH_START = textwrap.dedent('''
+    import os, sys
+    path = sys.argv[1]
+    import app
+    assert app._app is None, 'import built the app'
+    flask_app = app.get_app()
+    assert app.app is flask_app
+    assert not os.path.exists(path), 'create_app touched the database'
+
+    from migrations import MIGRATIONS, upgrade, seed_defaults
+    with flask_app.app_context():
+        assert upgrade() == sorted(version for version, _ in MIGRATIONS)
+        assert upgrade() == []
+        assert seed_defaults() == ['rooms', 'admin']
+        assert seed_defaults() == []
+    print('ok')
+''')
+
+
+def test_fresh_database_is_built_by_migrate_not_import(tmp_path):
+    path = str(tmp_path / 'fresh.db')
+    env = dict(os.environ,
+               MESSENGER_SQLALCHEMY_DATABASE_URI=f'sqlite:///{path}',
+               MESSENGER_ARCHIVE_DIR=str(tmp_path / 'archive'),
+               MESSENGER_ATTACHMENTS_DIR=str(tmp_path / 'attachments'),
+               MESSENGER_ASSETS_OUTPUT=str(tmp_path / 'assets'))
+    result = subprocess.run([sys.executable, '-c', FRESH_START, path], cwd=HERE, env=env,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == 'ok'
+
+
+def test_schema_version_records_every_migration(app, ctx):
+    from migrations import MIGRATIONS
+    from models import db
+
+    versions = [row[0] for row in db.session.execute(text('SELECT version FROM schema_version ORDER BY version'))]
+    assert versions == sorted(version for version, _ in MIGRATIONS)
+
+
+def test_cli_commands_are_idempotent(app):
+    from migrations import migrate_command, seed_command
+
+    runner = app.test_cli_runner()
+    assert runner.invoke(migrate_command).output.strip() == 'schema is up to date'
+    assert runner.invoke(seed_command).output.strip() == 'nothing to seed'
+
+
+def test_sequence_migration_numbers_legacy_rows(app, room_id, make_user, write_messages):
+    """ردیف‌های پیش از مهاجرت ۵ به ترتیب (created_at, id) شماره می‌گیرند"""
+    from migrations import message_sequences
+    from models import db, Message, Room
+
+    user = make_user()
+    start = datetime.utcnow()
+    # شناسه بزرگ‌تر زمان کوچک‌تر دارد تا ترتیب created_at آزموده شود
+    ids = write_messages([Message(room_id=room_id, user_id=user.id, content=str(i),
+                                  created_at=start - timedelta(minutes=i)) for i in range(3)])
+    with app.app_context():
+        db.session.execute(db.update(Message).where(Message.room_id == room_id).values(seq=None))
+        db.session.execute(db.update(Room).where(Room.id == room_id).values(last_seq=0))
+        db.session.commit()
+        message_sequences()
+        seqs = dict(db.session.query(Message.id, Message.seq).filter(Message.room_id == room_id))
+        assert [seqs[i] for i in ids] == [3, 2, 1]
+        assert db.session.get(Room, room_id).last_seq == 3
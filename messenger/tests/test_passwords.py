@@ -0,0 +1,93 @@
+"""استخر جدای bcrypt، رد کار در شلوغی و محدودیت تلاش ورود"""
+import threading
+
+import pytest
+from flask import Flask
+
+
+def login(user, password='secret123', addr='10.0.0.1'):
+    return user.http.post('/login', data={'code_or_username': user.name, 'password': password},
+                          environ_base={'REMOTE_ADDR': addr})
+
+
+def hasher(**config):
+    from utils import PasswordHasher
+
+    app = Flask(__name__)
+    app.config.update(BCRYPT_LOG_ROUNDS=4, **config)
+    return PasswordHasher(app)
+
+
+def test_hash_and_check_long_password():
+    passwords = hasher()
+    raw = 'پ' * 100
+    hashed = passwords.hash(raw)
+    assert passwords.check(hashed, raw)
+    assert not passwords.check(hashed, 'wrong')
+    assert not passwords.check('not a hash', raw)
+    assert not passwords.needs_rehash(hashed)
+
+
+def test_full_pool_raises_busy():
+    from utils import PasswordPoolBusy
+
+    passwords = hasher(PASSWORD_POOL_SIZE=1, PASSWORD_QUEUE_MAX=0, PASSWORD_QUEUE_TIMEOUT=0.01)
+    entered, release = threading.Event(), threading.Event()
+
+    def slow():
+        entered.set()
+        release.wait(5)
+    worker = threading.Thread(target=passwords._run, args=(slow,))
+    worker.start()
+    assert entered.wait(5)
+    with pytest.raises(PasswordPoolBusy):
+        passwords.hash('secret123')
+    release.set()
+    worker.join(5)
+    assert passwords.check(passwords.hash('secret123'), 'secret123')
+
+
+def test_login_rehashes_with_new_rounds(app, make_user, monkeypatch):
+    from models import db, User
+    from utils import passwords, hash_rounds
+
+    user = make_user()
+    user.http.get('/logout')
+    monkeypatch.setattr(passwords, 'rounds', 5)
+    assert login(user, addr='10.0.1.1').status_code == 302
+    with app.app_context():
+        assert hash_rounds(db.session.get(User, user.id).password_hash) == 5
+
+
+def test_busy_pool_is_503(app, make_user, monkeypatch):
+    import app as app_module
+    from utils import PasswordPoolBusy
+
+    def busy(*args):
+        raise PasswordPoolBusy()
+    monkeypatch.setattr(app_module, 'check_password', busy)
+    user = make_user()
+    user.http.get('/logout')
+    assert login(user, addr='10.0.2.1').status_code == 503
+
+
+def test_login_attempts_are_limited_per_ident(app, make_user):
+    user = make_user()
+    user.http.get('/logout')
+    burst = app.config['LOGIN_IDENT_BURST']
+    # هر تلاش از IP دیگری تا فقط محدودیت شناسه آزموده شود
+    statuses = [login(user, 'wrong-password', addr=f'10.0.3.{i}').status_code for i in range(burst + 1)]
+    assert statuses == [200] * burst + [429]
+    # شناسه دیگر همچنان وارد می‌شود
+    other = make_user()
+    other.http.get('/logout')
+    assert login(other, addr='10.0.3.100').status_code == 302
+
+
+def test_login_attempts_are_limited_per_ip(app, make_user):
+    burst = app.config['LOGIN_IP_BURST']
+    users = [make_user() for _ in range(burst + 1)]
+    for user in users:
+        user.http.get('/logout')
+    statuses = [login(user, 'wrong-password', addr='10.0.4.1').status_code for user in users]
+    assert statuses == [200] * burst + [429]
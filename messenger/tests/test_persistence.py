@@ -0,0 +1,145 @@
+"""نویسنده write-behind پیام‌ها: commit دسته‌ای، تکرار روی قفل و جدا کردن ردیف خراب"""
+import sqlite3
+import threading
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from conftest import received
+
+
+def locked():
+    return OperationalError('INSERT', {}, sqlite3.OperationalError('database is locked'))
+
+
+def message(room_id, user_id, content='hi'):
+    from models import Message
+    return Message(room_id=room_id, user_id=user_id, content=content)
+
+
+def test_submit_resolves_with_id_and_seq(app, room_id, make_user):
+    from persistence import message_writer
+
+    user = make_user()
+    committed = []
+    with app.app_context():
+        first = message_writer.submit(message(room_id, user.id), on_commit=committed.append)
+        second = message_writer.submit(message(room_id, user.id), on_commit=committed.append)
+    assert first.wait(5) and second.wait(5)
+    assert (first.seq, second.seq) == (1, 2)
+    assert first.id < second.id
+    assert committed == [first, second]
+
+
+def test_bad_row_is_isolated_from_batch(app, room_id, make_user):
+    from models import Message
+    from persistence import PendingWrite, message_writer
+
+    user = make_user()
+    batch = [PendingWrite(message(room_id, user.id, 'a')),
+             PendingWrite(message(room_id, user.id, None)),
+             PendingWrite(message(room_id, user.id, 'c'))]
+    with app.app_context():
+        errors = message_writer._commit(batch)
+        assert errors[0] is None and errors[2] is None
+        assert errors[1] is not None
+        contents = [m.content for m in Message.query.filter_by(room_id=room_id).order_by(Message.seq)]
+    assert contents == ['a', 'c']
+    assert [p.seq for p in (batch[0], batch[2])] == [1, 2]
+
+
+def test_lock_is_retried(app, room_id, make_user, monkeypatch):
+    from persistence import PendingWrite, message_writer
+    from storage import lock_stats
+
+    monkeypatch.setitem(app.config, 'DB_LOCK_BACKOFF', 0)
+    write = message_writer._write
+    calls = []
+
+    def flaky(batch):
+        calls.append(len(batch))
+        if len(calls) == 1:
+            raise locked()
+        return write(batch)
+    monkeypatch.setattr(message_writer, '_write', flaky)
+    user = make_user()
+    retries = lock_stats['retries']
+    batch = [PendingWrite(message(room_id, user.id)) for _ in range(3)]
+    with app.app_context():
+        assert message_writer._commit(batch) == [None, None, None]
+    assert calls == [3, 3]
+    assert lock_stats['retries'] == retries + 1
+
+
+def test_lock_failure_is_not_split_into_rows(app, room_id, make_user, monkeypatch):
+    """قفل ماندگار کل دسته را رد می‌کند؛ تکرار تک‌تک ردیف‌ها هم به همان قفل می‌خورد"""
+    from persistence import PendingWrite, message_writer
+
+    monkeypatch.setitem(app.config, 'DB_LOCK_RETRIES', 1)
+    monkeypatch.setitem(app.config, 'DB_LOCK_BACKOFF', 0)
+    calls = []
+
+    def always_locked(batch):
+        calls.append(len(batch))
+        raise locked()
+    monkeypatch.setattr(message_writer, '_write', always_locked)
+    user = make_user()
+    batch = [PendingWrite(message(room_id, user.id)) for _ in range(3)]
+    with app.app_context():
+        errors = message_writer._commit(batch)
+    assert calls == [3, 3]
+    assert all(error is not None for error in errors)
+
+
+def test_full_queue_raises_backpressure(app, room_id, make_user, drain, monkeypatch):
+    from persistence import message_writer, WriteBackpressure
+
+    drain()
+    monkeypatch.setitem(app.config, 'MESSAGE_QUEUE_MAX', 1)
+    monkeypatch.setitem(app.config, 'MESSAGE_ENQUEUE_TIMEOUT', 0.01)
+    entered, release = threading.Event(), threading.Event()
+    commit = message_writer._commit_in_context
+
+    def blocked(batch):
+        entered.set()
+        release.wait(5)
+        return commit(batch)
+    monkeypatch.setattr(message_writer, '_commit_in_context', blocked)
+    user = make_user()
+    with app.app_context():
+        first = message_writer.submit(message(room_id, user.id))
+        # نخ نویسنده اولی را برمی‌دارد و پشت release می‌ماند؛ دومی صف را پر می‌کند
+        assert entered.wait(5)
+        second = message_writer.submit(message(room_id, user.id))
+        with pytest.raises(WriteBackpressure):
+            message_writer.submit(message(room_id, user.id))
+    release.set()
+    assert first.wait(5) and second.wait(5)
+    drain()
+
+
+def test_live_message_then_saved(app, room, make_user, connect, drain, direct_emit):
+    sender, member = make_user(), make_user()
+    sender_client, member_client = connect(sender), connect(member)
+    sender_client.emit('join', {'room': room})
+    member_client.emit('join', {'room': room})
+    member_client.get_received()
+    assert sender_client.emit('message', {'room': room, 'msg': 'hi'}, callback=True) == {'ok': True}
+    drain()
+    [(_, live), (_, saved)] = received(member_client, 'message', 'message_saved')
+    assert 'seq' not in live and live['msg'] == 'hi'
+    assert saved == {'key': live['key'], 'id': saved['id'], 'seq': 1}
+
+
+def test_broadcast_after_commit(app, room, make_user, connect, drain, direct_emit, monkeypatch):
+    monkeypatch.setitem(app.config, 'MESSAGE_BROADCAST_AFTER_COMMIT', True)
+    monkeypatch.setitem(app.config, 'MESSAGE_ACK_DURABLE', True)
+    user = make_user()
+    client = connect(user)
+    client.emit('join', {'room': room})
+    client.get_received()
+    ack = client.emit('message', {'room': room, 'msg': 'hi'}, callback=True)
+    assert ack['ok'] and ack['seq'] == 1
+    drain()
+    [(_, live)] = received(client, 'message', 'message_saved')
+    assert (live['id'], live['seq'], 'key' in live) == (ack['id'], 1, False)
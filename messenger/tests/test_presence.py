@@ -0,0 +1,117 @@
+"""حضور و در حال نوشتن: تفاضل خالص هر اتاق در هر flush و قطع نشست‌های بی‌صدا"""
+from types import SimpleNamespace
+
+import pytest
+
+
+class FakeSocketIO:
+    def __init__(self):
+        self.emitted = []
+        self.disconnected = []
+        self.server = SimpleNamespace(disconnect=self.disconnected.append)
+
+    def start_background_task(self, target):
+        pass
+
+    def emit(self, event, payload, to=None):
+        self.emitted.append((to, payload))
+
+    def take(self):
+        emitted, self.emitted[:] = list(self.emitted), []
+        return emitted
+
+
+@pytest.fixture
+def registry(app, monkeypatch):
+    from presence import PresenceRegistry
+
+    socketio = FakeSocketIO()
+    registry = PresenceRegistry(app, socketio)
+    monkeypatch.setitem(app.config, 'WORKER_ID', 'presence-test')
+    return registry, socketio
+
+
+def test_join_and_leave_are_coalesced(registry):
+    presence, socketio = registry
+    presence.connect('s1', 1, 'ali')
+    presence.connect('s2', 2, 'sara')
+    presence.join('s1', 'general')
+    presence.join('s2', 'general')
+    presence.flush()
+    [(room, diff)] = socketio.take()
+    assert room == 'general'
+    assert sorted(user['name'] for user in diff['joined']) == ['ali', 'sara']
+    assert diff['left'] == [] and diff['typing'] == []
+
+    # ورود و خروج بین دو flush چیزی نمی‌فرستد
+    presence.connect('s3', 3, 'reza')
+    presence.join('s3', 'general')
+    presence.leave('s3', 'general')
+    presence.flush()
+    assert socketio.take() == []
+
+    presence.disconnect('s2')
+    presence.flush()
+    assert socketio.take() == [('general', {'room': 'general', 'joined': [], 'left': [2], 'typing': []})]
+
+
+def test_second_session_keeps_user_online(registry):
+    presence, socketio = registry
+    presence.connect('a', 1, 'ali')
+    presence.connect('b', 1, 'ali')
+    presence.join('a', 'r')
+    presence.join('b', 'r')
+    presence.flush()
+    socketio.take()
+    presence.disconnect('a')
+    presence.flush()
+    assert socketio.take() == []
+    assert presence.snapshot('r')['online'] == [{'id': 1, 'name': 'ali'}]
+
+
+def test_typing_needs_membership_and_expires(registry, app, monkeypatch):
+    presence, socketio = registry
+    presence.connect('s1', 1, 'ali')
+    presence.typing('s1', 'general')
+    presence.join('s1', 'general')
+    presence.flush()
+    socketio.take()
+
+    presence.typing('s1', 'general')
+    presence.typing('s1', 'general')
+    presence.flush()
+    assert [diff['typing'] for _, diff in socketio.take()] == [['ali']]
+    monkeypatch.setitem(app.config, 'TYPING_TIMEOUT', -1)
+    presence.typing('s1', 'general', False)
+    presence.typing('s1', 'general')
+    presence.flush()
+    assert [diff['typing'] for _, diff in socketio.take()] == [[]]
+
+
+def test_silent_sessions_are_disconnected(registry, app, monkeypatch):
+    presence, socketio = registry
+    presence.connect('quiet', 1, 'ali')
+    presence.join('quiet', 'general')
+    presence.flush()
+    socketio.take()
+    monkeypatch.setitem(app.config, 'PRESENCE_TIMEOUT', -1)
+    presence.flush()
+    assert socketio.disconnected == ['quiet']
+    assert [diff['left'] for _, diff in socketio.take()] == [[1]]
+
+
+def test_online_users_from_presence_table(registry, app, make_user):
+    from presence import PresenceRegistry
+
+    presence, _ = registry
+    user, offline = make_user(), make_user()
+    presence.connect('s1', user.id, user.name)
+    presence.flush()
+    # پردازه دیگر فقط جدول user_presence را می‌بیند
+    other = PresenceRegistry(app, FakeSocketIO())
+    with app.app_context():
+        assert other.online_user_ids([user.id, offline.id]) == {user.id}
+    presence.disconnect('s1')
+    presence.flush()
+    with app.app_context():
+        assert other.online_user_ids([user.id, offline.id]) == set()
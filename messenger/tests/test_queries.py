@@ -0,0 +1,88 @@
+"""تعداد کوئری صفحه‌های فهرستی به تعداد ردیف‌ها بستگی ندارد (بدون N+1)"""
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import pytest
+from markupsafe import Markup
+from sqlalchemy import event
+
+
+@contextmanager
+def statements(app):
+    """فهرست SQLهای اجراشده در بلوک؛ فقط نخ جاری، نه نویسنده پیام‌ها و کارهای پس‌زمینه"""
+    from models import db
+
+    with app.app_context():
+        engine = db.engine
+    executed = []
+    thread = threading.get_ident()
+
+    def record(conn, cursor, statement, *args):
+        if threading.get_ident() == thread:
+            executed.append(statement)
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield executed
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def count(app, http, url):
+    with statements(app) as executed:
+        assert http.get(url).status_code == 200
+    return len(executed)
+
+
+def talk(user, friends, write_messages):
+    from models import DirectMessage
+    write_messages([DirectMessage(sender_id=friend.id, receiver_id=user.id, content='hi',
+                                  created_at=datetime.utcnow()) for friend in friends])
+
+
+@pytest.fixture
+def uncached_fragments(monkeypatch):
+    from cache import fragment_cache
+    monkeypatch.setattr(fragment_cache, 'render', lambda name, key, render: Markup(render()))
+
+
+@pytest.mark.parametrize('url', ['/my_messages', '/dashboard'])
+def test_inbox_queries_do_not_grow(app, make_user, write_messages, uncached_fragments, url):
+    user = make_user()
+    talk(user, [make_user() for _ in range(2)], write_messages)
+    user.http.get(url)
+    few = count(app, user.http, url)
+    talk(user, [make_user() for _ in range(6)], write_messages)
+    assert count(app, user.http, url) == few
+
+
+def test_room_page_queries_do_not_grow(app, room, room_id, make_user, write_messages):
+    from models import Message
+
+    viewer = make_user()
+    write_messages([Message(room_id=room_id, user_id=make_user().id, content='a')])
+    viewer.http.get(f'/r/{room}')
+    few = count(app, viewer.http, f'/r/{room}')
+    write_messages([Message(room_id=room_id, user_id=make_user().id, content='b') for _ in range(6)])
+    assert count(app, viewer.http, f'/r/{room}') == few
+
+
+def test_admin_list_is_projection_only(app, make_user):
+    from cache import lookup_cache
+    from metrics import metrics
+    from models import db, User
+
+    admin = make_user()
+    with app.app_context():
+        row = db.session.get(User, admin.id)
+        row.is_admin = True
+        db.session.commit()
+        lookup_cache.invalidate_user(row)
+    admin.http.get('/admin/users')
+    key = ('http', 'admin.users_list')
+    before = metrics._series[key].orm_objects
+    assert count(app, admin.http, '/admin/users') <= 2
+    # صفحه پر از کاربر است ولی جز کاربر واردشده هیچ شیء ORMی ساخته نمی‌شود
+    assert metrics._series[key].orm_objects - before <= 1
+    page = admin.http.get(f'/admin/users?q={admin.name}').get_data(as_text=True)
+    assert admin.name in page
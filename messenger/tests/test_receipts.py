@@ -0,0 +1,88 @@
+"""رسید خواندن: ادغام گزارش‌ها با بیشینه و نوشتن دسته‌ای بازه‌ای is_read"""
+import pytest
+
+from conftest import wait_for
+
+
+class FakeSocketIO:
+    def __init__(self):
+        self.emitted = []
+
+    def start_background_task(self, target):
+        pass
+
+    def emit(self, event, payload, to=None):
+        self.emitted.append((event, payload, to))
+
+
+@pytest.fixture
+def receipts(app):
+    from receipts import ReadReceipts
+    return ReadReceipts(app, FakeSocketIO())
+
+
+def conversation_with(make_user, write_messages, count):
+    from models import DirectMessage, canonical_dm_key
+
+    reader, friend = make_user(), make_user()
+    write_messages([DirectMessage(sender_id=friend.id, receiver_id=reader.id, content=f'd{i}')
+                    for i in range(count)])
+    return reader, friend, canonical_dm_key(reader.id, friend.id)
+
+
+def unread(app, reader):
+    from models import DirectMessage
+    with app.app_context():
+        return [m.seq for m in DirectMessage.query.filter_by(receiver_id=reader.id, is_read=False)
+                .order_by(DirectMessage.seq)]
+
+
+def test_reports_are_coalesced_to_the_highest_seq(app, receipts, make_user, write_messages):
+    reader, _, key = conversation_with(make_user, write_messages, 6)
+    for seq in (2, 4, 3):
+        receipts.report(key, reader.id, seq, 'dm-room')
+    assert receipts.stats['coalesced'] == 2
+    receipts.flush()
+    assert unread(app, reader) == [5, 6]
+    assert receipts.socketio.emitted == [('read', {'user_id': reader.id, 'seq': 4}, 'dm-room')]
+    assert (receipts.stats['flushes'], receipts.stats['advanced']) == (1, 1)
+
+    # گزارش قدیمی‌تر پس از نوشتن چیزی را جلو نمی‌برد و رویدادی نمی‌فرستد
+    receipts.report(key, reader.id, 3, 'dm-room')
+    receipts.flush()
+    assert len(receipts.socketio.emitted) == 1
+    receipts.flush()
+    assert receipts.stats['flushes'] == 2
+
+
+def test_one_flush_writes_many_conversations(app, receipts, make_user, write_messages):
+    first = conversation_with(make_user, write_messages, 3)
+    second = conversation_with(make_user, write_messages, 2)
+    receipts.report(first[2], first[0].id, 3, 'a')
+    receipts.report(second[2], second[0].id, 1, 'b')
+    receipts.flush()
+    assert (unread(app, first[0]), unread(app, second[0])) == ([], [2])
+    assert receipts.stats['flushes'] == 1
+
+
+def test_outsider_report_is_ignored(app, receipts, make_user, write_messages):
+    reader, friend, key = conversation_with(make_user, write_messages, 2)
+    stranger = make_user()
+    receipts.report(key, stranger.id, 2, 'dm-room')
+    receipts.flush()
+    assert unread(app, reader) == [1, 2]
+    assert receipts.socketio.emitted == []
+
+
+def test_read_event_end_to_end(app, make_user, connect, write_messages):
+    from receipts import receipts
+
+    reader, friend, _ = conversation_with(make_user, write_messages, 3)
+    client = connect(reader)
+    assert client.emit('read', {'friend_id': friend.id, 'seq': 2}, callback=True) == {'ok': True}
+    assert client.emit('read', {'friend_id': reader.id, 'seq': 2}, callback=True) == \
+        {'ok': False, 'error': 'not_found'}
+    assert client.emit('read', {'friend_id': friend.id, 'seq': 'x'}, callback=True) == \
+        {'ok': False, 'error': 'bad_request'}
+    # نخ پس‌زمینه هم ممکن است همزمان بنویسد
+    wait_for(lambda: receipts.flush() or unread(app, reader) == [3])
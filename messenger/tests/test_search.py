@@ -0,0 +1,96 @@
+"""جست‌وجوی متن کامل: نرمال‌سازی فارسی، هر دو backend و دسترسی به پیام‌های خصوصی"""
+import itertools
+
+import pytest
+
+_words = itertools.count(1)
+
+
+def word():
+    """واژه یکتا تا نتیجه‌ها به پیام‌های آزمون‌های دیگر وابسته نباشند"""
+    return f'zebra{next(_words)}x'
+
+
+@pytest.fixture(params=['fts5', 'memory'])
+def backend(request, app, monkeypatch):
+    from search import FTS5Backend, MemoryBackend, search_index
+
+    monkeypatch.setattr(search_index, '_backend', FTS5Backend() if request.param == 'fts5' else MemoryBackend())
+    return request.param
+
+
+def test_normalize_and_tokenize():
+    from search import normalize_text, tokenize
+
+    assert normalize_text('كتاب‌هاي ۱۲٣') == 'کتابهای 123'
+    assert normalize_text('مُحَمَّد') == 'محمد'
+    assert tokenize('Hello, دنیـــا!') == ['hello', 'دنیا']
+
+
+def test_snippet_marks_prefix_matches():
+    from search import make_snippet
+
+    snippet = make_snippet('<b>سلام</b> كتاب‌ها', ['کتابها'])
+    assert str(snippet) == '&lt;b&gt;سلام&lt;/b&gt; <mark>كتاب‌ها</mark>'
+    long = make_snippet('x ' * 200 + 'needle', ['need'], width=40)
+    assert str(long).startswith('…') and '<mark>needle</mark>' in long
+
+
+def test_room_and_prefix_search(app, backend, room_id, make_user, write_messages):
+    from models import Message
+    from search import search_index
+
+    user = make_user()
+    term = word()
+    write_messages([Message(room_id=room_id, user_id=user.id, content=f'{term} {term}s {term}'),
+                    Message(room_id=room_id, user_id=user.id, content=f'other {term}s'),
+                    Message(room_id=room_id, user_id=user.id, content='unrelated')])
+    with app.app_context():
+        hits, has_more = search_index.search(user.id, term)
+        assert [hit.message.content for hit in hits] == [f'{term} {term}s {term}', f'other {term}s']
+        assert not has_more
+        assert hits[0].kind == 'room' and hits[0].message.room.id == room_id
+        hits, _ = search_index.search(user.id, f'other {term}', room_id=room_id)
+        assert len(hits) == 1
+        assert search_index.search(user.id, term, room_id=room_id + 10 ** 6) == ([], False)
+
+
+def test_search_pages(app, backend, room_id, make_user, write_messages, monkeypatch):
+    from models import Message
+    from search import search_index
+
+    monkeypatch.setitem(app.config, 'SEARCH_PAGE_SIZE', 2)
+    user = make_user()
+    term = word()
+    write_messages([Message(room_id=room_id, user_id=user.id, content=f'{term} {i}') for i in range(5)])
+    with app.app_context():
+        pages = [search_index.search(user.id, term, page) for page in (1, 2, 3)]
+    assert [(len(hits), more) for hits, more in pages] == [(2, True), (2, True), (1, False)]
+    assert len({hit.message.id for hits, _ in pages for hit in hits}) == 5
+
+
+def test_direct_messages_are_private(app, backend, make_user, write_messages):
+    from models import DirectMessage, canonical_dm_key
+    from search import search_index
+
+    user, friend, stranger = make_user(), make_user(), make_user()
+    term = word()
+    write_messages([DirectMessage(sender_id=user.id, receiver_id=friend.id, content=f'secret {term}')])
+    key = canonical_dm_key(user.id, friend.id)
+    with app.app_context():
+        for member in (user, friend):
+            hits, _ = search_index.search(member.id, term)
+            assert [(hit.kind, hit.message.sender.id) for hit in hits] == [('dm', user.id)]
+        assert search_index.search(stranger.id, term) == ([], False)
+        assert len(search_index.search(friend.id, term, conversation_key=key)[0]) == 1
+
+
+def test_search_page_hides_foreign_conversation(app, make_user, write_messages):
+    from models import DirectMessage
+
+    user, friend, stranger = make_user(), make_user(), make_user()
+    term = word()
+    write_messages([DirectMessage(sender_id=user.id, receiver_id=friend.id, content=f'secret {term}')])
+    assert 'secret' in friend.http.get(f'/search?q={term}').get_data(as_text=True)
+    page = stranger.http.get(f'/search?q={term}&with={friend.code}')
+    assert page.status_code == 200 and 'secret' not in page.get_data(as_text=True)
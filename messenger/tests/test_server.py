@@ -0,0 +1,51 @@
+"""ورودی سرور ناهمگام و استخرهای کارهای مسدودکننده"""
+import threading
+import time
+
+
+def test_parse_args_reads_environment(monkeypatch):
+    from server import parse_args
+
+    monkeypatch.setenv('MESSENGER_PORT', '6000')
+    monkeypatch.setenv('MESSENGER_SOCKETIO_ASYNC_MODE', 'eventlet')
+    args = parse_args([])
+    assert (args.port, args.async_mode, args.no_migrate) == (6000, 'eventlet', False)
+    args = parse_args(['--async-mode', 'gevent', '--no-migrate', '--host', '0.0.0.0'])
+    assert (args.host, args.async_mode, args.no_migrate) == ('0.0.0.0', 'gevent', True)
+
+
+def test_threading_mode_without_monkey_patch(app):
+    from app import socketio
+    from concurrency import async_mode, run_blocking
+
+    # آزمون‌ها بدون monkey patch اجرا می‌شوند؛ برنامه نباید gevent را خودکار برگزیند
+    assert async_mode() == 'threading'
+    assert socketio.server.eio.async_mode == 'threading'
+    assert run_blocking(threading.get_ident) == threading.get_ident()
+
+
+def test_blocking_pool_bounds_concurrency():
+    from concurrency import BlockingPool
+
+    pool = BlockingPool(2)
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def work():
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.02)
+        with lock:
+            active[0] -= 1
+        return threading.get_ident()
+
+    results = []
+    callers = [threading.Thread(target=lambda: results.append(pool.run(work))) for _ in range(6)]
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join(5)
+    assert len(results) == 6
+    assert peak[0] == 2
+    assert threading.get_ident() not in results
@@ -0,0 +1,87 @@
+"""پروفایل production برای SQLite: PRAGMAها، استخر اتصال و تکرار روی قفل"""
+import sqlite3
+
+import pytest
+from flask import Flask
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+
+def locked():
+    return OperationalError('UPDATE', {}, sqlite3.OperationalError('database is locked'))
+
+
+def test_production_pragmas_on_every_connection(app, ctx):
+    from models import db
+
+    with db.engine.connect() as conn:
+        pragma = lambda name: conn.execute(text(f'PRAGMA {name}')).scalar()
+        assert pragma('journal_mode') == 'wal'
+        assert pragma('synchronous') == 1
+        assert pragma('busy_timeout') == 5000
+        assert pragma('temp_store') == 2
+    assert db.engine.pool.size() == app.config['SQLITE_POOL_SIZE']
+
+
+def test_engine_options_follow_profile(tmp_path):
+    from storage import Storage
+
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'x.db'}",
+                      SQLITE_PRAGMAS={'busy_timeout': 250}, SQLITE_POOL_SIZE=3)
+    Storage(app)
+    options = app.config['SQLALCHEMY_ENGINE_OPTIONS']
+    assert options['connect_args'] == {'timeout': 0.25}
+    assert (options['pool_size'], options['max_overflow']) == (3, 3)
+
+    other = Flask(__name__)
+    other.config.update(SQLALCHEMY_DATABASE_URI='postgresql://localhost/x')
+    Storage(other)
+    assert other.config['SQLALCHEMY_ENGINE_OPTIONS'] == {'pool_pre_ping': True}
+
+    unknown = Flask(__name__)
+    unknown.config.update(SQLALCHEMY_DATABASE_URI='sqlite://', STORAGE_PROFILE='fast')
+    with pytest.raises(ValueError):
+        Storage(unknown)
+
+
+def test_retry_on_lock_repeats_unit_of_work(app, ctx, monkeypatch):
+    from storage import retry_on_lock, lock_stats
+
+    monkeypatch.setitem(app.config, 'DB_LOCK_BACKOFF', 0)
+    calls = []
+
+    def work():
+        calls.append(1)
+        if len(calls) < 3:
+            raise locked()
+        return 'done'
+    retries = lock_stats['retries']
+    assert retry_on_lock(work) == 'done'
+    assert len(calls) == 3
+    assert lock_stats['retries'] == retries + 2
+
+
+def test_retry_on_lock_gives_up(app, ctx, monkeypatch):
+    from storage import retry_on_lock, lock_stats
+
+    monkeypatch.setitem(app.config, 'DB_LOCK_RETRIES', 2)
+    monkeypatch.setitem(app.config, 'DB_LOCK_BACKOFF', 0)
+    calls = []
+
+    def work():
+        calls.append(1)
+        raise locked()
+    failures = lock_stats['failures']
+    with pytest.raises(OperationalError):
+        retry_on_lock(work)
+    assert len(calls) == 3
+    assert lock_stats['failures'] == failures + 1
+
+    def broken():
+        calls.append(1)
+        raise OperationalError('SELECT', {}, sqlite3.OperationalError('no such table: x'))
+    calls.clear()
+    with pytest.raises(OperationalError):
+        retry_on_lock(broken)
+    assert len(calls) == 1
@@ -0,0 +1,66 @@
+"""همگام‌سازی تفاضلی پس از اتصال دوباره: صفحه‌بندی روی seq و reset برای فاصله‌های جبران‌ناپذیر"""
+from datetime import datetime, timedelta
+
+
+def sync(client, **data):
+    return client.emit('sync', data, callback=True)
+
+
+def room_messages(room_id, user_id, count, days_ago=0):
+    from models import Message
+    start = datetime.utcnow() - timedelta(days=days_ago)
+    return [Message(room_id=room_id, user_id=user_id, content=f'm{i}',
+                    created_at=start + timedelta(seconds=i)) for i in range(count)]
+
+
+def test_room_sync_pages_by_seq(app, room, room_id, make_user, connect, write_messages, monkeypatch):
+    monkeypatch.setitem(app.config, 'SYNC_PAGE_SIZE', 4)
+    user = make_user()
+    write_messages(room_messages(room_id, user.id, 10))
+    client = connect(user)
+    seen, after = [], 3
+    while True:
+        page = sync(client, room=room, after=after)
+        assert page['ok']
+        seen += [m['seq'] for m in page['messages']]
+        after = page['last_seq']
+        if not page['has_more']:
+            break
+    assert seen == list(range(4, 11))
+    assert sync(client, room=room, after=10) == {'ok': True, 'messages': [], 'has_more': False, 'last_seq': 10}
+
+
+def test_dm_sync(app, make_user, connect, write_messages):
+    from models import DirectMessage
+
+    user, friend = make_user(), make_user()
+    write_messages([DirectMessage(sender_id=friend.id, receiver_id=user.id, content=f'd{i}') for i in range(3)])
+    client = connect(user)
+    page = sync(client, friend_id=friend.id, after=1)
+    assert [(m['seq'], m['from_code']) for m in page['messages']] == [(2, friend.code), (3, friend.code)]
+    assert sync(client, friend_id=user.id, after=0) == {'ok': False, 'error': 'not_found'}
+
+
+def test_reset_on_large_gap_or_future_seq(app, room, room_id, make_user, connect, write_messages, monkeypatch):
+    monkeypatch.setitem(app.config, 'SYNC_MAX_GAP', 5)
+    user = make_user()
+    write_messages(room_messages(room_id, user.id, 8))
+    client = connect(user)
+    assert sync(client, room=room, after=0) == {'ok': True, 'reset': True, 'last_seq': 8}
+    assert sync(client, room=room, after=20)['reset']
+    assert not sync(client, room=room, after=3).get('reset')
+    assert sync(client, room=room, after='x') == {'ok': False, 'error': 'bad_request'}
+    assert sync(client, room='no-such-room', after=0) == {'ok': False, 'error': 'not_found'}
+
+
+def test_reset_when_gap_was_archived(app, room, room_id, make_user, connect, write_messages):
+    from archive import archiver
+
+    user = make_user()
+    write_messages(room_messages(room_id, user.id, 4, days_ago=300))
+    write_messages(room_messages(room_id, user.id, 2))
+    with app.app_context():
+        archiver.run(days=180)
+    client = connect(user)
+    assert sync(client, room=room, after=2) == {'ok': True, 'reset': True, 'last_seq': 6}
+    assert [m['seq'] for m in sync(client, room=room, after=4)['messages']] == [5, 6]
@@ -1,14 +1,92 @@
-from flask_bcrypt import Bcrypt
+import threading
 
-bcrypt = Bcrypt()
+import bcrypt
+
+from concurrency import BlockingPool
+
+# bcrypt فقط ۷۲ بایت اول رمز را به کار می‌برد؛ bcrypt 5 برای ورودی بلندتر خطا می‌دهد
+BCRYPT_MAX_BYTES = 72
+
+class PasswordPoolBusy(Exception):
+    """صف استخر هش پر است و کار در مهلت تعیین‌شده پذیرفته نشد"""
+
+def _encode(raw_password):
+    return raw_password.encode('utf-8')[:BCRYPT_MAX_BYTES]
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode('utf-8')
+
+def _check(hashed_password, password):
+    try:
+        return bcrypt.checkpw(password, hashed_password.encode('utf-8'))
+    except ValueError:
+        return False
+
+def hash_rounds(hashed_password):
+    """هزینه ذخیره‌شده در هش bcrypt ($2b$12$...)"""
+    try:
+        return int(hashed_password.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+class PasswordHasher:
+    """اجرای bcrypt در یک استخر نخ جدا با اندازه محدود
+
+    هر هش ۱۰۰ تا ۳۰۰ میلی‌ثانیه CPU می‌گیرد. bcrypt هنگام هش GIL را آزاد
+    می‌کند، بنابراین PASSWORD_POOL_SIZE نخ واقعی به اندازه همان تعداد
+    پردازه موازی کار می‌کنند و حلقه رویداد و استخر مشترک run_blocking را
+    درگیر نمی‌کنند. حداکثر PASSWORD_POOL_SIZE + PASSWORD_QUEUE_MAX کار
+    پذیرفته می‌شود و بقیه پس از PASSWORD_QUEUE_TIMEOUT ثانیه با
+    PasswordPoolBusy رد می‌شوند.
+    """
+
+    def __init__(self, app=None):
+        self.rounds = 12
+        self.queue_timeout = None
+        self._slots = None
+        self._pool = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('BCRYPT_LOG_ROUNDS', 12)
+        app.config.setdefault('PASSWORD_POOL_SIZE', 2)
+        app.config.setdefault('PASSWORD_QUEUE_MAX', 32)
+        app.config.setdefault('PASSWORD_QUEUE_TIMEOUT', 2.0)
+        self.rounds = app.config['BCRYPT_LOG_ROUNDS']
+        self.queue_timeout = app.config['PASSWORD_QUEUE_TIMEOUT']
+        self._pool = BlockingPool(app.config['PASSWORD_POOL_SIZE'])
+        self._slots = threading.BoundedSemaphore(app.config['PASSWORD_POOL_SIZE'] + app.config['PASSWORD_QUEUE_MAX'])
+        app.extensions['passwords'] = self
+
+    def hash(self, raw_password):
+        return self._run(_hash, _encode(raw_password), self.rounds)
+
+    def check(self, hashed_password, raw_password):
+        return self._run(_check, hashed_password, _encode(raw_password))
+
+    def needs_rehash(self, hashed_password):
+        return hash_rounds(hashed_password) != self.rounds
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise PasswordPoolBusy()
+        try:
+            return self._pool.run(func, *args)
+        finally:
+            self._slots.release()
+
+passwords = PasswordHasher()
 
 def hash_password(raw_password):
     """هش کردن رمز عبور"""
-    return bcrypt.generate_password_hash(raw_password).decode('utf-8')
+    return passwords.hash(raw_password)
 
 def check_password(hashed_password, raw_password):
     """بررسی تطابق رمز عبور"""
     try:
-        return bcrypt.check_password_hash(hashed_password, raw_password)
+        return passwords.check(hashed_password, raw_password)
+    except PasswordPoolBusy:
+        raise
     except Exception:
-        return False
\ No newline at end of file
+        return False